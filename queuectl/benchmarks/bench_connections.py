@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Compare job lifecycle throughput of pooled storage connections against the
+old open-a-connection-per-call access pattern.
+Run from the queuectl directory: python benchmarks/bench_connections.py --jobs 2000
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src import storage
+
+INSERT_SQL = ("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+              "VALUES(?,?,?,?,?,?,?,?,?)")
+
+def _seed(n):
+    now = '2024-01-01T00:00:00Z'
+    storage.execute_many(INSERT_SQL, [(f"job-{i:08d}", 'true', 'pending', 0, 3, now, now, 0, 60) for i in range(n)])
+
+def _per_call_lifecycle(db_path):
+    """One claim + config read + completion, each on a fresh rollback-journal connection."""
+    def connect():
+        conn = sqlite3.connect(str(db_path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    now_ts = int(time.time())
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute("SELECT id FROM jobs WHERE state='pending' AND next_attempt<=? ORDER BY created_at LIMIT 1",
+                       (now_ts,)).fetchone()
+    if not row:
+        conn.commit()
+        conn.close()
+        return False
+    conn.execute("UPDATE jobs SET state='processing', attempts=attempts+1, updated_at=?, next_attempt=0 WHERE id=?",
+                 (now_ts, row['id']))
+    job = conn.execute("SELECT * FROM jobs WHERE id=?", (row['id'],)).fetchone()
+    conn.commit()
+    conn.close()
+    conn = connect()
+    conn.execute("SELECT value FROM meta WHERE key='job_timeout'").fetchone()
+    conn.close()
+    conn = connect()
+    conn.execute("UPDATE jobs SET state=?, updated_at=? WHERE id=?", ('completed', now_ts, job['id']))
+    conn.close()
+    return True
+
+def _pooled_lifecycle(db_path):
+    job = storage.atomic_claim_job()
+    if not job:
+        return False
+    storage.fetch_one("SELECT value FROM meta WHERE key='job_timeout'")
+    storage.execute("UPDATE jobs SET state=?, updated_at=? WHERE id=?", ('completed', int(time.time()), job['id']))
+    return True
+
+def run(mode, jobs, workdir):
+    db_path = Path(workdir) / f'{mode}.db'
+    storage.DB_PATH = db_path
+    storage.init_db()
+    _seed(jobs)
+    storage.close_pool()
+    if mode == 'per-call':
+        # the old code never enabled WAL, so measure it on a rollback journal
+        conn = sqlite3.connect(str(db_path))
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+    step = _per_call_lifecycle if mode == 'per-call' else _pooled_lifecycle
+    start = time.perf_counter()
+    done = 0
+    while step(db_path):
+        done += 1
+    elapsed = time.perf_counter() - start
+    storage.close_pool()
+    return done, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='queuectl connection pooling benchmark')
+    parser.add_argument('--jobs', type=int, default=2000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {}
+        for mode in ('per-call', 'pooled'):
+            done, elapsed = run(mode, args.jobs, workdir)
+            results[mode] = done / elapsed
+            print(f"{mode:>9}: {done} jobs in {elapsed:.2f}s -> {results[mode]:.0f} jobs/sec")
+        print(f"speedup: {results['pooled'] / results['per-call']:.1f}x")
+
+if __name__ == '__main__':
+    main()
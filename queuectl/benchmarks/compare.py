@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files written by suite.py.
+
+Prints every metric the two runs share with its change, and flags regressions beyond
+--threshold percent: lower throughput (*_per_sec), or higher latency, time or size.
+Exits 1 if any metric regressed, so it can gate CI.
+    python benchmarks/compare.py benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+import sys
+
+# leaves that are parameters or bookkeeping, not measurements
+_SKIP = {'jobs', 'seconds', 'count', 'status', 'workers', 'rate_per_sec', 'requests', 'dlq', 'claim_batch', 'completed',
+         'not_completed', 'runs'}
+
+def metrics(node, prefix=''):
+    """{'claim.by_workers.4.jobs_per_sec': 2767.1, ...} for the numeric leaves of a result tree."""
+    out = {}
+    for key, value in node.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            out.update(metrics(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in _SKIP:
+            out[path] = value
+    return out
+
+def higher_is_better(name):
+    return name.endswith('_per_sec')
+
+def main():
+    parser = argparse.ArgumentParser(description='compare two queuectl benchmark runs')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent change that counts as a regression')
+    args = parser.parse_args()
+    base, cand = (json.load(open(path)) for path in (args.baseline, args.candidate))
+    print(f"baseline {base['meta'].get('commit')} vs candidate {cand['meta'].get('commit')}")
+    a_params, b_params = base['meta'].get('params', {}), cand['meta'].get('params', {})
+    for key in sorted(a_params.keys() & b_params.keys()):
+        if a_params[key] != b_params[key] and key != 'only':
+            print(f"warning: runs used different --{key.replace('_', '-')} ({a_params[key]} vs {b_params[key]})")
+    old, new = metrics(base['results']), metrics(cand['results'])
+    regressions = 0
+    for name in sorted(old.keys() & new.keys()):
+        a, b = old[name], new[name]
+        if a == 0:
+            continue
+        change = (b - a) / a * 100
+        worse = -change if higher_is_better(name) else change
+        flag = ''
+        if worse > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif worse < -args.threshold:
+            flag = '  improved'
+        print(f"{name:<60} {a:>12g} -> {b:>12g}  {change:+7.1f}%{flag}")
+    print(f"{regressions} regression(s) beyond {args.threshold:g}%")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
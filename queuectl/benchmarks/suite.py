@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency benchmarks for the queue core, written as JSON so runs can be
+compared (see compare.py).
+
+Every scenario runs against a fresh queue.db in its own temporary directory:
+
+- enqueue_single   enqueue_from_input one job at a time (jobs/sec)
+- enqueue_bulk     enqueue --batch from a JSON Lines file (jobs/sec)
+- claim            claim + complete through storage by 1..N worker processes (jobs/sec per count)
+- shards           the same with a fixed number of processes over 1, 2, 4 shards routed by
+                   id, each process claiming from its home shard first (jobs/sec per count)
+- latency          a real master with workers running no-op jobs enqueued at a steady rate:
+                   enqueue -> start -> finish percentiles (ms)
+- db_size          queue.db bytes per job after enqueue, after completion, after retention
+- dashboard        API endpoint latency percentiles (ms) against a populated queue.db
+- startup          wall time of whole `queuectl` CLI invocations (ms), with a bare
+                   interpreter start for reference
+
+Run from the queuectl directory:
+    python benchmarks/suite.py                         # everything, default sizes
+    python benchmarks/suite.py --only claim latency --jobs 5000 --output before.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from src import storage, joblogs, notify, queue_manager, retention, shards, worker
+from src.models import Outcome
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# ---------- helpers ----------
+@contextlib.contextmanager
+def fresh_db(workdir):
+    """Point storage (and the cwd-relative paths) at an empty queue.db in `workdir`."""
+    workdir = Path(workdir)
+    saved = (storage.DB_PATH, joblogs.LOG_DIR, notify.WAKEUP_SOCK, retention.ARCHIVE_DIR)
+    storage.close_pool()
+    storage.DB_PATH = workdir / 'queue.db'
+    joblogs.LOG_DIR = workdir / 'job_logs'
+    notify.WAKEUP_SOCK = workdir / 'queuectl_wakeup.sock'
+    retention.ARCHIVE_DIR = workdir / 'archive'
+    storage.init_db()
+    try:
+        yield workdir
+    finally:
+        storage.close_pool()
+        storage.DB_PATH, joblogs.LOG_DIR, notify.WAKEUP_SOCK, retention.ARCHIVE_DIR = saved
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)], 3)
+    return {'count': len(ordered), 'p50': pick(50), 'p90': pick(90), 'p95': pick(95), 'p99': pick(99),
+            'max': round(ordered[-1], 3), 'mean': round(sum(ordered) / len(ordered), 3)}
+
+def db_bytes():
+    return sum(p.stat().st_size for p in (storage.DB_PATH, Path(f"{storage.DB_PATH}-wal")) if p.exists())
+
+def _rows(n, prefix='job', **fields):
+    return ({'id': f"{prefix}-{i:08d}", 'command': 'true', **fields} for i in range(n))
+
+def _bulk(n, workdir, prefix='job', **fields):
+    path = Path(workdir) / f'{prefix}.jsonl'
+    with open(path, 'w') as f:
+        for row in _rows(n, prefix, **fields):
+            f.write(json.dumps(row) + '\n')
+    with contextlib.redirect_stdout(io.StringIO()):
+        queue_manager.enqueue_batch(str(path))
+
+# ---------- scenarios ----------
+def bench_enqueue_single(args, workdir):
+    n = args.single_jobs
+    with fresh_db(workdir):
+        payloads = [json.dumps(row) for row in _rows(n)]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for payload in payloads:
+                queue_manager.enqueue_from_input(payload)
+        elapsed = time.perf_counter() - start
+    return {'jobs': n, 'seconds': round(elapsed, 3), 'jobs_per_sec': round(n / elapsed, 1)}
+
+def bench_enqueue_bulk(args, workdir):
+    n = args.jobs
+    with fresh_db(workdir):
+        start = time.perf_counter()
+        _bulk(n, workdir)
+        elapsed = time.perf_counter() - start
+    return {'jobs': n, 'seconds': round(elapsed, 3), 'jobs_per_sec': round(n / elapsed, 1)}
+
+def _claim_worker(db_path, owner, batch, ready, go):
+    storage.DB_PATH = Path(db_path)
+    ready.wait()
+    go.wait()
+    while True:
+        rows = storage.atomic_claim_jobs(owner, batch)
+        if not rows:
+            return
+        now = int(time.time())
+        storage.apply_outcomes([Outcome(r['id'], 'completed', now) for r in rows], owner)
+
+def bench_claim(args, workdir):
+    """Drain `jobs` pending jobs with K processes doing claim + complete, for each K."""
+    ctx = multiprocessing.get_context('fork')
+    results = {}
+    for count in args.workers:
+        with fresh_db(Path(workdir) / f'claim-{count}') as wd:
+            _bulk(args.jobs, wd)
+            storage.close_pool()
+            ready, go = ctx.Barrier(count + 1), ctx.Event()
+            procs = [ctx.Process(target=_claim_worker, args=(storage.DB_PATH, f"bench{i}", args.claim_batch,
+                                                             ready, go)) for i in range(count)]
+            for p in procs:
+                p.start()
+            ready.wait()
+            start = time.perf_counter()
+            go.set()
+            for p in procs:
+                p.join()
+            elapsed = time.perf_counter() - start
+            left = storage.fetch_one("SELECT COUNT(*) AS n FROM jobs WHERE state!='completed'")['n']
+        results[str(count)] = {'jobs': args.jobs, 'seconds': round(elapsed, 3),
+                               'jobs_per_sec': round(args.jobs / elapsed, 1), 'not_completed': left}
+    return {'claim_batch': args.claim_batch, 'by_workers': results}
+
+def _shard_worker(db_path, owner, home, batch, ready, go):
+    storage.DB_PATH = Path(db_path)
+    ready.wait()
+    go.wait()
+    while True:
+        jobs = worker._claim(owner, batch, None, storage.DEFAULT_LEASE_SECONDS, None, home)
+        if not jobs:
+            return
+        now = int(time.time())
+        with shards.using(jobs[0]['shard']):
+            storage.apply_outcomes([Outcome(j['id'], 'completed', now) for j in jobs], owner)
+
+def bench_shards(args, workdir):
+    """Drain `jobs` jobs with `shard_workers` processes doing claim + complete, for each shard count."""
+    ctx = multiprocessing.get_context('fork')
+    count = args.shard_workers
+    results = {}
+    for n in args.shards:
+        with fresh_db(Path(workdir) / f'shards-{n}') as wd:
+            with contextlib.redirect_stdout(io.StringIO()):
+                shards.configure(n, by='id')
+            _bulk(args.jobs, wd)
+            storage.close_pool()
+            ready, go = ctx.Barrier(count + 1), ctx.Event()
+            procs = [ctx.Process(target=_shard_worker, args=(storage.DB_PATH, f"bench{i}", i % n, args.claim_batch,
+                                                             ready, go)) for i in range(count)]
+            for p in procs:
+                p.start()
+            ready.wait()
+            start = time.perf_counter()
+            go.set()
+            for p in procs:
+                p.join()
+            elapsed = time.perf_counter() - start
+            left = sum(storage.fetch_one("SELECT COUNT(*) AS n FROM jobs WHERE state!='completed'")['n']
+                       for _ in shards.each())
+        results[str(n)] = {'jobs': args.jobs, 'seconds': round(elapsed, 3),
+                           'jobs_per_sec': round(args.jobs / elapsed, 1), 'not_completed': left}
+    return {'workers': count, 'claim_batch': args.claim_batch, 'by_shards': results}
+
+def bench_latency(args, workdir):
+    """
+    Real master + workers in `workdir`. Each job's command prints its own start time
+    (`date +%s.%N`, as cheap as a no-op shell), so start latency is exact; finish is when
+    this process sees the job completed, polling every 2 ms.
+    """
+    n, rate = args.latency_jobs, args.latency_rate
+    with fresh_db(workdir) as wd:
+        master = subprocess.Popen([sys.executable, str(ROOT / 'queuectl.py'), 'worker', 'start',
+                                   '--count', str(args.latency_workers)],
+                                  cwd=wd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 10
+            while not notify.WAKEUP_SOCK.exists() and time.time() < deadline:
+                time.sleep(0.05)
+            time.sleep(0.5)     # let the workers reach their idle wait
+            enqueued, finished = {}, {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                for i in range(n):
+                    due = time.time()
+                    job_id = f"lat-{i:06d}"
+                    queue_manager.enqueue_from_input(json.dumps({'id': job_id, 'command': 'date +%s.%N'}))
+                    enqueued[job_id] = due
+                    _poll_finished(enqueued, finished)
+                    while time.time() < due + 1 / rate:
+                        _poll_finished(enqueued, finished)
+                        time.sleep(0.002)
+            deadline = time.time() + 30
+            while len(finished) < n and time.time() < deadline:
+                _poll_finished(enqueued, finished)
+                time.sleep(0.002)
+        finally:
+            master.send_signal(signal.SIGTERM)
+            master.wait(timeout=30)
+        start_ms, finish_ms = [], []
+        for job_id, t0 in enqueued.items():
+            started = _started_at(job_id)
+            if started is not None:
+                start_ms.append((started - t0) * 1000)
+            if job_id in finished:
+                finish_ms.append((finished[job_id] - t0) * 1000)
+    return {'jobs': n, 'rate_per_sec': rate, 'workers': args.latency_workers, 'completed': len(finished),
+            'enqueue_to_start_ms': percentiles(start_ms), 'enqueue_to_finish_ms': percentiles(finish_ms)}
+
+def _poll_finished(enqueued, finished):
+    now = time.time()
+    waiting = [j for j in enqueued if j not in finished]
+    if not waiting:
+        return
+    marks = ','.join('?' * len(waiting))
+    for r in storage.fetch_all(f"SELECT id FROM jobs WHERE state='completed' AND id IN ({marks})", waiting):
+        finished[r['id']] = now
+
+def _started_at(job_id):
+    # the job's own output: the time its command began
+    for line in joblogs.read_range(job_id, 0, joblogs.log_size(job_id)).decode(errors='ignore').splitlines():
+        if not line.startswith('[queuectl'):
+            try:
+                return float(line.strip())
+            except ValueError:
+                pass
+    return None
+
+def bench_db_size(args, workdir):
+    n = args.jobs
+    with fresh_db(workdir):
+        empty = db_bytes()
+        _bulk(n, workdir)
+        storage.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pending = db_bytes()
+        with storage.transaction() as conn:
+            now = int(time.time())
+            conn.execute("UPDATE jobs SET state='completed', finished_at=?, updated_at=?", (now - 86400, now))
+        storage.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        completed = db_bytes()
+        storage.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('retention_seconds','3600')")
+        storage.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('retention_mode','delete')")
+        retention.run_once()
+        storage.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        after = db_bytes()
+    return {'jobs': n, 'empty_bytes': empty, 'pending_bytes': pending, 'completed_bytes': completed,
+            'after_retention_bytes': after, 'bytes_per_job': round((pending - empty) / n, 1)}
+
+def bench_dashboard(args, workdir):
+    """Endpoint latency through Flask's test client against `dashboard_jobs` jobs and a DLQ."""
+    from src import dashboard
+    n, dead = args.dashboard_jobs, args.dashboard_jobs // 10
+    with fresh_db(workdir) as wd:
+        _bulk(n, wd)
+        with storage.transaction() as conn:
+            conn.execute("UPDATE jobs SET state='completed' WHERE rowid % 3 = 0")
+            conn.executemany("INSERT INTO dlq(id,command,failed_at,attempts,last_error) VALUES(?,?,?,?,?)",
+                             [(f"dead-{i}", 'false', 1_700_000_000 + i, 3, 'boom') for i in range(dead)])
+        log = joblogs.LogWriter('job-00000001')
+        log.write(b'line\n' * 20000)
+        log.close()
+        deep = queue_manager.encode_cursor('jobs', storage.fetch_one(
+            "SELECT created_at, id FROM jobs ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET 200"))
+        endpoints = {
+            'stats': '/api/stats',
+            'jobs_first_page': '/api/jobs?limit=100',
+            'jobs_deep_page': f'/api/jobs?limit=100&cursor={deep}',
+            'jobs_pending_filter': '/api/jobs?limit=100&state=pending',
+            'dlq_first_page': '/api/dlq/list?limit=100',
+            'log_tail': '/api/jobs/job-00000001/log?tail=100',
+        }
+        client = dashboard.app.test_client()
+        results = {}
+        for name, url in endpoints.items():
+            client.get(url)       # warm up (and start the feed for /api/stats)
+            samples = []
+            for _ in range(args.dashboard_requests):
+                start = time.perf_counter()
+                resp = client.get(url)
+                resp.get_data()
+                samples.append((time.perf_counter() - start) * 1000)
+            results[name] = {'status': resp.status_code, **percentiles(samples)}
+    return {'jobs': n, 'dlq': dead, 'requests': args.dashboard_requests, 'endpoints_ms': results}
+
+def bench_startup(args, workdir):
+    """Each command is a fresh process, as in a script calling queuectl in a loop."""
+    with fresh_db(workdir) as wd:
+        _bulk(1000, wd)
+    cli = [sys.executable, str(ROOT / 'queuectl.py')]
+    commands = {
+        'python_baseline': [sys.executable, '-c', 'pass'],
+        'status': cli + ['status'],
+        'list_page': cli + ['list', '--limit', '20'],
+        'enqueue': cli + ['enqueue', '{"command": "true"}'],
+        'config_get': cli + ['config', 'get', 'max_retries'],
+    }
+    results = {}
+    for name, cmd in commands.items():
+        subprocess.run(cmd, cwd=workdir, capture_output=True, check=True)      # warm the page cache / .pyc
+        samples = []
+        for _ in range(args.startup_runs):
+            start = time.perf_counter()
+            subprocess.run(cmd, cwd=workdir, capture_output=True, check=True)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = percentiles(samples)
+    return {'runs': args.startup_runs, 'commands_ms': results}
+
+SCENARIOS = {
+    'enqueue_single': bench_enqueue_single,
+    'enqueue_bulk': bench_enqueue_bulk,
+    'claim': bench_claim,
+    'shards': bench_shards,
+    'latency': bench_latency,
+    'db_size': bench_db_size,
+    'dashboard': bench_dashboard,
+    'startup': bench_startup,
+}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='queuectl benchmark suite')
+    parser.add_argument('--only', nargs='+', choices=list(SCENARIOS), help='run only these scenarios')
+    parser.add_argument('--jobs', type=int, default=20000, help='jobs for bulk enqueue, claim and db_size')
+    parser.add_argument('--single-jobs', type=int, default=2000, help='jobs for single enqueue')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='worker counts for claim')
+    parser.add_argument('--claim-batch', type=int, default=1, help='jobs per claim in the claim and shards scenarios')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='shard counts for shards')
+    parser.add_argument('--shard-workers', type=int, default=4, help='worker processes for shards')
+    parser.add_argument('--latency-jobs', type=int, default=300)
+    parser.add_argument('--latency-rate', type=float, default=50.0, help='jobs enqueued per second')
+    parser.add_argument('--latency-workers', type=int, default=2)
+    parser.add_argument('--dashboard-jobs', type=int, default=100000)
+    parser.add_argument('--dashboard-requests', type=int, default=200)
+    parser.add_argument('--startup-runs', type=int, default=30, help='invocations per command in startup')
+    parser.add_argument('--output', help='JSON results file (default benchmarks/results/<time>-<commit>.json)')
+    args = parser.parse_args()
+
+    commit = _git_commit()
+    report = {
+        'meta': {
+            'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': {k: v for k, v in vars(args).items() if k != 'output'},
+        },
+        'results': {},
+    }
+    for name in args.only or SCENARIOS:
+        with tempfile.TemporaryDirectory(prefix=f'queuectl-bench-{name}-') as workdir:
+            print(f"{name} ...", flush=True)
+            start = time.perf_counter()
+            report['results'][name] = result = SCENARIOS[name](args, workdir)
+            print(f"{name}: {json.dumps(result)} ({time.perf_counter() - start:.1f}s)", flush=True)
+
+    if args.output:
+        out = Path(args.output)
+    else:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        out = RESULTS_DIR / f"{stamp}-{commit or 'nogit'}.json"
+    out.write_text(json.dumps(report, indent=2) + '\n')
+    print(f"Results written to {out}")
+
+if __name__ == '__main__':
+    main()
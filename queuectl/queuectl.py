@@ -5,7 +5,10 @@ Run: ./queuectl <command> ...
 """
 import argparse
 import sys
-from src import queue_manager, config, worker, dashboard
+from src import config
+
+# Subcommand modules are imported where they are used: `status` or `enqueue` shouldn't
+# pay for Flask (dashboard) or multiprocessing (worker) on every call.
 
 def main():
     parser = argparse.ArgumentParser(prog='queuectl', description='queuectl - background job queue')
@@ -13,24 +16,72 @@ def main():
 
     # enqueue
     p_enq = sub.add_parser('enqueue', help='Enqueue a job JSON')
-    p_enq.add_argument('json_payload', help='JSON payload for job, or path to JSON file')
+    p_enq.add_argument('json_payload', nargs='?', help='JSON payload for job, or path to JSON file')
+    p_enq.add_argument('--batch', metavar='FILE', help='bulk enqueue JSON Lines (or a JSON array) from FILE, or - for stdin')
 
     # worker
     p_worker = sub.add_parser('worker', help='Manage workers')
-    p_worker.add_argument('action', choices=['start','stop','status'], help='start | stop | status')
-    p_worker.add_argument('--count', type=int, default=1, help='how many worker processes to spawn (start)')
+    p_worker.add_argument('action', choices=['start','stop','status','scale','reap'], help='start | stop | status | scale | reap')
+    p_worker.add_argument('--count', type=int, default=1, help='how many worker processes to spawn (start) or keep (scale)')
+    p_worker.add_argument('--concurrency', type=int, default=1, help='jobs each worker process runs at once (start)')
+    p_worker.add_argument('--queues', help='comma-separated queues to serve (start); default all')
+    p_worker.add_argument('--weights', help='comma-separated weight per queue in --queues (start)')
+    p_worker.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on 127.0.0.1:PORT/metrics (start)')
+    p_worker.add_argument('--strategy', choices=['weighted', 'strict'], default='weighted',
+                          help='weighted round-robin over --weights, or strict order of --queues (start)')
 
     # status / list
     p_status = sub.add_parser('status', help='Show counts by state')
+    p_status.add_argument('--recount', action='store_true', help='rebuild the state counters from a full count first')
     p_list = sub.add_parser('list', help='List jobs')
-    p_list.add_argument('--state', choices=['pending','processing','completed'], default=None)
+    p_list.add_argument('--state', choices=['scheduled','waiting','pending','processing','completed','cancelled'], default=None)
+    p_list.add_argument('--queue', help='only jobs in this queue')
+
+    p_cancel = sub.add_parser('cancel', help='Cancel a job that has not started, and the jobs depending on it')
+    p_cancel.add_argument('job_id')
+
+    # logs
+    p_logs = sub.add_parser('logs', help="Show a job's output log")
+    p_logs.add_argument('job_id')
+    p_logs.add_argument('--follow', '-f', action='store_true', help='keep printing new output until the job finishes')
+    p_logs.add_argument('--tail', type=int, metavar='N', help='only the last N lines')
 
     # dlq
     p_dlq = sub.add_parser('dlq', help='Dead letter queue ops')
     dlq_sub = p_dlq.add_subparsers(dest='dlq_cmd')
-    dlq_sub.add_parser('list', help='List DLQ jobs')
-    p_dlq_retry = dlq_sub.add_parser('retry', help='Retry job from DLQ (move to pending)')
-    p_dlq_retry.add_argument('job_id')
+    p_dlq_list = dlq_sub.add_parser('list', help='List DLQ jobs')
+    for p in (p_list, p_dlq_list):
+        p.add_argument('--limit', type=int, help='print at most N rows, then the cursor for the next page')
+        p.add_argument('--after', metavar='CURSOR', help='continue after a cursor printed by --limit')
+        p.add_argument('--format', choices=['text', 'jsonl'], default='text')
+        p.add_argument('--prefix', help='only commands starting with this')
+        p.add_argument('--since', help='ISO 8601 time (created_at, or failed_at for the DLQ)')
+        p.add_argument('--until', help='ISO 8601 time, exclusive')
+    p_dlq_retry = dlq_sub.add_parser('retry', help='Retry jobs from DLQ (move to pending)')
+    p_dlq_purge = dlq_sub.add_parser('purge', help='Delete jobs from DLQ')
+    for p in (p_dlq_retry, p_dlq_purge):
+        p.add_argument('job_id', nargs='?')
+        p.add_argument('--all', action='store_true', help='every DLQ entry')
+        p.add_argument('--match', metavar='PATTERN', help='glob on the command or last error, e.g. "*timeout*"')
+        p.add_argument('--since', metavar='TIME', help='entries that failed at/after this ISO 8601 time or epoch')
+    p_dlq_retry.add_argument('--rate', type=float, metavar='N', help='release at most N jobs per second')
+
+    # retention
+    p_gc = sub.add_parser('gc', help='Archive/delete completed jobs past retention now')
+    p_gc.add_argument('--vacuum', action='store_true', help='then VACUUM queue.db (blocks writers while it runs)')
+
+    # recurring jobs (created with enqueue '{"cron": ...}')
+    p_sched = sub.add_parser('schedule', help='List or remove recurring (cron) jobs')
+    p_sched.add_argument('action', choices=['list', 'remove'])
+    p_sched.add_argument('schedule_id', nargs='?')
+
+    # rate limits / concurrency caps
+    p_limit = sub.add_parser('limit', help='Rate limits and concurrency caps per queue or job tag')
+    p_limit.add_argument('action', choices=['set', 'clear', 'list'])
+    p_limit.add_argument('scope', nargs='?', help='queue:<name> or tag:<name>')
+    p_limit.add_argument('--rate', type=float, help='claims per second (token bucket)')
+    p_limit.add_argument('--burst', type=float, help='bucket size (default: max(1, rate))')
+    p_limit.add_argument('--max-inflight', type=int, help='jobs processing at once')
 
     # config
     p_cfg = sub.add_parser('config', help='Get/Set configuration')
@@ -38,6 +89,15 @@ def main():
     p_cfg.add_argument('key')
     p_cfg.add_argument('value', nargs='?')
 
+    # sharding
+    p_shards = sub.add_parser('shards', help='Spread jobs over N SQLite files (only while the queue is empty)')
+    p_shards.add_argument('count', type=int)
+    p_shards.add_argument('--by', choices=['queue', 'id'], default='queue',
+                          help='shard key: queue name (default) or job id')
+
+    # queue daemon
+    sub.add_parser('serve', help='Run the queue daemon: enqueue/claim/ack go through it, group-committed')
+
     # dashboard
     p_dash = sub.add_parser('dashboard', help='Start minimal dashboard (Flask)')
     p_dash.add_argument('--port', type=int, default=5000)
@@ -50,26 +110,77 @@ def main():
     # ensure DB initialized
     config.ensure_db()
 
+    try:
+        _run(parser, args)
+    except ValueError as e:
+        # bad input (a malformed job, an unknown id, an out-of-range option): no traceback
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+def _run(parser, args):
+    """Dispatch a parsed command line."""
+    if args.cmd in ('enqueue', 'status', 'list', 'cancel', 'logs', 'dlq', 'schedule'):
+        from src import queue_manager
+
     if args.cmd == 'enqueue':
-        queue_manager.enqueue_from_input(args.json_payload)
+        if args.batch:
+            queue_manager.enqueue_batch(args.batch)
+        elif args.json_payload:
+            queue_manager.enqueue_from_input(args.json_payload)
+        else:
+            print("enqueue requires a JSON payload or --batch FILE")
     elif args.cmd == 'worker':
+        from src import worker
         if args.action == 'start':
-            worker.start_master(args.count)
+            from src import queues
+            worker.start_master(args.count, args.concurrency,
+                                queues.parse_selector(args.queues, args.weights, args.strategy), args.metrics_port)
         elif args.action == 'stop':
             worker.stop_master()
         elif args.action == 'status':
             worker.worker_status()
+        elif args.action == 'scale':
+            worker.scale_workers(args.count)
+        elif args.action == 'reap':
+            worker.reap_expired()
     elif args.cmd == 'status':
-        queue_manager.print_status()
+        queue_manager.print_status(args.recount)
     elif args.cmd == 'list':
-        queue_manager.list_jobs(args.state)
+        queue_manager.list_jobs(args.state, args.limit, args.after, args.format, args.queue,
+                                args.prefix, args.since, args.until)
+    elif args.cmd == 'cancel':
+        queue_manager.cancel_job(args.job_id)
+    elif args.cmd == 'logs':
+        queue_manager.show_log(args.job_id, args.follow, args.tail)
     elif args.cmd == 'dlq':
         if args.dlq_cmd == 'list':
-            queue_manager.list_dlq()
+            queue_manager.list_dlq(args.limit, args.after, args.format, args.prefix, args.since, args.until)
         elif args.dlq_cmd == 'retry':
-            queue_manager.retry_dlq_job(args.job_id)
+            queue_manager.retry_dlq_job(args.job_id, args.all, args.match, args.since, args.rate)
+        elif args.dlq_cmd == 'purge':
+            queue_manager.purge_dlq_jobs(args.job_id, args.all, args.match, args.since)
+        else:
+            print("dlq requires a command: list | retry | purge")
+    elif args.cmd == 'gc':
+        from src import retention
+        retention.collect(args.vacuum)
+    elif args.cmd == 'schedule':
+        if args.action == 'list':
+            queue_manager.list_schedules()
+        elif args.schedule_id:
+            queue_manager.remove_schedule(args.schedule_id)
+        else:
+            print("schedule remove requires a schedule id")
+    elif args.cmd == 'limit':
+        from src import limits
+        if args.action == 'list':
+            limits.show_limits()
+        elif not args.scope:
+            print("limit set|clear requires a scope: queue:<name> or tag:<name>")
+        elif args.action == 'set':
+            limits.set_limit(args.scope, args.rate, args.burst, args.max_inflight)
         else:
-            print("dlq requires a command: list | retry")
+            limits.clear_limit(args.scope)
     elif args.cmd == 'config':
         if args.action == 'set' and args.value is not None:
             config.set_config(args.key, args.value)
@@ -77,12 +188,18 @@ def main():
             print(config.get_config(args.key))
         else:
             print("config usage: config (get|set) key [value]")
+    elif args.cmd == 'shards':
+        from src import shards
+        shards.configure(args.count, args.by)
+    elif args.cmd == 'serve':
+        from src import server
+        server.serve()
     elif args.cmd == 'dashboard':
+        from src import dashboard
         dashboard.run(port=args.port)
     elif args.cmd == 'selftest':
         import tests.validate_system as vs
         vs.run_smoke()
-    
     else:
         parser.print_help()
 
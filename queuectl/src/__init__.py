@@ -1,2 +1 @@
-# package initializer
-from . import storage, models, queue_manager, worker, config, dashboard
+# package initializer; submodules are imported where they are used (see queuectl.py)
@@ -0,0 +1,127 @@
+"""
+Async worker mode: one process drives up to `concurrency` shell jobs at once with
+asyncio subprocesses, claiming work in batches and writing results back in batches.
+Used by `worker start --concurrency K` (K > 1).
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config, joblogs
+from .worker import (_replay, _owner_id, _lease_seconds, _outcome, _report_all, _idle_timeout, _sleep_until_work,
+                     _claim, _home_shard, _renew, _record_attempt, _ack_buffer, _IDLE_MIN, _IDLE_MAX)
+
+async def _run_command(command, timeout, log):
+    proc = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE,
+                                                 stderr=asyncio.subprocess.STDOUT)
+
+    async def pump():
+        # output goes to the job's log a chunk at a time, never collected in memory
+        while chunk := await proc.stdout.read(joblogs.CHUNK_SIZE):
+            log.write(chunk)
+        return await proc.wait()
+
+    try:
+        return await asyncio.wait_for(pump(), timeout), log.tail()
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        msg = f"timeout: command timed out after {timeout} seconds"
+        log.note(msg)
+        return 124, f"{log.tail()}\n{msg}".lstrip()
+
+async def _run_job(worker_id, job, default_timeout, backoff_base, log_opts):
+    timeout = job.get('timeout') or default_timeout
+    print(f"[worker {worker_id}] picked job={job['id']} attempts={job['attempts']}/{job['max_retries']} cmd={job['command']}")
+    log = None
+    started_at = time.time()
+    try:
+        log = joblogs.LogWriter(job['id'], *log_opts)
+        log.note(f"attempt {job['attempts']}/{job['max_retries']}: {job['command']}")
+        if 'cached' in job:
+            rc, out = 0, _replay(job, log)
+        else:
+            rc, out = await _run_command(job['command'], timeout, log)
+    except Exception as e:
+        # e.g. EMFILE at high concurrency: fail this attempt, keep the other jobs running
+        rc, out = 1, f"could not run command: {e!r}"
+        if log is not None:
+            log.note(out)
+    finally:
+        if log is not None:
+            log.close()
+    return job, rc, out, _record_attempt(_outcome(job, rc, out, backoff_base), job, rc, started_at)
+
+async def _drive(worker_id, event, wakeup, concurrency, selector):
+    loop = asyncio.get_running_loop()
+    # every DB call goes through one thread, and so one pooled connection
+    db = ThreadPoolExecutor(max_workers=1, thread_name_prefix='queuectl-db')
+
+    def on_db(fn, *args):
+        return loop.run_in_executor(db, fn, *args)
+
+    backoff_base = float(await on_db(config.get_config, 'backoff_base') or 2.0)
+    default_timeout = int(await on_db(config.get_config, 'job_timeout') or 60)
+    lease = await on_db(_lease_seconds)
+    log_opts = await on_db(joblogs.log_options)
+    owner = _owner_id(worker_id)
+    # results are written back ack_batch at a time or after ack_interval_ms (worker.AckBuffer)
+    acks = await on_db(_ack_buffer, owner)
+    running = set()
+    idle = _IDLE_MIN
+
+    async def flush():
+        _report_all(worker_id, await on_db(acks.flush))
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(lease / 3)
+            try:
+                await on_db(_renew, owner, lease)
+            except Exception as e:
+                print(f"[{owner}] lease renewal failed: {e}")
+
+    beating = asyncio.create_task(heartbeat())
+    # After an empty claim, don't claim again (a write transaction) until poked or until
+    # the earliest pending job comes due; the pipe check in between costs no DB access.
+    claim_after = 0.0
+    try:
+        while True:
+            stopping = event.is_set()
+            if not stopping and len(running) < concurrency and time.time() >= claim_after:
+                queues = selector.order() if selector else None
+                jobs = await on_db(_claim, owner, concurrency - len(running), None, lease, queues,
+                                   _home_shard(worker_id))
+                for job in jobs:
+                    running.add(asyncio.create_task(_run_job(worker_id, job, default_timeout, backoff_base, log_opts)))
+                if jobs:
+                    idle = _IDLE_MIN
+                else:
+                    claim_after = time.time() + await on_db(_idle_timeout, wakeup, idle)
+                    idle = min(idle * 2, _IDLE_MAX)
+            if running:
+                done, running = await asyncio.wait(running, timeout=acks.interval,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    acks.add(*t.result())
+                if acks.due():
+                    await flush()
+                if wakeup and wakeup.wait(0):
+                    claim_after = 0.0
+                continue
+            await flush()
+            if stopping:
+                break
+            # nothing running: block until poked or the next job is due
+            await loop.run_in_executor(None, _sleep_until_work, wakeup, max(claim_after - time.time(), 0))
+            claim_after = 0.0
+    finally:
+        beating.cancel()
+        db.shutdown(wait=True)
+
+def async_worker_loop(worker_id, event, wakeup=None, concurrency=8, selector=None):
+    """
+    Run up to `concurrency` jobs at a time in this process until event.is_set(), then
+    finish the running ones and write back their results.
+    """
+    asyncio.run(_drive(worker_id, event, wakeup, concurrency, selector))
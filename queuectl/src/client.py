@@ -0,0 +1,103 @@
+"""
+Client side of the queue daemon (`queuectl serve`, src/server.py).
+
+When a daemon is listening on SERVE_SOCK, remote() returns this thread's connection to
+it and queue_manager and the workers send their writes there instead of opening
+queue.db themselves. Otherwise it returns None and everything works on the file
+directly, as without a daemon.
+
+The protocol is one JSON object per line each way: {"op": ..., args...} answered by
+{"result": ...} or {"error": ..., "type": ...}, in request order. A client may send
+several requests before reading the answers (send / receive), so a batch of writes
+reaches the daemon together and can share its commit.
+
+Client also has the storage functions a worker uses (atomic_claim_jobs, apply_outcomes,
+renew_leases, release_jobs, throttled_until), so worker code can take either one.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+SERVE_SOCK = Path.cwd() / 'queuectl.sock'
+# after a failed connect, how long a thread keeps using queue.db before trying again
+RETRY_SECONDS = 1.0
+
+_local = threading.local()
+
+class Client:
+    def __init__(self, path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(str(path or SERVE_SOCK))
+        except OSError:
+            self.sock.close()
+            raise
+        self.rfile = self.sock.makefile('rb')
+        self.pid = os.getpid()
+        self._throttled_until = None
+
+    def send(self, op, **args):
+        self.sock.sendall(json.dumps({'op': op, **args}).encode() + b'\n')
+
+    def receive(self):
+        """The answer to the oldest request not yet received; daemon-side errors are re-raised."""
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("queuectl serve closed the connection")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise (ValueError if reply.get('type') == 'ValueError' else RuntimeError)(reply['error'])
+        return reply['result']
+
+    def call(self, op, **args):
+        self.send(op, **args)
+        return self.receive()
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    # ---- the storage functions a worker calls ----
+    def atomic_claim_jobs(self, worker_id, limit=1, start=None, lease_seconds=30, queues=None):
+        reply = self.call('claim', worker=worker_id, limit=limit, start=start, lease=lease_seconds,
+                          queues=list(queues) if queues else None)
+        self._throttled_until = reply['throttled_until']
+        return reply['rows']
+
+    def throttled_until(self):
+        return self._throttled_until
+
+    def apply_outcomes(self, outcomes, worker_id=None, start_ids=()):
+        self.call('ack', worker=worker_id, outcomes=[vars(o) for o in outcomes], start_ids=list(start_ids))
+
+    def renew_leases(self, worker_id, lease_seconds=30):
+        return self.call('renew', worker=worker_id, lease=lease_seconds)
+
+    def release_jobs(self, worker_id, job_ids):
+        if job_ids:
+            self.call('release', worker=worker_id, ids=list(job_ids))
+
+def remote():
+    """This thread's connection to a running `queuectl serve`, or None to use queue.db directly."""
+    c = getattr(_local, 'client', None)
+    if c is not None and c.pid == os.getpid():
+        return c
+    _local.client = None
+    if not SERVE_SOCK.exists() or getattr(_local, 'retry_at', 0) > time.monotonic():
+        return None
+    try:
+        _local.client = Client()
+    except OSError:
+        # a socket file left by a daemon that is gone
+        _local.retry_at = time.monotonic() + RETRY_SECONDS
+    return _local.client
+
+def disconnect():
+    """Close this thread's connection (the next remote() reconnects)."""
+    c = getattr(_local, 'client', None)
+    _local.client = None
+    if c is not None and c.pid == os.getpid():
+        c.close()
@@ -1,10 +1,15 @@
-from . import storage
+from . import storage, shards
 
 def ensure_db():
     storage.init_db()
+    if shards.count() > 1:
+        for _ in shards.each():
+            storage.init_db()
 
 def set_config(key:str, value:str):
-    storage.execute("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", (key, str(value)))
+    # every shard keeps a copy: claims and outcomes read settings from their own file
+    for _ in shards.each():
+        storage.execute("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", (key, str(value)))
     print(f"config set {key} = {value}")
 
 def get_config(key:str):
@@ -0,0 +1,104 @@
+"""
+Cron expressions for recurring jobs, evaluated in UTC.
+
+Five fields: minute hour day-of-month month day-of-week. Each takes `*`, numbers, ranges
+`a-b`, steps `*/n` or `a-b/n`, and comma lists; months and weekdays also take names
+(jan, mon). Day of week 0 and 7 are Sunday. As in classic cron, when both day fields are
+restricted a day matching either one fires. Also @yearly, @monthly, @weekly, @daily and
+@hourly.
+"""
+import datetime
+import functools
+
+MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+_MONTHS = {m: i for i, m in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                                       'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+_DAYS = {d: i for i, d in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])}
+# (low, high, names) per field
+_FIELDS = ((0, 59, {}), (0, 23, {}), (1, 31, {}), (1, 12, _MONTHS), (0, 7, _DAYS))
+# how far ahead next_after looks before deciding an expression never fires (e.g. Feb 30)
+_SEARCH_YEARS = 5
+
+def _value(text, low, high, names):
+    text = text.lower()
+    if text in names:
+        return names[text]
+    if not text.isdigit() or not low <= int(text) <= high:
+        raise ValueError(f"{text!r} is not in {low}-{high}")
+    return int(text)
+
+def _parse_field(text, low, high, names):
+    values = set()
+    for part in text.split(','):
+        rng, slash, step = part.partition('/')
+        if slash and not (step.isdigit() and int(step) > 0):
+            raise ValueError(f"bad step in {part!r}")
+        step = int(step) if slash else None
+        if rng == '*':
+            first, last = low, high
+        elif '-' in rng:
+            a, b = rng.split('-', 1)
+            first, last = _value(a, low, high, names), _value(b, low, high, names)
+            if first > last:
+                raise ValueError(f"empty range {rng!r}")
+        else:
+            first = _value(rng, low, high, names)
+            last = high if step else first
+        values.update(range(first, last + 1, step or 1))
+    return values
+
+class Cron:
+    def __init__(self, expr):
+        self.expr = expr
+        fields = MACROS.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields (minute hour day month weekday), got {expr!r}")
+        try:
+            self.minutes, self.hours, self.days, self.months, weekdays = (
+                _parse_field(f, *spec) for f, spec in zip(fields, _FIELDS))
+        except ValueError as e:
+            raise ValueError(f"invalid cron expression {expr!r}: {e}")
+        self.weekdays = {d % 7 for d in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, t):
+        in_month = t.day in self.days
+        in_week = (t.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, ts):
+        """The first firing time (epoch seconds) strictly after `ts`."""
+        t = datetime.datetime.fromtimestamp(int(ts) // 60 * 60 + 60, datetime.timezone.utc)
+        last_year = t.year + _SEARCH_YEARS
+        # skip whole months, days and hours that can't match before stepping minutes
+        while t.year <= last_year:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return int(t.timestamp())
+        raise ValueError(f"cron expression {self.expr!r} never fires")
+
+    def __repr__(self):
+        return f"Cron({self.expr!r})"
+
+@functools.lru_cache(maxsize=1024)
+def parse(expr):
+    """A Cron for `expr`, cached: many schedules share a handful of expressions."""
+    return Cron(expr)
@@ -1,202 +1,187 @@
-from flask import Flask, request, jsonify
-import sqlite3
-import os
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 import json
-from src import queue_manager
-import html
+from src import queue_manager, storage, notify, joblogs, shards
+import itertools
+import threading
+import time
+from collections import deque
 import subprocess, sys
 
-# Database path
-DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'queue.db')
-
 app = Flask(__name__)
 
 # ---------- DB Connection Helper ----------
+# The dev server runs each request on a new thread, so borrow one of storage's shared
+# connections per request instead of letting every thread open its own.
+@app.before_request
+def _lend_db():
+    g.db_lease = storage.lend_conn()
+    g.db_lease.__enter__()
+
+@app.teardown_request
+def _return_db(exc):
+    lease = g.pop('db_lease', None)
+    if lease is not None:
+        lease.__exit__(None, None, None)
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # the connection lent to this request; do not close it
+    return storage.get_conn()
+
+
+# ---------- Live state feed ----------
+FEED_TICK = 1.0          # seconds between reads
+FEED_KEEPALIVE = 15.0    # idle SSE connections get a comment this often
+FEED_IDLE_STOP = 30.0    # the poller stops this long after its last client left
+RECENT_JOBS = 10
+
+class _Feed:
+    """
+    One poller thread shared by every dashboard client. Once per FEED_TICK it reads the
+    state counters and the most recent jobs (one read, however many clients are connected)
+    and, when something changed, publishes a delta: changed counts, changed job rows and
+    the new recent-jobs order. It only runs while someone is watching.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._changed_at = None
+        self._counts = None
+        self._recent = []
+        self._deltas = deque(maxlen=64)     # (version, delta) for clients that fell behind a tick
+        self._clients = 0
+        self._last_use = 0.0
+        self._thread = None
+        self._stopped = False
+
+    def _ensure_running(self):
+        # under _cond: a poller about to exit checks _clients/_last_use and clears _thread under it too
+        with self._cond:
+            self._last_use = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='dashboard-feed', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the poller now, rather than FEED_IDLE_STOP after its last client, and wait for it."""
+        with self._cond:
+            self._stopped = True
+            thread = self._thread
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def _read(self):
+        counts, rows = {}, []
+        for _ in shards.each():
+            # one snapshot per file: both statements see the same committed state
+            with storage.transaction('DEFERRED') as conn:
+                for state, n in storage.state_counts().items():
+                    counts[state] = counts.get(state, 0) + n
+                rows += conn.execute("SELECT id, command, state, attempts, queue, priority, updated_at FROM jobs "
+                                     "ORDER BY updated_at DESC LIMIT ?", (RECENT_JOBS,)).fetchall()
+        rows.sort(key=lambda r: r['updated_at'], reverse=True)
+        return dict(sorted(counts.items())), [dict(r) for r in rows[:RECENT_JOBS]]
+
+    def _publish(self, counts, recent):
+        delta = {}
+        if counts != self._counts:
+            delta['counts'] = counts
+        previous = {j['id']: j for j in self._recent}
+        changed = [j for j in recent if previous.get(j['id']) != j]
+        if changed:
+            delta['jobs'] = changed
+        order = [j['id'] for j in recent]
+        if order != [j['id'] for j in self._recent]:
+            delta['order'] = order
+        if not delta and self._version:
+            return
+        with self._cond:
+            self._counts, self._recent = counts, recent
+            self._version += 1
+            self._changed_at = time.time()
+            self._deltas.append((self._version, delta))
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    if self._stopped or not self._clients and time.monotonic() - self._last_use > FEED_IDLE_STOP:
+                        self._thread = None
+                        return
+                try:
+                    self._publish(*self._read())
+                except Exception as e:
+                    print(f"dashboard feed: read failed: {e}")
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stopped, timeout=FEED_TICK)
+        finally:
+            storage.close_pool()
+
+    def snapshot(self):
+        """(version, changed_at, state) of the latest read, starting the poller if needed."""
+        with self._cond:
+            self._ensure_running()
+            self._cond.wait_for(lambda: self._version > 0, timeout=5)
+            state = {'counts': self._counts or {}, 'jobs': self._recent, 'order': [j['id'] for j in self._recent]}
+            return self._version, self._changed_at, state
+
+    def events(self):
+        """Server-sent events for one client: a snapshot, then deltas as they are published."""
+        with self._cond:
+            self._clients += 1
+        try:
+            version, _, state = self.snapshot()
+            yield _sse('snapshot', state, version)
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._version > version, timeout=FEED_KEEPALIVE)
+                    missed = [(v, d) for v, d in self._deltas if v > version]
+                    latest = self._version
+                if latest == version:
+                    yield ": keepalive\n\n"
+                elif len(missed) < latest - version:
+                    # fell further behind than the delta buffer: start over from a snapshot
+                    version, _, state = self.snapshot()
+                    yield _sse('snapshot', state, version)
+                else:
+                    for version, delta in missed:
+                        yield _sse('delta', delta, version)
+        finally:
+            with self._cond:
+                self._clients -= 1
+                self._last_use = time.monotonic()
+
+def _sse(event, data, version):
+    return f"id: {version}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+_feed = _Feed()
+
+def _conditional_json(payload, last_modified=None):
+    """JSON response with an ETag (and Last-Modified if known); answers 304 to a matching conditional GET."""
+    resp = jsonify(payload)
+    resp.add_etag()
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    return resp.make_conditional(request)
 
 
 # ---------- Dashboard UI ----------
 @app.route('/')
 def index():
-    conn = get_db()
-    counts = conn.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state").fetchall()
-    dlq_count = conn.execute("SELECT COUNT(*) AS count FROM dlq").fetchone()['count']
-    jobs = conn.execute("SELECT * FROM jobs ORDER BY updated_at DESC LIMIT 10").fetchall()
-    conn.close()
-
-    # Prepare state counts
-    states = {row['state']: row['count'] for row in counts}
-    pending = states.get('pending', 0)
-    processing = states.get('processing', 0)
-    completed = states.get('completed', 0)
-    failed = states.get('failed', 0)
-
-    # Escape job data to avoid JS/HTML errors
-    rows_html = ""
-    for j in jobs:
-        safe_id = html.escape(j["id"])
-        safe_cmd = html.escape(j["command"])
-        safe_state = html.escape(j["state"])
-        safe_attempts = html.escape(str(j["attempts"]))
-        rows_html += (
-            f"<tr>"
-            f"<td>{safe_id}</td>"
-            f"<td>{safe_cmd}</td>"
-            f"<td>{safe_state}</td>"
-            f"<td>{safe_attempts}</td>"
-            f"<td><button onclick=\"retryJob('{safe_id}')\">Retry</button></td>"
-            f"</tr>"
-        )
-
-    html_code = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>QueueCTL Dashboard</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                background-color: #121212;
-                color: #f2f2f2;
-                text-align: center;
-                padding: 40px;
-            }}
-            h1 {{ color: #00ff99; }}
-            .card {{
-                display: inline-block;
-                background: #1f1f1f;
-                border-radius: 10px;
-                margin: 20px;
-                padding: 20px 40px;
-                box-shadow: 0 0 10px #00ff99;
-            }}
-            .value {{
-                font-size: 2rem;
-                color: #00ff99;
-            }}
-            table {{
-                margin: auto;
-                margin-top: 30px;
-                border-collapse: collapse;
-                width: 80%;
-                background: #1f1f1f;
-                border-radius: 10px;
-            }}
-            th, td {{
-                border: 1px solid #00ff99;
-                padding: 8px;
-            }}
-            th {{
-                background-color: #00ff99;
-                color: black;
-            }}
-            tr:hover {{
-                background-color: #333;
-            }}
-            input, button {{
-                padding: 10px;
-                border-radius: 8px;
-                border: none;
-                margin: 5px;
-            }}
-            input {{
-                width: 250px;
-            }}
-            button {{
-                background-color: #00ff99;
-                color: black;
-                cursor: pointer;
-                font-weight: bold;
-            }}
-            button:hover {{
-                background-color: #00cc7a;
-            }}
-            .section {{
-                margin-top: 40px;
-            }}
-        </style>
-    </head>
-    <body>
-        <h1>QueueCTL Dashboard</h1>
-        <div class="card"><h3>Pending Jobs</h3><div class="value">{pending}</div></div>
-        <div class="card"><h3>Processing Jobs</h3><div class="value">{processing}</div></div>
-        <div class="card"><h3>Completed Jobs</h3><div class="value">{completed}</div></div>
-        <div class="card"><h3>Failed Jobs</h3><div class="value">{failed}</div></div>
-        <div class="card"><h3>Dead Letter Queue</h3><div class="value">{dlq_count}</div></div>
-
-        <div class="section">
-            <h2> Add Job</h2>
-            <input id="job_id" placeholder="Job ID" />
-            <input id="job_cmd" placeholder="Command (e.g. echo hello)" />
-            <button onclick="enqueueJob()">Add Job</button>
-        </div>
-
-        <div class="section">
-            <h2> Recent Jobs</h2>
-            <table>
-                <tr><th>ID</th><th>Command</th><th>State</th><th>Attempts</th><th>Action</th></tr>
-                {rows_html}
-            </table>
-        </div>
-
-        <div class="section">
-            <h2> Dead Letter Queue (DLQ)</h2>
-            <button onclick="listDLQ()">View DLQ</button>
-            <div id="dlqDisplay"></div>
-        </div>
-
-        <script>
-            async function enqueueJob() {{
-                const id = document.getElementById('job_id').value;
-                const cmd = document.getElementById('job_cmd').value;
-                if (!id || !cmd) return alert('Please provide both Job ID and Command');
-                const body = {{id: id, command: cmd}};
-                const res = await fetch('/api/enqueue', {{
-                    method: 'POST',
-                    headers: {{'Content-Type':'application/json'}},
-                    body: JSON.stringify(body)
-                }});
-                const data = await res.json();
-                alert(data.message);
-                location.reload();
-            }}
-
-            async function retryJob(id) {{
-                const res = await fetch('/api/retry/' + encodeURIComponent(id), {{ method:'POST' }});
-                const data = await res.json();
-                alert(data.message);
-                location.reload();
-            }}
-
-            async function listDLQ() {{
-                const res = await fetch('/api/dlq/list');
-                const data = await res.json();
-                if (data.jobs.length === 0) {{
-                    document.getElementById('dlqDisplay').innerHTML = "<p>No DLQ Jobs</p>";
-                    return;
-                }}
-                let html = "<table><tr><th>ID</th><th>Command</th><th>Attempts</th><th>Action</th></tr>";
-                data.jobs.forEach(j => {{
-                    html += `<tr><td>${{j.id}}</td><td>${{j.command}}</td><td>${{j.attempts}}</td><td><button onclick="retryDLQ('${{j.id}}')">🔁 Retry DLQ</button></td></tr>`;
-                }});
-                html += "</table>";
-                document.getElementById('dlqDisplay').innerHTML = html;
-            }}
-
-            async function retryDLQ(id) {{
-                const res = await fetch('/api/dlq/retry/' + encodeURIComponent(id), {{ method:'POST' }});
-                const data = await res.json();
-                alert(data.message);
-                location.reload();
-            }}
-        </script>
-    </body>
-    </html>
-    """
-    return html_code
+    # static page; it loads live state from /api/stream. send_static_file handles ETag/304.
+    return app.send_static_file('index.html')
+
+@app.route('/api/stream')
+def stream():
+    return Response(_feed.events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/stats')
+def stats():
+    """The feed's latest counts and recent jobs, for clients that poll instead of streaming."""
+    _, changed_at, state = _feed.snapshot()
+    return _conditional_json(state, changed_at)
 
 
 # ---------- API Routes ----------
@@ -209,26 +194,53 @@ def enqueue():
 
 @app.route('/api/retry/<job_id>', methods=['POST'])
 def retry_job(job_id):
-    conn = get_db()
-    job = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
-    if not job:
-        return jsonify({"message": "Job not found"}), 404
-
-    conn.execute("UPDATE jobs SET state='pending', attempts=0 WHERE id=?", (job_id,))
-    conn.commit()
-    conn.close()
+    # the job's own shard (get_db() is queue.db's connection, shard 0)
+    with shards.using(shards.locate([job_id]).get(job_id, 0)):
+        conn = storage.get_conn()
+        job = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if not job:
+            return jsonify({"message": "Job not found"}), 404
+        conn.execute("UPDATE jobs SET state='pending', attempts=0 WHERE id=?", (job_id,))
+    notify.send_wakeup()
 
     # Automatically start a worker for demo
     subprocess.Popen([sys.executable, "queuectl.py", "worker", "start", "--count", "1"])
     return jsonify({"message": f"Job {job_id} reset and worker started!"})
 
 
+PAGE_DEFAULT = 100
+PAGE_MAX = 1000
+
+def _list_page(table):
+    """
+    One keyset page of `jobs` or `dlq` as {"jobs": [...], "next_cursor": ...}, or with
+    ?format=jsonl every matching row from `cursor` on, streamed as JSON Lines.
+    Filters: state, queue (jobs), prefix, since, until.
+    """
+    args = request.args
+    filters = {'prefix': args.get('prefix'), 'since': args.get('since'), 'until': args.get('until')}
+    if table == 'jobs':
+        filters.update(state=args.get('state'), queue=args.get('queue'))
+    try:
+        if args.get('format') == 'jsonl':
+            rows = queue_manager.iter_rows(table, after=args.get('cursor'), **filters)
+            first = next(rows, None)        # surface a bad cursor/filter as a 400, not a broken stream
+            lines = (json.dumps(dict(r)) + "\n" for r in itertools.chain([first] if first else [], rows))
+            return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+        limit = min(max(args.get('limit', PAGE_DEFAULT, type=int), 1), PAGE_MAX)
+        rows = list(queue_manager.iter_rows(table, after=args.get('cursor'), limit=limit, **filters))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    next_cursor = queue_manager.encode_cursor(table, rows[-1]) if len(rows) == limit else None
+    return _conditional_json({"jobs": [dict(r) for r in rows], "next_cursor": next_cursor})
+
+@app.route('/api/jobs')
+def list_jobs():
+    return _list_page('jobs')
+
 @app.route('/api/dlq/list')
 def list_dlq():
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM dlq").fetchall()
-    conn.close()
-    return jsonify({"jobs": [dict(row) for row in rows]})
+    return _list_page('dlq')
 
 
 @app.route('/api/dlq/retry/<job_id>', methods=['POST'])
@@ -237,6 +249,35 @@ def retry_dlq(job_id):
     return jsonify({"message": f"Job {job_id} moved from DLQ to pending!"})
 
 
+# largest slice of a job log one request returns; clients page through bigger logs with Range
+MAX_LOG_RESPONSE = 1 << 20
+
+@app.route('/api/jobs/<path:job_id>/log')
+def job_log(job_id):
+    """
+    A job's output log as text/plain. Honors `Range: bytes=...` (206) over the kept
+    segments; `?tail=N` returns the last N lines; otherwise the last MAX_LOG_RESPONSE bytes.
+    X-Log-Size carries the full size so clients can page or poll for new output.
+    """
+    if not joblogs.segments(job_id):
+        return jsonify({"message": "No log for this job"}), 404
+    size = joblogs.log_size(job_id)
+    headers = {'Accept-Ranges': 'bytes', 'X-Log-Size': str(size)}
+    if request.range is not None:
+        span = request.range.range_for_length(size)
+        if span is None:
+            return Response(status=416, headers={**headers, 'Content-Range': f"bytes */{size}"})
+        start, stop = span[0], min(span[1], span[0] + MAX_LOG_RESPONSE)
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+        return Response(joblogs.read_range(job_id, start, stop), 206, headers, mimetype='text/plain')
+    tail = request.args.get('tail', type=int)
+    if tail is not None:
+        body = joblogs.tail_lines(job_id, max(tail, 0), size)[-MAX_LOG_RESPONSE:]
+    else:
+        body = joblogs.read_range(job_id, max(size - MAX_LOG_RESPONSE, 0), size)
+    return Response(body, 200, headers, mimetype='text/plain')
+
+
 # ---------- Run Flask ----------
 def run(port=5000):
     print(f"🚀 Flask dashboard running at http://localhost:{port}")
@@ -0,0 +1,173 @@
+"""
+Per-job output logs.
+
+Workers stream a job's combined stdout/stderr into LOG_DIR/<job id>.log in fixed-size
+chunks; nothing holds the whole output in memory. When the active file reaches
+`log_segment_bytes` it is rotated to .log.1, .log.2, ... and only `log_segments` files
+are kept, so one job's log never exceeds about segment_bytes * segments on disk.
+Every attempt appends to the same log. Readers treat the kept segments, oldest first,
+as one byte stream and read ranges of it.
+"""
+import os
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from . import config
+
+LOG_DIR = Path.cwd() / 'job_logs'
+DEFAULT_SEGMENT_BYTES = 1 << 20
+DEFAULT_SEGMENTS = 4
+CHUNK_SIZE = 64 * 1024
+# how much of the end of the output is kept in memory for last_error and worker logs
+TAIL_CHARS = 2000
+
+def log_options():
+    """(segment_bytes, segments) from config, falling back to the defaults."""
+    segment_bytes = int(config.get_config('log_segment_bytes') or DEFAULT_SEGMENT_BYTES)
+    segments = int(config.get_config('log_segments') or DEFAULT_SEGMENTS)
+    return max(segment_bytes, 1024), max(segments, 1)
+
+def log_path(job_id, segment=0):
+    # quote() keeps arbitrary job ids (slashes, spaces) inside LOG_DIR
+    name = quote(job_id, safe='') + '.log'
+    return LOG_DIR / (f"{name}.{segment}" if segment else name)
+
+def segments(job_id):
+    """Existing log files of a job, oldest first."""
+    paths = []
+    n = 1
+    while log_path(job_id, n).exists():
+        paths.append(log_path(job_id, n))
+        n += 1
+    paths.reverse()
+    if log_path(job_id).exists():
+        paths.append(log_path(job_id))
+    return paths
+
+def remove(job_id):
+    """Delete every log segment of a job."""
+    for path in segments(job_id):
+        path.unlink(missing_ok=True)
+
+class LogWriter:
+    """Appends to a job's log, rotating segments; remembers only the last TAIL_CHARS bytes."""
+    def __init__(self, job_id, segment_bytes=DEFAULT_SEGMENT_BYTES, segments=DEFAULT_SEGMENTS):
+        LOG_DIR.mkdir(exist_ok=True)
+        self.job_id = job_id
+        self.segment_bytes = segment_bytes
+        self.segments = segments
+        self._tail = b''
+        self._f = open(log_path(job_id), 'ab')
+        self._size = self._f.tell()
+
+    def _rotate(self):
+        # .log -> .log.1 -> ... ; renaming onto .log.<segments-1> drops the oldest
+        self._f.close()
+        if self.segments == 1:
+            log_path(self.job_id).unlink(missing_ok=True)
+        for n in range(self.segments - 2, -1, -1):
+            if log_path(self.job_id, n).exists():
+                os.replace(log_path(self.job_id, n), log_path(self.job_id, n + 1))
+        self._f = open(log_path(self.job_id), 'ab')
+        self._size = 0
+
+    def write(self, data):
+        self._tail = (self._tail + data)[-TAIL_CHARS:]
+        self._append(data)
+
+    def _append(self, data):
+        view = memoryview(data)
+        while view:
+            if self._size >= self.segment_bytes:
+                self._rotate()
+            piece = view[:self.segment_bytes - self._size]
+            self._f.write(piece)
+            self._size += len(piece)
+            view = view[len(piece):]
+        # readers (`logs --follow`, the dashboard) see output as soon as the job writes it
+        self._f.flush()
+
+    def note(self, text):
+        """Write a queuectl line (attempt header, timeout) into the log, but not into tail()."""
+        self._append(f"[queuectl {time.strftime('%Y-%m-%dT%H:%M:%S')}] {text}\n".encode())
+
+    def tail(self):
+        """The end of the command's output, as text."""
+        return self._tail.decode('utf-8', errors='ignore')
+
+    def close(self):
+        self._f.close()
+
+# ---------- reading ----------
+def log_size(job_id):
+    return sum(p.stat().st_size for p in segments(job_id))
+
+def read_range(job_id, start, end):
+    """Bytes [start, end) of the job's log (kept segments, oldest first)."""
+    out = []
+    offset = 0
+    for path in segments(job_id):
+        size = path.stat().st_size
+        if offset + size > start and offset < end:
+            with open(path, 'rb') as f:
+                f.seek(max(start - offset, 0))
+                out.append(f.read(min(end, offset + size) - max(start, offset)))
+        offset += size
+        if offset >= end:
+            break
+    return b''.join(out)
+
+def tail_lines(job_id, n, end=None):
+    """The last `n` lines of a job's log before byte `end`, reading backwards only as far as needed."""
+    pos = end = log_size(job_id) if end is None else end
+    data = b''
+    while pos > 0 and data.count(b'\n') <= n:
+        step = min(CHUNK_SIZE, pos)
+        pos -= step
+        data = read_range(job_id, pos, pos + step) + data
+    lines = data.splitlines(keepends=True)
+    return b''.join(lines[-n:]) if n else b''
+
+def follow(job_id, is_finished, offset=None, poll=0.5):
+    """
+    Yield output written to the active log file from `offset` on (its current end by
+    default), across rotations, until `is_finished()` is true and all of it was read.
+    """
+    f = None
+    try:
+        while True:
+            if f is None:
+                try:
+                    f = open(log_path(job_id), 'rb')
+                except FileNotFoundError:
+                    # not started yet: show it from the first byte once it is
+                    offset = 0
+                else:
+                    if offset is None:
+                        f.seek(0, os.SEEK_END)
+                    else:
+                        f.seek(offset)
+            chunk = f.read(CHUNK_SIZE) if f else b''
+            if chunk:
+                yield chunk
+                continue
+            if f is not None and _rotated(job_id, f):
+                # finish what was written before the rotation, then move to the new active file
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    yield chunk
+                f.close()
+                f, offset = None, 0
+                continue
+            if is_finished():
+                return
+            time.sleep(poll)
+    finally:
+        if f is not None:
+            f.close()
+
+def _rotated(job_id, f):
+    try:
+        return os.stat(log_path(job_id)).st_ino != os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return False
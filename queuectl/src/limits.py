@@ -0,0 +1,83 @@
+"""
+Rate limits and concurrency caps, per queue or per job tag.
+
+A limit is declared for a scope, `queue:<name>` or `tag:<name>` (jobs carry an optional
+`tag` to group a command class across queues), and stored in `meta` under
+`limit:<scope>` as JSON:
+
+- rate / burst: a token bucket. Each claim takes a token; tokens refill at `rate` per
+  second up to `burst`.
+- max_inflight: at most this many of the scope's jobs processing at once.
+
+storage.atomic_claim_jobs enforces them inside its write transaction, so they hold across
+every worker process sharing queue.db and throttled jobs stay pending instead of being
+claimed and released. With several shards each one enforces the limit on its own jobs:
+exact for a queue when sharding by queue, per shard otherwise.
+"""
+import json
+
+from . import storage, shards
+
+KINDS = ('queue', 'tag')
+
+def parse_scope(scope):
+    """'queue:emails' -> ('queue', 'emails')."""
+    kind, _, name = scope.partition(':')
+    if kind not in KINDS or not name:
+        raise ValueError(f"limit scope must be queue:<name> or tag:<name>, got {scope!r}")
+    return kind, name
+
+def set_limit(scope, rate=None, burst=None, max_inflight=None):
+    kind, name = parse_scope(scope)
+    if rate is None and max_inflight is None:
+        raise ValueError("give --rate and/or --max-inflight")
+    if rate is not None and rate <= 0:
+        raise ValueError("rate must be positive")
+    if burst is not None and (rate is None or burst < 1):
+        raise ValueError("burst needs --rate and must be at least 1")
+    if max_inflight is not None and max_inflight < 0:
+        raise ValueError("max_inflight must be 0 (paused) or more")
+    limit = {}
+    if rate is not None:
+        # by default allow about one second's worth at once
+        limit.update(rate=rate, burst=burst or max(1.0, rate))
+    if max_inflight is not None:
+        limit['max_inflight'] = max_inflight
+    key = f"{kind}:{name}"
+    # each shard enforces it on its own jobs (see shards)
+    for _ in shards.each():
+        with storage.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", (storage.LIMIT_PREFIX + key, json.dumps(limit)))
+            # start the new limit with a full bucket
+            conn.execute("DELETE FROM rate_buckets WHERE scope=?", (key,))
+    print(f"limit {key}: {_describe(limit)}")
+
+def clear_limit(scope):
+    kind, name = parse_scope(scope)
+    key = f"{kind}:{name}"
+    removed = 0
+    for _ in shards.each():
+        with storage.transaction() as conn:
+            removed += conn.execute("DELETE FROM meta WHERE key=?", (storage.LIMIT_PREFIX + key,)).rowcount
+            conn.execute("DELETE FROM rate_buckets WHERE scope=?", (key,))
+    print(f"limit {key} cleared" if removed else f"no limit on {key}")
+
+def get_limits():
+    """{'queue:emails': {...}, ...} for every declared limit."""
+    rows = storage.fetch_all("SELECT key, value FROM meta WHERE key GLOB 'limit:*' ORDER BY key")
+    return {r['key'][len(storage.LIMIT_PREFIX):]: json.loads(r['value']) for r in rows}
+
+def show_limits():
+    limits = get_limits()
+    if not limits:
+        print("No limits set")
+    for key, limit in limits.items():
+        print(f"{key}: {_describe(limit)}")
+
+def _describe(limit):
+    parts = []
+    if 'rate' in limit:
+        parts.append(f"{limit['rate']:g}/s (burst {limit['burst']:g})")
+    if 'max_inflight' in limit:
+        parts.append(f"max {limit['max_inflight']} in flight")
+    return ', '.join(parts)
@@ -0,0 +1,133 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Every series lives at a fixed offset in a flat block of doubles: a histogram takes one
+slot per bucket plus count and sum, a counter one slot. Recording is a couple of float
+additions, with no I/O and no database access.
+
+The master gives each worker slot a block in shared memory (new_block) and the worker
+attaches it (attach), so what workers record is visible to the master without any
+messages. A restarted worker keeps its slot's block, so counters never go backwards.
+The master's listener (serve) sums the blocks on every scrape. It doesn't query the
+database. Processes without an attached block (the CLI, tests) record into a private one.
+"""
+import threading
+
+# seconds; spans sub-millisecond DB calls to hour-long jobs
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+DB_OPS = ('claim', 'apply_outcomes', 'mark_started', 'renew_leases', 'release_jobs', 'reap_expired_leases',
+          'requeue_owner_jobs')
+OUTCOMES = ('completed', 'retry', 'dlq')
+
+# name -> (type, help, label name, label values)
+SERIES = {
+    'queuectl_job_queue_wait_seconds': ('histogram', 'Time from a job becoming due to a worker claiming it.', None, None),
+    'queuectl_job_run_seconds': ('histogram', 'Run time of job commands.', None, None),
+    'queuectl_claim_seconds': ('histogram', 'Time a worker spends in one claim, waiting for the write lock included.',
+                               None, None),
+    'queuectl_db_op_seconds': ('histogram', 'Duration of storage operations.', 'op', DB_OPS),
+    'queuectl_job_attempts_total': ('counter', 'Finished job attempts by what happened to the job.', 'outcome',
+                                    OUTCOMES),
+}
+
+def _layout():
+    offsets, size = {}, 0
+    for name, (kind, _, _, values) in SERIES.items():
+        for value in values or (None,):
+            offsets[(name, value)] = size
+            size += len(BUCKETS) + 2 if kind == 'histogram' else 1
+    return offsets, size
+
+_OFFSETS, BLOCK_SIZE = _layout()
+
+def new_block():
+    """A zeroed block of shared memory for one process's series (create before forking)."""
+    import multiprocessing
+    return multiprocessing.RawArray('d', BLOCK_SIZE)
+
+_block = [0.0] * BLOCK_SIZE
+_lock = threading.Lock()
+
+def attach(block):
+    """Record into `block` (from new_block) from now on."""
+    global _block
+    _block = block
+
+def observe(name, seconds, label=None):
+    base = _OFFSETS[(name, label)]
+    i = 0
+    while i < len(BUCKETS) and seconds > BUCKETS[i]:
+        i += 1
+    with _lock:
+        if i < len(BUCKETS):
+            # beyond the last bound only +Inf, i.e. the count, goes up
+            _block[base + i] += 1
+        _block[base + len(BUCKETS)] += 1
+        _block[base + len(BUCKETS) + 1] += seconds
+
+def inc(name, label=None, amount=1):
+    with _lock:
+        _block[_OFFSETS[(name, label)]] += amount
+
+def _fmt(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+def render(blocks, gauges=()):
+    """
+    Prometheus text exposition of the sum of `blocks`, plus `gauges`: (name, help, value)
+    tuples the caller already holds in memory.
+    """
+    total = [sum(values) for values in zip(*blocks)] if blocks else [0.0] * BLOCK_SIZE
+    lines = []
+    for name, (kind, help_text, label, values) in SERIES.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for value in values or (None,):
+            base = _OFFSETS[(name, value)]
+            tag = f'{label}="{value}"' if label else ''
+            if kind == 'counter':
+                lines.append(f"{name}{{{tag}}} {_fmt(total[base])}" if tag else f"{name} {_fmt(total[base])}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, total[base:base + len(BUCKETS)]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{tag + "," if tag else ""}le="{bound}"}} {_fmt(cumulative)}')
+            count, total_seconds = total[base + len(BUCKETS)], total[base + len(BUCKETS) + 1]
+            lines.append(f'{name}_bucket{{{tag + "," if tag else ""}le="+Inf"}} {_fmt(count)}')
+            suffix = f"{{{tag}}}" if tag else ''
+            lines.append(f"{name}_sum{suffix} {_fmt(total_seconds)}")
+            lines.append(f"{name}_count{suffix} {_fmt(count)}")
+    for name, help_text, value in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_fmt(value)}"]
+    return '\n'.join(lines) + '\n'
+
+def serve(port, collect, host='127.0.0.1'):
+    """
+    Serve GET /metrics on `port` from a background thread; `collect()` returns the text.
+    Returns the server, or None if the port can't be bound.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = collect().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        print(f"Metrics listener unavailable on {host}:{port} ({e})")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-listener', daemon=True).start()
+    return server
@@ -1,22 +1,50 @@
-from dataclasses import dataclass, asdict
-from typing import Optional
+from dataclasses import dataclass
 import datetime
 
 @dataclass
 class Job:
     id: str
     command: str
-    state: str = 'pending'       # pending | processing | completed
+    state: str = 'pending'       # scheduled | waiting | pending | processing | completed | cancelled
     attempts: int = 0
     max_retries: int = 3
     created_at: str = None
     updated_at: str = None
     next_attempt_ts: int = 0     # epoch seconds
     timeout: int = 60            # seconds
+    priority: int = 0            # higher is claimed first
+    queue: str = 'default'
+    tag: str = None              # groups jobs for rate limits / concurrency caps across queues
+    depends_on: tuple = ()       # ids of jobs that must complete first
+    unmet: int = 0               # of those, how many haven't yet (set when stored)
+    dedup_key: str = None        # duplicates of this key are collapsed at enqueue
+    dedup_window: int = None     # seconds the key holds after enqueue (config dedup_window)
+    cache_ttl: int = None        # keep a successful result this long and reuse it (seconds)
 
     def __post_init__(self):
         now = datetime.datetime.utcnow().isoformat() + 'Z'
         if self.created_at is None:
             self.created_at = now
         if self.updated_at is None:
-            self.updated_at = now
\ No newline at end of file
+            self.updated_at = now
+
+@dataclass
+class Outcome:
+    """What one finished attempt does to its job; applied by storage.apply_outcomes."""
+    job_id: str
+    action: str                  # completed | retry | dlq
+    finished_at: int             # epoch seconds
+    command: str = None
+    attempts: int = 0
+    next_attempt_ts: int = 0     # retry: when the job becomes claimable again
+    last_error: str = None       # dlq: tail of the failing output
+    # timing of the attempt (epoch seconds, fractional), recorded in job_attempts when set
+    exit_code: int = None
+    claimed_at: float = None
+    started_at: float = None
+    ended_at: float = None
+    # result cache (completed jobs with a cache_ttl): `output` is stored for cache_ttl
+    # seconds, or, if the result came from the cache (cache_hit), its entry is marked used
+    cache_ttl: int = None
+    output: str = None
+    cache_hit: bool = False
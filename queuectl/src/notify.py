@@ -0,0 +1,108 @@
+"""
+Wakeup notifications between enqueuers and idle workers.
+
+The master owns a Unix datagram socket (WAKEUP_SOCK). Anything that makes work
+claimable (enqueue, DLQ retry, a retry being scheduled) sends it an empty
+datagram; the master then pokes every worker through that worker's own pipe.
+Idle workers block on their pipe instead of polling the database.
+"""
+import os
+import socket
+import threading
+from pathlib import Path
+
+WAKEUP_SOCK = Path.cwd() / 'queuectl_wakeup.sock'
+
+def send_wakeup():
+    """Tell a running master that new work may be claimable. No-op if none is listening."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        s.setblocking(False)
+        s.sendto(b'', str(WAKEUP_SOCK))
+    except OSError:
+        # no master, stale socket file or a full receive buffer (a wakeup is already queued)
+        pass
+    finally:
+        s.close()
+
+class Wakeup:
+    """
+    One worker's wakeup channel. Pokes are coalesced: any number of them before the
+    worker next waits wake it exactly once, and none are lost between a failed claim
+    and the following wait.
+    """
+    def __init__(self):
+        import multiprocessing
+        self._reader, self._writer = multiprocessing.Pipe(duplex=False)
+        # never let a poke block the master on a worker that stopped reading
+        os.set_blocking(self._writer.fileno(), False)
+
+    def poke(self):
+        try:
+            self._writer.send_bytes(b'')
+        except OSError:
+            # pipe full (already poked) or the worker is gone
+            pass
+
+    def wait(self, timeout):
+        """Block until poked or `timeout` seconds pass. Returns True if poked."""
+        woke = self._reader.poll(timeout)
+        while self._reader.poll(0):
+            self._reader.recv_bytes()
+        return woke
+
+class WakeupHub:
+    """Master side: one Wakeup per worker plus the listener on WAKEUP_SOCK."""
+    def __init__(self):
+        self._channels = {}
+        self._sock = None
+        self._stopped = threading.Event()
+
+    def channel(self, worker_id):
+        ch = self._channels[worker_id] = Wakeup()
+        return ch
+
+    def drop(self, worker_id):
+        self._channels.pop(worker_id, None)
+
+    def notify(self):
+        for ch in list(self._channels.values()):
+            ch.poke()
+
+    def listen(self):
+        """Bind WAKEUP_SOCK and forward datagrams to all workers from a background thread."""
+        try:
+            WAKEUP_SOCK.unlink()
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(str(WAKEUP_SOCK))
+        except OSError as e:
+            sock.close()
+            print(f"Wakeup socket unavailable ({e}); workers fall back to polling")
+            return False
+        sock.settimeout(1.0)
+        self._sock = sock
+        threading.Thread(target=self._serve, name='wakeup-listener', daemon=True).start()
+        return True
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                self._sock.recv(16)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.notify()
+
+    def close(self):
+        self._stopped.set()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                WAKEUP_SOCK.unlink()
+            except FileNotFoundError:
+                pass
@@ -1,9 +1,241 @@
+import base64
 import json
+import sys
 import time
-from . import storage
-from .models import Job
+from . import storage, notify, cron, client, shards
 import datetime
-import uuid
+
+_INSERT_JOB_SQL = ("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout,"
+                   "priority,queue,tag,unmet,cache_ttl) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)")
+
+# cron jobs: the same row, ignored if that firing was already materialized
+_INSERT_FIRED_SQL = _INSERT_JOB_SQL.replace("INSERT", "INSERT OR IGNORE", 1)
+
+# an existing job is only replaced by an enqueue of its id once it is in one of these
+# states; a job that is still waiting, queued or running absorbs the duplicate instead
+_REPLACEABLE = ('completed', 'cancelled')
+
+# seconds a dedup_key collapses duplicates after its job was enqueued (config dedup_window)
+DEDUP_WINDOW = 3600
+
+# jobs per transaction for enqueue --batch
+BATCH_CHUNK = 5000
+
+def _job_defaults():
+    """Config-backed defaults for optional payload fields; resolve once per enqueue call."""
+    return {
+        'max_retries': int(storage.fetch_one("SELECT value FROM meta WHERE key='max_retries'")['value']),
+        'timeout': int(storage.fetch_one("SELECT value FROM meta WHERE key='job_timeout'")['value']),
+    }
+
+def _new_id():
+    import uuid     # imported on first use: it probes the platform, and most payloads carry an id
+    return str(uuid.uuid4())
+
+def _epoch(value, field):
+    """An ISO 8601 time (UTC unless it says otherwise) or epoch seconds, as epoch seconds."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"job '{field}' must be an ISO 8601 time or epoch seconds, got {value!r}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+def _job_from_payload(data, defaults):
+    # models (dataclasses) is only needed to enqueue; status and list start without it
+    from .models import Job
+    if not isinstance(data, dict):
+        raise ValueError("job payload must be a JSON object")
+    if 'command' not in data:
+        raise ValueError("job payload must contain 'command'")
+    if 'cron' in data:
+        raise ValueError("a 'cron' payload is a schedule, not a job")
+    queue = data.get('queue', 'default')
+    if not isinstance(queue, str) or not queue:
+        raise ValueError("job 'queue' must be a non-empty string")
+    tag = data.get('tag')
+    if tag is not None and (not isinstance(tag, str) or not tag):
+        raise ValueError("job 'tag' must be a non-empty string")
+    try:
+        priority = int(data.get('priority') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("job 'priority' must be an integer")
+    depends_on = data.get('depends_on') or []
+    if not isinstance(depends_on, list) or not all(isinstance(d, str) and d for d in depends_on):
+        raise ValueError("job 'depends_on' must be a list of job ids")
+    dedup_key = data.get('dedup_key')
+    if dedup_key is not None and (not isinstance(dedup_key, str) or not dedup_key):
+        raise ValueError("job 'dedup_key' must be a non-empty string")
+    dedup_window, cache_ttl = _seconds(data, 'dedup_window'), _seconds(data, 'cache_ttl')
+    # a job due later waits as 'scheduled' until the claim that finds it due
+    run_at = _epoch(data['run_at'], 'run_at') if data.get('run_at') is not None else 0
+    now = datetime.datetime.utcnow().isoformat()+'Z'
+    return Job(
+        id=data.get('id') or _new_id(),
+        command=data['command'],
+        state='scheduled' if run_at > time.time() else 'pending',
+        attempts=0,
+        max_retries=int(data.get('max_retries') or defaults['max_retries']),
+        created_at=now,
+        updated_at=now,
+        next_attempt_ts=run_at,
+        timeout=int(data.get('timeout') or defaults['timeout']),
+        priority=priority,
+        queue=queue,
+        tag=tag,
+        depends_on=tuple(dict.fromkeys(depends_on)),
+        dedup_key=dedup_key,
+        dedup_window=dedup_window,
+        cache_ttl=cache_ttl,
+    )
+
+def _seconds(data, field):
+    value = data.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ValueError(f"job '{field}' must be a positive number of seconds")
+    return value
+
+def _job_row(job):
+    return (job.id, job.command, job.state, job.attempts, job.max_retries, job.created_at, job.updated_at,
+            job.next_attempt_ts, job.timeout, job.priority, job.queue, job.tag, job.unmet, job.cache_ttl)
+
+# ids per IN (...) lookup when resolving dependencies
+_LOOKUP_CHUNK = 500
+
+def _states(conn, table, ids):
+    """{id: state} (or {id: 'dlq'}) for those of `ids` present in `table`."""
+    column = 'state' if table == 'jobs' else "'dlq' AS state"
+    found = {}
+    for i in range(0, len(ids), _LOOKUP_CHUNK):
+        part = ids[i:i + _LOOKUP_CHUNK]
+        rows = conn.execute(f"SELECT id, {column} FROM {table} WHERE id IN ({','.join('?' * len(part))})", part)
+        found.update((r['id'], r['state']) for r in rows)
+    return found
+
+def _link(conn, jobs):
+    """
+    Resolve the dependencies of `jobs` (one enqueue chunk, in input order) and return the
+    edges to store. A dependency must already exist or come earlier in the same input, so
+    new jobs can't form a cycle. Completed dependencies are already met and get no edge;
+    each other one adds to the job's `unmet`, and a job with any waits as 'waiting'.
+    """
+    position = {job.id: i for i, job in enumerate(jobs)}
+    outside = list({d for job in jobs for d in job.depends_on if d not in position})
+    known = _states(conn, 'jobs', outside)
+    known.update(_states(conn, 'dlq', [d for d in outside if d not in known]))
+    edges = []
+    for i, job in enumerate(jobs):
+        for dep in job.depends_on:
+            state = 'new' if position.get(dep, i) < i else known.get(dep)
+            if dep == job.id or state is None:
+                raise ValueError(f"job {job.id} depends on {dep}, which isn't an earlier job "
+                                 f"(dependencies must be enqueued first)")
+            if state in ('dlq', 'cancelled'):
+                raise ValueError(f"job {job.id} depends on {dep}, which {'failed' if state == 'dlq' else 'was cancelled'}")
+            if state != 'completed':
+                edges.append((dep, job.id))
+                job.unmet += 1
+        if job.unmet:
+            job.state = 'waiting'
+    return edges
+
+def _collapse(conn, jobs):
+    """
+    Split `jobs` into those to store and duplicates, returned as (fresh, duplicates) with
+    duplicates as [id, existing id, existing state]. A job is a duplicate when its id
+    belongs to a job that isn't completed or cancelled, or when its dedup_key was taken
+    by a job that is unfinished or was enqueued less than its window ago. Within one
+    input the first occurrence wins.
+    """
+    seen = {}
+    existing = _states(conn, 'jobs', list({job.id for job in jobs}))
+    keyed = {}
+    if any(job.dedup_key for job in jobs):
+        now = int(time.time())
+        keyed = _live_keys(conn, list({job.dedup_key for job in jobs if job.dedup_key}), now)
+        row = conn.execute("SELECT value FROM meta WHERE key='dedup_window'").fetchone()
+        default_window = int(row['value']) if row else DEDUP_WINDOW
+    fresh, duplicates, keys = [], [], []
+    for job in jobs:
+        if job.id in seen:
+            dup = seen[job.id]
+        elif job.id in existing and existing[job.id] not in _REPLACEABLE:
+            dup = (job.id, existing[job.id])
+        else:
+            dup = keyed.get(job.dedup_key)
+        if dup is not None:
+            duplicates.append([job.id, *dup])
+            continue
+        fresh.append(job)
+        seen[job.id] = (job.id, job.state)
+        if job.dedup_key:
+            keyed[job.dedup_key] = (job.id, job.state)
+            keys.append((job.dedup_key, job.id, now + (job.dedup_window or default_window)))
+    # a completed or cancelled job has no dependency edges left, so replacing it is a plain delete + insert
+    conn.executemany(f"DELETE FROM jobs WHERE id=? AND state IN {_REPLACEABLE}",
+                     [(job.id,) for job in fresh if job.id in existing])
+    conn.executemany("INSERT OR REPLACE INTO dedup_keys(key, job_id, expires_at) VALUES(?,?,?)", keys)
+    return fresh, duplicates
+
+def _live_keys(conn, keys, now):
+    """{dedup_key: (job id, state)} for keys still held: in their window, or by an unfinished job."""
+    found = {}
+    for i in range(0, len(keys), _LOOKUP_CHUNK):
+        part = keys[i:i + _LOOKUP_CHUNK]
+        rows = conn.execute(f"SELECT d.key, j.id, j.state FROM dedup_keys d JOIN jobs j ON j.id=d.job_id "
+                            f"WHERE d.key IN ({','.join('?' * len(part))}) AND j.state!='cancelled' "
+                            f"AND (j.state!='completed' OR d.expires_at>?)", (*part, now))
+        found.update((r['key'], (r['id'], r['state'])) for r in rows)
+    return found
+
+def _store_jobs(jobs):
+    """
+    Insert `jobs` and their dependency edges, collapsing duplicates (see _collapse), in
+    one transaction per shard they go to. Returns (stored jobs, duplicates).
+    """
+    if shards.count() == 1:
+        return _store_shard(jobs)
+    stored, duplicates = [], []
+    for shard, group in _route(jobs).items():
+        with shards.using(shard):
+            kept, dups = _store_shard(group)
+        stored += kept
+        duplicates += dups
+    return stored, duplicates
+
+def _route(jobs):
+    """
+    {shard: jobs} in input order. An id that is already stored stays on its shard and a
+    job with dependencies joins them, so ids stay unique and edges never cross files;
+    anything else goes where shards.route hashes it.
+    """
+    placed = shards.locate(list({i for job in jobs for i in (job.id, *job.depends_on)}))
+    groups = {}
+    for job in jobs:
+        if job.id in placed:
+            shard = placed[job.id]
+        else:
+            homes = {placed[d] for d in job.depends_on if d in placed}
+            if len(homes) > 1:
+                raise ValueError(f"job {job.id} depends on jobs in different shards")
+            # an unknown dependency is reported by _link on the job's own shard
+            shard = homes.pop() if homes else shards.route(job)
+            placed[job.id] = shard
+        groups.setdefault(shard, []).append(job)
+    return groups
+
+def _store_shard(jobs):
+    with storage.transaction() as conn:
+        jobs, duplicates = _collapse(conn, jobs)
+        edges = _link(conn, jobs) if any(job.depends_on for job in jobs) else []
+        conn.executemany(_INSERT_JOB_SQL, [_job_row(job) for job in jobs])
+        conn.executemany("INSERT INTO job_deps(depends_on, job_id) VALUES(?,?)", edges)
+    return jobs, duplicates
 
 def enqueue_from_input(payload):
     """
@@ -17,54 +249,527 @@ def enqueue_from_input(payload):
     else:
         raise ValueError("enqueue requires either JSON payload or path to JSON file")
 
-    if 'id' not in data:
-        data['id'] = str(uuid.uuid4())
-    if 'command' not in data:
-        raise ValueError("job payload must contain 'command'")
+    remote = client.remote()
+    if remote is not None:
+        stored = remote.call('enqueue', payloads=[data])
+    else:
+        stored = _enqueue_payloads([data])
+        notify.send_wakeup()
+    for sched_id, expr, next_fire in stored['schedules']:
+        print(f"Scheduled recurring job {sched_id} ({expr}), first run {_iso(next_fire)}")
+    for job_id, existing, state in stored['duplicates']:
+        print(f"Job {job_id} not enqueued: duplicate of job {existing} ({state})")
+    for job_id, state, unmet, due in stored['jobs']:
+        if state == 'waiting':
+            print(f"Enqueued job {job_id}, waiting on {unmet} job(s)")
+        elif state == 'scheduled':
+            print(f"Enqueued job {job_id}, due {_iso(due)}")
+        else:
+            print(f"Enqueued job {job_id}")
 
-    job = Job(
-        id=data['id'],
-        command=data['command'],
-        state='pending',
-        attempts=0,
-        max_retries=int(data.get('max_retries') or storage.fetch_one("SELECT value FROM meta WHERE key='max_retries'")['value']),
-        created_at=datetime.datetime.utcnow().isoformat()+'Z',
-        updated_at=datetime.datetime.utcnow().isoformat()+'Z',
-        next_attempt_ts=0,
-        timeout=int(data.get('timeout') or storage.fetch_one("SELECT value FROM meta WHERE key='job_timeout'")['value'])
-    )
-    storage.execute("INSERT OR REPLACE INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) VALUES(?,?,?,?,?,?,?,?,?)",
-                    (job.id, job.command, job.state, job.attempts, job.max_retries, job.created_at, job.updated_at, job.next_attempt_ts, job.timeout))
-    print(f"Enqueued job {job.id}")
+def _enqueue_payloads(payloads):
+    """
+    Validate and store jobs and recurring jobs in one transaction. Returns
+    {'jobs': [[id, state, unmet, due]], 'schedules': [[id, cron, first fire]],
+     'duplicates': [[id, existing id, existing state]]}.
+    The queue daemon (src/server.py) stores its clients' enqueues through this too.
+    """
+    defaults = _job_defaults()
+    now = int(time.time())
+    jobs, schedules, duplicates = [], [], []
+    for data in payloads:
+        if isinstance(data, dict) and 'cron' in data:
+            schedules.append(_schedule_from_payload(data, defaults, now))
+        else:
+            jobs.append(_job_from_payload(data, defaults))
+    with storage.transaction():
+        if jobs:
+            jobs, duplicates = _store_jobs(jobs)
+        if schedules:
+            _store_schedules(schedules)
+    return {'jobs': [[j.id, j.state, j.unmet, j.next_attempt_ts] for j in jobs],
+            'schedules': [[row[0], row[1], row[3]] for row in schedules],
+            'duplicates': duplicates}
 
-def list_jobs(state=None):
-    if state:
-        rows = storage.fetch_all("SELECT * FROM jobs WHERE state=? ORDER BY created_at", (state,))
-    else:
-        rows = storage.fetch_all("SELECT * FROM jobs ORDER BY created_at")
+# longest single array element enqueue --batch will buffer while looking for its end
+MAX_RECORD_CHARS = 1 << 20
+
+def _iter_json_array(stream, buf, chunk_size=65536):
+    """
+    Yield the elements of a JSON array read incrementally from `stream`.
+    `buf` holds what was already read, starting just after the opening '['.
+    Malformed input is reported as soon as it is seen, never after reading the rest.
+    """
+    decoder = json.JSONDecoder()
+    eof = False
+    count = 0
+    expect_value = True
+
+    def read_more():
+        nonlocal buf, eof
+        if eof:
+            raise ValueError(f"truncated JSON array after element {count}")
+        more = stream.read(chunk_size)
+        eof = not more
+        buf += more
+
+    while True:
+        buf = buf.lstrip(' \t\r\n')
+        if not buf:
+            read_more()
+            continue
+        if not expect_value or (count == 0 and buf[0] == ']'):
+            # between elements: only a separator or the end of the array may follow
+            if buf[0] == ']':
+                return
+            if buf[0] != ',':
+                raise ValueError(f"expected ',' or ']' after element {count}, got {buf[:20]!r}")
+            buf = buf[1:]
+            expect_value = True
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise ValueError(f"element {count + 1}: {e}")
+            if len(buf) > MAX_RECORD_CHARS:
+                raise ValueError(f"element {count + 1} is malformed or longer than {MAX_RECORD_CHARS} characters")
+            read_more()
+            continue
+        count += 1
+        yield obj
+        buf = buf[end:]
+        expect_value = False
+
+def iter_payloads(stream):
+    """
+    Stream job payloads from JSON Lines or a single JSON array without loading the input.
+    """
+    first = ''
+    while not first.strip():
+        first = stream.readline()
+        if not first:
+            return
+    stripped = first.lstrip()
+    if stripped.startswith('['):
+        yield from _iter_json_array(stream, stripped[1:])
+        return
+    lineno = 1
+    line = first
+    while line:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {lineno}: {e}")
+        line = stream.readline()
+        lineno += 1
+
+def enqueue_batch(source, chunk_size=BATCH_CHUNK):
+    """
+    Bulk enqueue from a JSON Lines (or JSON array) file, or '-' for stdin.
+    Jobs are validated as they stream in and inserted `chunk_size` per transaction.
+    A job's `depends_on` may name jobs earlier in the same input.
+    """
+    import sys
+    stream = sys.stdin if source == '-' else open(source)
+    defaults = _job_defaults()
+    remote = client.remote()
+    total = 0
+    skipped = 0
+    chunk = []
+    schedules = []
+    raw = []
+    start = time.perf_counter()
+    try:
+        for n, data in enumerate(iter_payloads(stream), 1):
+            try:
+                if isinstance(data, dict) and 'cron' in data:
+                    schedules.append(_schedule_from_payload(data, defaults, int(time.time())))
+                else:
+                    chunk.append(_job_from_payload(data, defaults))
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"record {n}: {e} ({total} jobs already enqueued)")
+            if remote is not None:
+                # validated here for the record number; the daemon stores the payloads as sent
+                raw.append(data)
+            if len(chunk) + len(schedules) >= chunk_size:
+                stored, dups = _flush_batch(chunk, schedules, total, remote, raw)
+                total, skipped = total + stored, skipped + dups
+                chunk, schedules, raw = [], [], []
+        if chunk or schedules:
+            stored, dups = _flush_batch(chunk, schedules, total, remote, raw)
+            total, skipped = total + stored, skipped + dups
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else float(total)
+    print(f"Enqueued {total} jobs in {elapsed:.2f}s ({rate:.0f} jobs/sec)"
+          + (f", {skipped} duplicate(s) skipped" if skipped else ""))
+    return total
+
+def _flush_batch(jobs, schedules, total, remote=None, raw=()):
+    """Store one chunk. Returns (jobs and schedules stored, duplicates skipped)."""
+    duplicates = []
+    try:
+        if remote is not None:
+            duplicates = remote.call('enqueue', payloads=raw)['duplicates']
+        elif jobs:
+            jobs, duplicates = _store_jobs(jobs)
+            notify.send_wakeup()
+    except ValueError as e:
+        raise ValueError(f"{e} ({total} jobs already enqueued)")
+    if schedules and remote is None:
+        _store_schedules(schedules)
+    if remote is not None:
+        return len(jobs) + len(schedules) - len(duplicates), len(duplicates)
+    return len(jobs) + len(schedules), len(duplicates)
+
+def cancel_job(job_id):
+    """Cancel a job that hasn't been claimed yet, and every job that depends on it."""
+    now = int(time.time())
+    with shards.using(shards.locate([job_id]).get(job_id, 0)), storage.transaction() as conn:
+        row = conn.execute("UPDATE jobs SET state='cancelled', unmet=0, updated_at=?, finished_at=? WHERE id=? "
+                           "AND state IN ('pending', 'scheduled', 'waiting') RETURNING id", (now, now, job_id)).fetchone()
+        if row is None:
+            current = conn.execute("SELECT state FROM jobs WHERE id=?", (job_id,)).fetchone()
+            raise ValueError(f"job {job_id} is {current['state']} and can't be cancelled" if current
+                             else f"no job {job_id}")
+        conn.execute("DELETE FROM job_deps WHERE job_id=?", (job_id,))
+        dependents = storage.cancel_dependents(conn, [job_id], now)
+    print(f"Cancelled job {job_id}" + (f" and {dependents} job(s) depending on it" if dependents else ""))
+
+# ---------- recurring (cron) jobs ----------
+_UPSERT_SCHEDULE_SQL = ("INSERT INTO schedules(id,cron,payload,next_fire,rev) VALUES(?,?,?,?,?) "
+                        "ON CONFLICT(id) DO UPDATE SET cron=excluded.cron, payload=excluded.payload, "
+                        "next_fire=excluded.next_fire, rev=excluded.rev")
+
+def _iso(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _schedule_from_payload(data, defaults, now):
+    """(id, cron, job template JSON, first fire) for a payload with a 'cron' field."""
+    for field in ('run_at', 'depends_on', 'dedup_key'):
+        if field in data:
+            raise ValueError(f"'{field}' and 'cron' can't be combined")
+    expr = data['cron']
+    if not isinstance(expr, str):
+        raise ValueError("job 'cron' must be a string")
+    template = {k: v for k, v in data.items() if k not in ('id', 'cron')}
+    # the jobs it creates must be valid too
+    _job_from_payload(template, defaults)
+    next_fire = cron.parse(expr).next_after(now)
+    return data.get('id') or _new_id(), expr, json.dumps(template), next_fire
+
+def add_schedules(payloads):
+    """
+    Store (or replace, by id) recurring jobs. Each gets a new rev so a running master's
+    scheduler picks it up. Returns [(id, first fire time)].
+    """
+    defaults = _job_defaults()
+    now = int(time.time())
+    return _store_schedules([_schedule_from_payload(data, defaults, now) for data in payloads])
+
+def _store_schedules(rows):
+    with storage.transaction() as conn:
+        rev = storage.bump_rev(conn, 'schedules_rev')
+        conn.executemany(_UPSERT_SCHEDULE_SQL, [(*row, rev) for row in rows])
+    return [(row[0], row[3]) for row in rows]
+
+def list_schedules():
+    rows = storage.fetch_all("SELECT id, cron, payload, next_fire FROM schedules ORDER BY next_fire, id")
+    if not rows:
+        print("No recurring jobs")
     for r in rows:
-        print(dict(r))
+        print(f"{r['id']} | {r['cron']} | next {_iso(r['next_fire'])} | {json.loads(r['payload'])['command']}")
+
+def remove_schedule(sched_id):
+    """Delete a recurring job; jobs it already created are left alone."""
+    with storage.transaction() as conn:
+        removed = conn.execute("DELETE FROM schedules WHERE id=?", (sched_id,)).rowcount
+    print(f"Removed schedule {sched_id}" if removed else f"No schedule {sched_id}")
+
+# ---------- listing ----------
+# Jobs are listed in (created_at, id) order and DLQ entries in (failed_at, id) order. A
+# cursor encodes the last row's key; the next page starts strictly after it, so every
+# page is an index seek however deep into the table it is.
+_LIST_KEYS = {'jobs': 'created_at', 'dlq': 'failed_at'}
+LIST_PAGE = 500
+
+def encode_cursor(table, row):
+    key = json.dumps([row[_LIST_KEYS[table]], row['id']])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    try:
+        value, job_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return value, job_id
+
+def _time_bound(table, value):
+    """A --since/--until value (ISO 8601) in the table's time format."""
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"expected an ISO 8601 time, got {value!r}")
+    if table == 'jobs':
+        # created_at is ISO text: compare as text, so '2024-01-01' works as a prefix
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+def iter_rows(table, state=None, queue=None, prefix=None, since=None, until=None, after=None,
+              limit=None, page_size=LIST_PAGE):
+    """
+    Yield rows of `jobs` or `dlq` oldest first, a page at a time, never loading the whole
+    table. Filters: state and queue (jobs only), command prefix, since/until (ISO 8601,
+    on created_at or failed_at), and `after` (a cursor from encode_cursor).
+    With several shards, each is read in key order and the streams are merged, so the
+    order and the cursors are the same as with one.
+    """
+    args = (table, state, queue, prefix, since, until, after, limit, page_size)
+    if shards.count() == 1:
+        yield from _iter_shard(*args)
+        return
+    import heapq
+    import itertools
+    key = _LIST_KEYS[table]
+    streams = [_on_shard(shard, _iter_shard(*args)) for shard in range(shards.count())]
+    yield from itertools.islice(heapq.merge(*streams, key=lambda r: (r[key], r['id'])), limit)
+
+def _on_shard(shard, rows):
+    """Advance the generator `rows` with storage pointed at `shard`."""
+    while True:
+        with shards.using(shard):
+            row = next(rows, None)
+        if row is None:
+            return
+        yield row
+
+def _iter_shard(table, state, queue, prefix, since, until, after, limit, page_size):
+    key = _LIST_KEYS[table]
+    where, params = [], []
+    if state:
+        where.append("state=?")
+        params.append(state)
+    if queue:
+        where.append("queue=?")
+        params.append(queue)
+    if prefix:
+        where.append("substr(command, 1, ?)=?")
+        params += [len(prefix), prefix]
+    if since:
+        where.append(f"{key}>=?")
+        params.append(_time_bound(table, since))
+    if until:
+        where.append(f"{key}<?")
+        params.append(_time_bound(table, until))
+    last = _decode_cursor(after) if after else None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        clauses = where + ([f"({key}, id) > (?, ?)"] if last else [])
+        sql = (f"SELECT * FROM {table}" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+               + f" ORDER BY {key}, id LIMIT ?")
+        n = page_size if remaining is None else min(page_size, remaining)
+        page = storage.fetch_all(sql, (*params, *(last or ()), n))
+        yield from page
+        if len(page) < n:
+            return
+        last = (page[-1][key], page[-1]['id'])
+        if remaining is not None:
+            remaining -= len(page)
 
-def list_dlq():
-    rows = storage.fetch_all("SELECT * FROM dlq ORDER BY failed_at")
+def _print_rows(table, rows, limit, fmt):
+    count = 0
+    last = None
     for r in rows:
-        print(dict(r))
+        print(json.dumps(dict(r)) if fmt == 'jsonl' else dict(r))
+        count += 1
+        last = r
+    if limit is not None and count == limit:
+        # more may follow: this resumes right after the last row printed
+        print(f"next: --after {encode_cursor(table, last)}", file=sys.stderr)
 
-def retry_dlq_job(job_id):
-    row = storage.fetch_one("SELECT * FROM dlq WHERE id=?", (job_id,))
-    if not row:
+def list_jobs(state=None, limit=None, after=None, fmt='text', queue=None, prefix=None, since=None, until=None):
+    """Print jobs oldest first (as dicts, or JSON Lines with fmt='jsonl'), streaming page by page."""
+    rows = iter_rows('jobs', state=state, queue=queue, prefix=prefix, since=since, until=until,
+                     after=after, limit=limit)
+    _print_rows('jobs', rows, limit, fmt)
+
+def list_dlq(limit=None, after=None, fmt='text', prefix=None, since=None, until=None):
+    rows = iter_rows('dlq', prefix=prefix, since=since, until=until, after=after, limit=limit)
+    _print_rows('dlq', rows, limit, fmt)
+
+# ---------- DLQ bulk operations ----------
+# DLQ entries per transaction for dlq retry/purge
+DLQ_CHUNK = 1000
+
+def _dlq_filter(job_id=None, match=None, since=None):
+    where, params = [], []
+    if job_id is not None:
+        where.append("id=?")
+        params.append(job_id)
+    if match:
+        where.append("(command GLOB ? OR last_error GLOB ?)")
+        params += [match, match]
+    if since:
+        where.append("failed_at>=?")
+        params.append(int(since) if str(since).isdigit() else _time_bound('dlq', since))
+    return where, params
+
+def _dlq_chunks(where, params, chunk_size):
+    """
+    Yield (connection, rows) for successive chunks of matching DLQ entries, each inside
+    its own write transaction, walking (failed_at, id) so skipped entries aren't revisited.
+    """
+    last = None
+    while True:
+        with storage.transaction() as conn:
+            clauses = where + (["(failed_at, id) > (?, ?)"] if last else [])
+            sql = ("SELECT rowid, id, failed_at FROM dlq" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+                   + " ORDER BY failed_at, id LIMIT ?")
+            rows = conn.execute(sql, (*params, *(last or ()), chunk_size)).fetchall()
+            if not rows:
+                return
+            yield conn, rows
+        last = (rows[-1]['failed_at'], rows[-1]['id'])
+
+def _dlq_chunks_all(where, params, chunk_size):
+    """_dlq_chunks over every shard in turn."""
+    for _ in shards.each():
+        yield from _dlq_chunks(where, params, chunk_size)
+
+def retry_dlq(job_id=None, match=None, since=None, rate=None, chunk_size=DLQ_CHUNK):
+    """
+    Move DLQ entries back to pending with their original settings (max_retries, timeout,
+    priority, queue, tag) and fresh attempts. Select one id, or everything matching `match`
+    (a glob on command or last_error) and/or failed since `since`. With `rate` (jobs per
+    second) they become due gradually instead of all at once. Entries whose id is already
+    back in `jobs` are left in the DLQ. Returns (moved, skipped).
+    """
+    if rate is not None and rate <= 0:
+        raise ValueError("rate must be positive")
+    where, params = _dlq_filter(job_id, match, since)
+    defaults = _job_defaults()
+    now = datetime.datetime.utcnow().isoformat() + 'Z'
+    now_ts = int(time.time())
+    moved = skipped = 0
+    # a DLQ entry goes back to the shard it failed on
+    for conn, rows in _dlq_chunks_all(where, params, chunk_size):
+        marks = ','.join('?' * len(rows))
+        rowids = [r['rowid'] for r in rows]
+        free = [r[0] for r in conn.execute(
+            f"SELECT rowid FROM dlq WHERE rowid IN ({marks}) AND id NOT IN (SELECT id FROM jobs)", rowids)]
+        skipped += len(rows) - len(free)
+        if not free:
+            continue
+        marks = ','.join('?' * len(free))
+        # with a rate, job n (counting across chunks) is due n/rate seconds from now
+        # due now (so its queue wait starts now, not at the original enqueue) or staggered by rate
+        due = "?" if rate is None else "? + CAST((? + ROW_NUMBER() OVER (ORDER BY failed_at, id) - 1) / ? AS INTEGER)"
+        due_params = (now_ts,) if rate is None else (now_ts, moved, float(rate))
+        conn.execute(f"INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout,"
+                     f"priority,queue,tag) "
+                     f"SELECT id, command, CASE WHEN {due} > ? THEN 'scheduled' ELSE 'pending' END, 0, "
+                     f"COALESCE(max_retries, ?), COALESCE(created_at, ?), ?, {due}, "
+                     f"COALESCE(timeout, ?), COALESCE(priority, 0), COALESCE(queue, 'default'), tag "
+                     f"FROM dlq WHERE rowid IN ({marks})",
+                     (*due_params, now_ts, defaults['max_retries'], now, now, *due_params, defaults['timeout'], *free))
+        conn.execute(f"DELETE FROM dlq WHERE rowid IN ({marks})", free)
+        moved += len(free)
+    if moved:
+        notify.send_wakeup()
+    return moved, skipped
+
+def purge_dlq(job_id=None, match=None, since=None, chunk_size=DLQ_CHUNK):
+    """
+    Delete matching DLQ entries (same selection as retry_dlq), a chunk per transaction,
+    and their output logs. Returns the count.
+    """
+    from . import joblogs
+    where, params = _dlq_filter(job_id, match, since)
+    purged = 0
+    for conn, rows in _dlq_chunks_all(where, params, chunk_size):
+        marks = ','.join('?' * len(rows))
+        ids = [r['id'] for r in conn.execute(f"DELETE FROM dlq WHERE rowid IN ({marks}) RETURNING id",
+                                             [r['rowid'] for r in rows])]
+        for gone in ids:
+            joblogs.remove(gone)
+        purged += len(ids)
+    return purged
+
+def _require_selection(job_id, select_all, match, since):
+    if job_id is None and not (select_all or match or since):
+        raise ValueError("give a job id, --all, --match PATTERN or --since TIME")
+    if job_id is not None and (select_all or match or since):
+        raise ValueError("a job id can't be combined with --all/--match/--since")
+
+def retry_dlq_job(job_id=None, select_all=False, match=None, since=None, rate=None):
+    """`dlq retry`: one id, or a filtered bulk retry."""
+    _require_selection(job_id, select_all, match, since)
+    moved, skipped = retry_dlq(job_id, match, since, rate)
+    if job_id is not None and not (moved or skipped):
         print("Job not found in DLQ")
         return
-    # move back to jobs with reset attempts and pending state
-    now = datetime.datetime.utcnow().isoformat()+'Z'
-    storage.execute("INSERT OR REPLACE INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) VALUES(?,?,?,?,?,?,?,?,?)",
-                    (row['id'], row['command'], 'pending', 0, row['attempts'], now, now, 0, 60))
-    storage.execute("DELETE FROM dlq WHERE id=?", (job_id,))
-    print(f"Moved {job_id} from DLQ back to pending")
+    if job_id is not None and moved:
+        print(f"Moved {job_id} from DLQ back to pending")
+    else:
+        pace = f", released at {rate}/s" if rate and moved else ""
+        print(f"Moved {moved} job(s) from DLQ back to pending{pace}")
+    if skipped:
+        print(f"Skipped {skipped} entr{'y' if skipped == 1 else 'ies'} whose id is already in the queue")
 
-def print_status():
-    rows = storage.fetch_all("SELECT state, COUNT(*) as cnt FROM jobs GROUP BY state")
-    for r in rows:
-        print(f"{r['state']}: {r['cnt']}")
-    dlq_count = storage.fetch_one("SELECT COUNT(*) as c FROM dlq")['c']
+def purge_dlq_jobs(job_id=None, select_all=False, match=None, since=None):
+    """`dlq purge`: drop DLQ entries for good."""
+    _require_selection(job_id, select_all, match, since)
+    print(f"Purged {purge_dlq(job_id, match, since)} DLQ entr{'y' if job_id else 'ies'}")
+
+def _job_finished(job_id):
+    """True once the job can write no more output: completed, cancelled, or gone from `jobs` (DLQ, retention)."""
+    with shards.using(shards.locate([job_id]).get(job_id, 0)):
+        row = storage.fetch_one("SELECT state FROM jobs WHERE id=?", (job_id,))
+    # scheduled and waiting jobs haven't run yet: a follower keeps waiting for them
+    return row is None or row['state'] in ('completed', 'cancelled')
+
+def show_log(job_id, follow=False, tail=None):
+    """
+    Print a job's output log, or its last `tail` lines. With `follow`, keep printing new
+    output until the job completes or moves to the DLQ.
+    """
+    from . import joblogs
+    out = sys.stdout.buffer
+    paths = joblogs.segments(job_id)
+    if not paths and not follow:
+        print(f"No log for job {job_id}")
+        return
+    sizes = [p.stat().st_size for p in paths]
+    end = sum(sizes)
+    active = sizes[-1] if paths and paths[-1] == joblogs.log_path(job_id) else 0
+    if tail is not None:
+        out.write(joblogs.tail_lines(job_id, tail, end))
+    else:
+        for pos in range(0, end, joblogs.CHUNK_SIZE):
+            out.write(joblogs.read_range(job_id, pos, min(pos + joblogs.CHUNK_SIZE, end)))
+    out.flush()
+    if follow:
+        try:
+            for chunk in joblogs.follow(job_id, lambda: _job_finished(job_id), offset=active):
+                out.write(chunk)
+                out.flush()
+        except KeyboardInterrupt:
+            pass
+
+def print_status(recount=False):
+    """Job counts by state and the DLQ size, from the queue_stats counters (rebuilt first with `recount`)."""
+    remote = client.remote()
+    if recount:
+        for _ in shards.each():
+            storage.recount_stats()
+    counts = remote.call('status') if remote is not None else shards.state_counts()
+    dlq_count = counts.pop('dlq')
+    for state, cnt in counts.items():
+        print(f"{state}: {cnt}")
     print(f"dlq: {dlq_count}")
\ No newline at end of file
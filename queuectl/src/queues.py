@@ -0,0 +1,60 @@
+"""
+Which named queues a worker claims from, and in what order.
+
+`worker start --queues a,b --weights 3,1` gives every worker a QueueSelector. Before each
+claim the worker asks it for an order of queues; storage.atomic_claim_jobs tries them in
+that order, so an empty queue never idles the worker while another has work.
+
+- strict: always the listed order; b is only served when a has nothing due.
+- weighted: smooth weighted round-robin over the weights, so with 3,1 a leads three claims
+  in four, spread out (a a b a ...) rather than in bursts; the rest follow by weight.
+"""
+
+STRATEGIES = ('weighted', 'strict')
+
+class QueueSelector:
+    def __init__(self, queues, weights=None, strategy='weighted'):
+        if not queues:
+            raise ValueError("at least one queue is required")
+        if len(set(queues)) != len(queues):
+            raise ValueError("queues must be distinct")
+        weights = list(weights) if weights else [1] * len(queues)
+        if len(weights) != len(queues):
+            raise ValueError("--weights needs one weight per queue")
+        if any(w <= 0 for w in weights):
+            raise ValueError("weights must be positive")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of {', '.join(STRATEGIES)}")
+        self.queues = list(queues)
+        self.weights = weights
+        self.strategy = strategy
+        self._current = [0] * len(queues)
+        # fallback order once the picked queue is served: heaviest first, ties as listed
+        self._by_weight = sorted(range(len(queues)), key=lambda i: -weights[i])
+
+    def order(self):
+        """The queues to claim from next, most preferred first."""
+        if self.strategy == 'strict':
+            return list(self.queues)
+        total = sum(self.weights)
+        for i, w in enumerate(self.weights):
+            self._current[i] += w
+        pick = max(range(len(self.queues)), key=lambda i: self._current[i])
+        self._current[pick] -= total
+        return [self.queues[pick]] + [self.queues[i] for i in self._by_weight if i != pick]
+
+    def __repr__(self):
+        return f"QueueSelector({self.queues}, {self.weights}, {self.strategy!r})"
+
+def parse_selector(queues, weights=None, strategy='weighted'):
+    """Build a QueueSelector from the CLI's comma-separated --queues/--weights, or None for all queues."""
+    if not queues:
+        if weights:
+            raise ValueError("--weights needs --queues")
+        return None
+    names = [q.strip() for q in queues.split(',') if q.strip()]
+    try:
+        values = [int(w) for w in weights.split(',')] if weights else None
+    except ValueError:
+        raise ValueError(f"--weights must be comma-separated integers, got {weights!r}")
+    return QueueSelector(names, values, strategy)
@@ -0,0 +1,186 @@
+"""
+Retention for finished (completed or cancelled) jobs.
+
+Finished jobs leave the hot `jobs` table once they are older than `retention_seconds`
+or beyond the newest `retention_keep` of them. In `archive` mode (the default) they
+are first copied into monthly archive databases (ARCHIVE_DIR/queue-YYYY-MM.db, by
+finishing time); in `delete` mode they are just dropped. Their output logs go with them.
+
+Rows move in batches of RETENTION_BATCH, each in its own short transaction, so workers
+are never locked out for long. Each batch is copied and committed before it is deleted:
+a crash in between only leaves a duplicate that the next pass overwrites. Freed pages
+are returned to the OS with incremental vacuum. Per-attempt timing rows (job_attempts)
+older than `retention_seconds` are deleted the same way.
+
+The DLQ is kept until purged by default: its entries are failures waiting for someone to
+look at them. With `dlq_retention_seconds` set, entries that failed longer ago than that
+are deleted, with their logs, on the same schedule.
+
+With several shards (src/shards.py) each file gets its own pass, all archiving into the
+same monthly databases; `retention_keep` counts completions per shard.
+"""
+import time
+from pathlib import Path
+
+from . import storage, config, joblogs, shards
+
+ARCHIVE_DIR = Path.cwd() / 'archive'
+DEFAULT_RETENTION_SECONDS = 7 * 24 * 3600
+DEFAULT_INTERVAL = 300
+RETENTION_BATCH = 1000
+MODES = ('archive', 'delete')
+
+def settings():
+    """(retention_seconds, retention_keep, retention_mode) from config; 0 disables a limit."""
+    ttl = config.get_config('retention_seconds')
+    ttl = DEFAULT_RETENTION_SECONDS if ttl is None else int(ttl)
+    keep = int(config.get_config('retention_keep') or 0)
+    mode = config.get_config('retention_mode') or 'archive'
+    if mode not in MODES:
+        raise ValueError(f"retention_mode must be one of {', '.join(MODES)}, got {mode!r}")
+    return ttl, keep, mode
+
+def archive_path(month):
+    return ARCHIVE_DIR / f"queue-{month}.db"
+
+def _expired_batch(conn, cutoff, limit):
+    return conn.execute("SELECT rowid, id, strftime('%Y-%m', finished_at, 'unixepoch') AS month "
+                        f"FROM jobs INDEXED BY idx_jobs_finished "
+                        f"WHERE {storage.FINISHED} AND finished_at<? ORDER BY finished_at LIMIT ?",
+                        (cutoff, limit)).fetchall()
+
+def _count_cutoff(conn, keep):
+    """finished_at of the oldest finished job `keep` must retain, or None if there are no more than that."""
+    row = conn.execute(f"SELECT finished_at FROM jobs INDEXED BY idx_jobs_finished WHERE {storage.FINISHED} "
+                       f"ORDER BY finished_at DESC LIMIT 1 OFFSET ?", (keep - 1,)).fetchone()
+    return row['finished_at'] if row else None
+
+def _attach_archive(conn, month, attached):
+    alias = attached.get(month)
+    if alias:
+        return alias
+    alias = attached[month] = f"archive_{month.replace('-', '_')}"
+    ARCHIVE_DIR.mkdir(exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS " + alias, (str(archive_path(month)),))
+    cols = [r['name'] for r in conn.execute("PRAGMA main.table_info(jobs)")]
+    have = {r['name'] for r in conn.execute(f"PRAGMA {alias}.table_info(jobs)")}
+    if not have:
+        rest = ', '.join(c for c in cols if c != 'id')
+        conn.execute(f"CREATE TABLE {alias}.jobs (id TEXT PRIMARY KEY, {rest})")
+    # archives created before a migration get the newer columns
+    for col in cols:
+        if have and col not in have:
+            conn.execute(f"ALTER TABLE {alias}.jobs ADD COLUMN {col}")
+    return alias
+
+def _archive(conn, batch, attached):
+    cols = ', '.join(r['name'] for r in conn.execute("PRAGMA main.table_info(jobs)"))
+    by_month = {}
+    for r in batch:
+        by_month.setdefault(r['month'], []).append(r['rowid'])
+    for month, rowids in by_month.items():
+        alias = _attach_archive(conn, month, attached)
+        marks = ','.join('?' * len(rowids))
+        with storage.transaction():
+            conn.execute(f"INSERT OR REPLACE INTO {alias}.jobs({cols}) SELECT {cols} FROM main.jobs "
+                         f"WHERE rowid IN ({marks}) AND {storage.FINISHED}", rowids)
+
+def _remove(conn, batch):
+    marks = ','.join('?' * len(batch))
+    with storage.transaction():
+        # a job re-queued since the batch was read stays
+        removed = conn.execute(f"DELETE FROM main.jobs WHERE rowid IN ({marks}) AND {storage.FINISHED}",
+                               [r['rowid'] for r in batch]).rowcount
+    for r in batch:
+        joblogs.remove(r['id'])
+    return removed
+
+def _prune_attempts(conn, cutoff):
+    """Drop job_attempts rows finished before `cutoff`, RETENTION_BATCH per transaction."""
+    removed = 0
+    while True:
+        with storage.transaction():
+            n = conn.execute("DELETE FROM job_attempts WHERE rowid IN (SELECT rowid FROM job_attempts "
+                             "INDEXED BY idx_attempts_finished WHERE finished_at<? LIMIT ?)",
+                             (cutoff, RETENTION_BATCH)).rowcount
+        removed += n
+        if n < RETENTION_BATCH:
+            return removed
+
+def _prune_dlq(conn, cutoff):
+    """Delete DLQ entries (and their logs) that failed before `cutoff`, RETENTION_BATCH per transaction."""
+    removed = 0
+    while True:
+        with storage.transaction():
+            ids = [r['id'] for r in conn.execute(
+                "DELETE FROM dlq WHERE rowid IN (SELECT rowid FROM dlq INDEXED BY idx_dlq_failed "
+                "WHERE failed_at<? ORDER BY failed_at LIMIT ?) RETURNING id", (cutoff, RETENTION_BATCH))]
+        for job_id in ids:
+            joblogs.remove(job_id)
+        removed += len(ids)
+        if len(ids) < RETENTION_BATCH:
+            return removed
+
+def _prune_keys(conn, now):
+    """Drop expired result cache entries, and dedup keys past their window whose job has finished."""
+    with storage.transaction():
+        conn.execute("DELETE FROM result_cache WHERE expires_at<=?", (now,))
+        conn.execute("DELETE FROM dedup_keys WHERE expires_at<=? AND NOT EXISTS (SELECT 1 FROM jobs "
+                     "WHERE id=dedup_keys.job_id AND state NOT IN ('completed', 'cancelled'))", (now,))
+
+def run_once(now=None):
+    """One retention pass. Returns the number of finished jobs moved out of `jobs`."""
+    ttl, keep, mode = settings()
+    now = int(time.time()) if now is None else now
+    conn = storage.get_conn()
+    attached = {}
+    total = 0
+    cutoffs = [now - ttl] if ttl > 0 else []
+    _prune_keys(conn, now)
+    dlq_ttl = int(config.get_config('dlq_retention_seconds') or 0)
+    if dlq_ttl > 0:
+        _prune_dlq(conn, now - dlq_ttl)
+    if ttl > 0:
+        # attempt history ages out on the same clock, whatever happened to its job
+        _prune_attempts(conn, now - ttl)
+    if keep > 0:
+        # deleting older rows doesn't move this, so it holds for the whole pass
+        oldest_kept = _count_cutoff(conn, keep)
+        if oldest_kept is not None:
+            cutoffs.append(oldest_kept)
+    if not cutoffs:
+        return 0
+    try:
+        while True:
+            batch = _expired_batch(conn, max(cutoffs), RETENTION_BATCH)
+            if not batch:
+                break
+            if mode == 'archive':
+                _archive(conn, batch, attached)
+            total += _remove(conn, batch)
+    finally:
+        for alias in attached.values():
+            conn.execute("DETACH DATABASE " + alias)
+    if total:
+        # give the freed pages back a bounded chunk at a time
+        conn.execute("PRAGMA incremental_vacuum(2000)").fetchall()
+    return total
+
+def vacuum():
+    """
+    Full VACUUM. Also converts a queue.db created before incremental auto_vacuum, which
+    the connection pragma can't do on its own. Blocks writers while it runs.
+    """
+    conn = storage.get_conn()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+def collect(full_vacuum=False):
+    """`queuectl gc`: run retention now, optionally followed by a full VACUUM."""
+    moved = sum(run_once() for _ in shards.each())
+    _, _, mode = settings()
+    print(f"Retention: {'archived' if mode == 'archive' else 'deleted'} {moved} finished job(s)")
+    if full_vacuum:
+        for shard in shards.each():
+            vacuum()
+            print(f"Vacuumed {shards.path(shard).name}")
@@ -0,0 +1,98 @@
+"""
+Materializes recurring (cron) jobs in the master.
+
+`enqueue` with a `cron` field stores a row in `schedules` (queue_manager.add_schedules).
+The master's Scheduler keeps a min-heap of (next fire time, schedule id) built once from
+that table, so a tick only looks at the top of the heap instead of scanning every
+schedule. Schedules added or replaced later get a higher `rev` and are picked up with a
+seek on idx_schedules_rev; heap entries they supersede are skipped when they surface.
+
+Firing inserts the job (id `<schedule id>@<fire time>`, ignored if it already exists) and
+moves next_fire on in the same transaction, and only if next_fire is still the time being
+fired, so each firing happens once. A job for another shard commits in its own file
+first; if the master dies before next_fire moves, the refire is ignored by id. A
+schedule that came due while no master was running fires once, then continues from now.
+"""
+import heapq
+import json
+import time
+
+from . import storage, queue_manager, cron, shards
+
+# schedules fired per tick at most, so a burst of due schedules can't stall the master loop
+FIRE_BATCH = 500
+
+class Scheduler:
+    def __init__(self):
+        self._heap = []      # (next_fire, schedule id, rev)
+        self._rev = {}       # schedule id -> rev of its live heap entry
+        self._seen = 0       # highest rev loaded
+
+    def sync(self):
+        """Load schedules added or changed since the last sync (all of them the first time)."""
+        rows = storage.fetch_all("SELECT id, next_fire, rev FROM schedules INDEXED BY idx_schedules_rev "
+                                 "WHERE rev>? ORDER BY rev", (self._seen,))
+        for r in rows:
+            self._rev[r['id']] = r['rev']
+            self._heap.append((r['next_fire'], r['id'], r['rev']))
+            self._seen = r['rev']
+        if rows:
+            heapq.heapify(self._heap)
+
+    def _top(self):
+        while self._heap and self._rev.get(self._heap[0][1]) != self._heap[0][2]:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def next_fire(self):
+        """Epoch seconds of the earliest schedule due, or None."""
+        top = self._top()
+        return top[0] if top else None
+
+    def fire_due(self, now=None):
+        """Create the jobs of schedules due by `now`, in one transaction. Returns how many fired."""
+        now = int(time.time() if now is None else now)
+        fired = 0
+        defaults = queue_manager._job_defaults()
+        with storage.transaction() as conn:
+            for _ in range(FIRE_BATCH):
+                top = self._top()
+                if top is None or top[0] > now:
+                    break
+                when, sched_id, rev = heapq.heappop(self._heap)
+                nxt, created = self._fire(conn, sched_id, rev, when, now, defaults)
+                fired += created
+                if nxt is None:
+                    del self._rev[sched_id]
+                else:
+                    heapq.heappush(self._heap, (nxt, sched_id, rev))
+        return fired
+
+    def _fire(self, conn, sched_id, rev, when, now, defaults):
+        """
+        Fire one schedule. Returns (next fire time or None if it is gone or replaced,
+        whether a job was created).
+        """
+        row = conn.execute("SELECT cron, payload, next_fire, rev FROM schedules WHERE id=?", (sched_id,)).fetchone()
+        if row is None or row['rev'] != rev:
+            # removed, or replaced and not synced yet: the next sync brings the new version
+            return None, False
+        if row['next_fire'] != when:
+            # fired elsewhere in the meantime; follow it
+            return row['next_fire'], False
+        try:
+            nxt = cron.parse(row['cron']).next_after(max(now, when))
+        except ValueError as e:
+            print(f"Scheduler: dropping schedule {sched_id}: {e}")
+            conn.execute("DELETE FROM schedules WHERE id=?", (sched_id,))
+            return None, False
+        job = queue_manager._job_from_payload({**json.loads(row['payload']), 'id': f"{sched_id}@{when}"}, defaults)
+        shard = shards.route(job)
+        if shard == 0:
+            conn.execute(queue_manager._INSERT_FIRED_SQL, queue_manager._job_row(job))
+        else:
+            # commits on its own before next_fire moves; a refire after a crash is ignored by id
+            with shards.using(shard):
+                storage.execute(queue_manager._INSERT_FIRED_SQL, queue_manager._job_row(job))
+        conn.execute("UPDATE schedules SET next_fire=? WHERE id=?", (nxt, sched_id))
+        return nxt, True
@@ -0,0 +1,206 @@
+"""
+`queuectl serve`: a long-lived daemon that does the queue's writes for its clients.
+
+It listens on client.SERVE_SOCK (a Unix stream socket next to queue.db). While it runs,
+`enqueue`, `status` and the workers' claim / ack / lease renewal / release go through
+it (src/client.py) instead of each process opening queue.db and taking the write lock.
+
+A single writer thread applies every request. It takes all requests waiting (up to
+GROUP_MAX), runs each in its own SAVEPOINT inside one BEGIN IMMEDIATE transaction and
+commits once, then answers them: a group commit. Requests arriving during a commit
+wait for the next one, so the batch grows with the load and no delay is added when
+idle. A request that fails is rolled back to its savepoint and answered with the error;
+the rest of the group still commits.
+
+Each connection gets a reader thread, which queues requests as they arrive, and a
+responder thread, which sends the answers in order. A client that pipelines a thousand
+acks therefore gets them into one or two commits.
+
+Other commands (dlq, cancel, gc, the dashboard, the master's lease reaping) still use
+queue.db directly; SQLite serializes them with the daemon as before.
+"""
+import json
+import queue
+import signal
+import socketserver
+import threading
+
+from . import storage, queue_manager, notify, client, shards
+from .models import Outcome
+
+# requests applied per transaction at most
+GROUP_MAX = 1000
+
+def _enqueue(payloads):
+    return queue_manager._enqueue_payloads(payloads)
+
+def _claim(worker, limit=1, start=None, lease=storage.DEFAULT_LEASE_SECONDS, queues=None):
+    rows = storage.atomic_claim_jobs(worker, limit, start, lease, queues)
+    return {'rows': [dict(r) for r in rows], 'throttled_until': storage.throttled_until()}
+
+def _ack(worker, outcomes, start_ids=()):
+    storage.apply_outcomes([Outcome(**o) for o in outcomes], worker, start_ids)
+
+def _renew(worker, lease=storage.DEFAULT_LEASE_SECONDS):
+    return storage.renew_leases(worker, lease)
+
+def _release(worker, ids):
+    storage.release_jobs(worker, ids)
+
+def _status():
+    return storage.state_counts()
+
+def _ping():
+    return {'schema_version': storage.SCHEMA_VERSION}
+
+OPS = {
+    'enqueue': _enqueue,
+    'claim': _claim,
+    'ack': _ack,
+    'renew': _renew,
+    'release': _release,
+    'status': _status,
+    'ping': _ping,
+}
+# ops after which idle workers may find something to claim
+_WAKES = {'enqueue', 'release'}
+
+class _Request:
+    __slots__ = ('op', 'args', 'reply', 'done')
+
+    def __init__(self, op, args):
+        self.op, self.args, self.reply = op, args, None
+        self.done = threading.Event()
+
+    def fail(self, e):
+        self.reply = {'error': str(e), 'type': type(e).__name__}
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        answers = queue.SimpleQueue()
+        responder = threading.Thread(target=self._respond, args=(answers,), daemon=True)
+        responder.start()
+        try:
+            for line in self.rfile:
+                answers.put(self.server.queue_server.submit(line))
+        finally:
+            answers.put(None)
+            responder.join()
+
+    def _respond(self, answers):
+        for req in iter(answers.get, None):
+            req.done.wait()
+            try:
+                self.wfile.write(json.dumps(req.reply).encode() + b'\n')
+                self.wfile.flush()
+            except OSError:
+                # the client went away; keep draining so the reader can finish
+                pass
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class QueueServer:
+    def __init__(self, path=None):
+        self.path = path or client.SERVE_SOCK
+        self._requests = queue.SimpleQueue()
+        self._server = None
+        self._threads = []
+        self.commits = 0
+        self.applied = 0
+
+    def start(self):
+        """Bind the socket and start the writer. Raises ValueError if a daemon already runs here."""
+        if shards.count() > 1:
+            # one writer thread per file would be needed; sharding already spreads the writes
+            raise ValueError(f"queuectl serve needs an unsharded queue, this one has {shards.count()} shards")
+        try:
+            client.Client(self.path).close()
+        except OSError:
+            pass
+        else:
+            raise ValueError(f"queuectl serve is already running on {self.path}")
+        self.path.unlink(missing_ok=True)
+        self._server = _UnixServer(str(self.path), _Handler)
+        self._server.queue_server = self
+        self._threads = [threading.Thread(target=self._write_loop, name='queue-writer', daemon=True),
+                         threading.Thread(target=self._server.serve_forever, name='queue-listener', daemon=True)]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        """Stop accepting, apply what was already received, and remove the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._requests.put(None)
+        self._threads[0].join()
+        self.path.unlink(missing_ok=True)
+        storage.close_pool()
+
+    def submit(self, line):
+        """Queue one request line for the writer; the returned request is done once committed."""
+        try:
+            msg = json.loads(line)
+            req = _Request(msg.pop('op'), msg)
+            if req.op not in OPS:
+                raise ValueError(f"unknown op {req.op!r}")
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            req = _Request(None, None)
+            req.fail(ValueError(f"bad request: {e}"))
+            req.done.set()
+            return req
+        self._requests.put(req)
+        return req
+
+    def _write_loop(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            batch = [first]
+            while len(batch) < GROUP_MAX:
+                try:
+                    req = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if req is None:
+                    self._requests.put(None)
+                    break
+                batch.append(req)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        try:
+            with storage.transaction() as conn:
+                for req in batch:
+                    conn.execute("SAVEPOINT request")
+                    try:
+                        req.reply = {'result': OPS[req.op](**req.args)}
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO request")
+                        req.fail(e)
+                    conn.execute("RELEASE request")
+            self.commits += 1
+            self.applied += len(batch)
+        except Exception as e:
+            # the commit itself failed: nothing in the group took effect
+            for req in batch:
+                req.fail(e)
+        finally:
+            for req in batch:
+                req.done.set()
+        if any(req.op in _WAKES and 'result' in req.reply for req in batch):
+            notify.send_wakeup()
+
+def serve():
+    """`queuectl serve`: run the daemon in the foreground until SIGINT/SIGTERM."""
+    server = QueueServer()
+    server.start()
+    stopping = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopping.set())
+    print(f"Serving {storage.DB_PATH} on {server.path} (Ctrl-C to stop)")
+    while not stopping.wait(1):
+        pass
+    server.stop()
+    print(f"Stopped after {server.applied} request(s) in {server.commits} commit(s)")
@@ -0,0 +1,137 @@
+"""
+Sharding: spread jobs over several SQLite files so writers don't all queue on one lock.
+
+With `queuectl shards N` (N > 1) jobs live in N files: queue.db is shard 0 and also
+keeps what isn't per job (config, limits, schedules); shard i is queue-<i>.db next to
+it, with the same schema. A job's shard is a hash of its queue name (the default: a
+queue's order, priorities, per-queue limits and dependencies stay within one file) or of
+its id (`--by id`, which spreads even a single queue; a dedup_key takes the id's place so
+duplicates meet on one shard). A job that depends on others goes where they are, and a
+re-enqueued id goes where it already is.
+
+storage works on one file at a time: using(i) points the calling thread's storage calls
+at shard i, so every storage function runs unchanged against any shard. Workers claim
+from their home shard first and steal from the others in turn when it has nothing due
+(src/worker.py); results, lease renewals and releases go back to the job's shard.
+
+With one shard (the default) everything here is a no-op and queue.db works as before.
+"""
+import threading
+import zlib
+from contextlib import contextmanager
+
+from . import storage
+
+BY = ('queue', 'id')
+
+_local = threading.local()
+# {str(DB_PATH): (count, by)}; the layout is fixed while jobs exist, so it is read once
+_layout = {}
+
+def layout():
+    """(shard count, routing key) of the queue at storage.DB_PATH."""
+    home = str(storage.DB_PATH)
+    found = _layout.get(home)
+    if found is None:
+        conn = storage.get_conn(home)
+        rows = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('shards', 'shard_by')").fetchall())
+        found = _layout[home] = (int(rows.get('shards') or 1), rows.get('shard_by') or 'queue')
+    return found
+
+def count():
+    return layout()[0]
+
+def path(shard):
+    """File of `shard`: queue.db for 0, queue-<i>.db beside it otherwise."""
+    home = storage.DB_PATH
+    return home if shard == 0 else home.with_name(f"{home.stem}-{shard}{home.suffix}")
+
+@contextmanager
+def using(shard):
+    """Point this thread's storage calls at `shard` for the duration of the block."""
+    previous = getattr(_local, 'shard', 0)
+    _local.shard = shard
+    storage.set_thread_db(path(shard) if shard else None)
+    try:
+        yield
+    finally:
+        _local.shard = previous
+        storage.set_thread_db(path(previous) if previous else None)
+
+def each():
+    """Run the loop body once on every shard: `for shard in each(): ...`."""
+    for shard in range(count()):
+        with using(shard):
+            yield shard
+
+def order(home):
+    """Shards in the order a worker whose home is `home` claims from them."""
+    n = count()
+    return [(home + i) % n for i in range(n)]
+
+def route(job):
+    """The shard a new job (models.Job) hashes to."""
+    n, by = layout()
+    if n == 1:
+        return 0
+    # by id, jobs sharing a dedup_key hash together so the key can collapse them
+    key = job.queue if by == 'queue' else job.dedup_key or job.id
+    return zlib.crc32(key.encode()) % n
+
+def locate(ids):
+    """{id: shard} for those of `ids` stored in `jobs` or the DLQ of some shard."""
+    found = {}
+    if not ids:
+        return found
+    for shard in each():
+        for table in ('jobs', 'dlq'):
+            missing = [i for i in ids if i not in found]
+            for i in range(0, len(missing), 500):
+                part = missing[i:i + 500]
+                rows = storage.fetch_all(f"SELECT id FROM {table} WHERE id IN ({','.join('?' * len(part))})", part)
+                found.update((r['id'], shard) for r in rows)
+    return found
+
+def state_counts():
+    """storage.state_counts() summed over the shards."""
+    if count() == 1:
+        return storage.state_counts()
+    total = {}
+    for _ in each():
+        for state, n in storage.state_counts().items():
+            total[state] = total.get(state, 0) + n
+    return dict(sorted(total.items()))
+
+def configure(n, by='queue'):
+    """
+    `queuectl shards N [--by queue|id]`: set the layout and create the shard files. Only
+    while no shard holds a job or DLQ entry, since changing it would strand existing jobs,
+    and while no master or daemon runs: processes read the layout once, so running workers
+    would go on claiming from the old one while new jobs went to shards nobody reads.
+    Config and limits are copied to new shards, which claims read from their own file.
+    """
+    from . import worker, client
+    if n < 1:
+        raise ValueError("shards must be at least 1")
+    if by not in BY:
+        raise ValueError(f"shard key must be one of {', '.join(BY)}")
+    pid = worker.running_master()
+    if pid:
+        raise ValueError(f"workers are running (master pid {pid}); stop them with `worker stop` first")
+    if client.remote() is not None:
+        raise ValueError("queuectl serve is running; stop it first")
+    busy = sum(storage.fetch_one("SELECT (SELECT COUNT(*) FROM jobs) + (SELECT COUNT(*) FROM dlq) AS n")['n']
+               for _ in each())
+    if busy:
+        raise ValueError(f"the queue holds {busy} job(s); the shard layout can only change while it is empty")
+    settings = storage.fetch_all("SELECT key, value FROM meta WHERE key NOT IN ('schema_version', 'shards', 'shard_by')")
+    with storage.transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('shards',?)", (str(n),))
+        conn.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('shard_by',?)", (by,))
+    _layout[str(storage.DB_PATH)] = (n, by)
+    for shard in range(1, n):
+        with using(shard):
+            storage.init_db()
+            storage.execute_many("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)",
+                                 [(r['key'], r['value']) for r in settings])
+    print(f"{n} shard(s), by {by}" + (f": {', '.join(path(i).name for i in range(n))}" if n > 1 else ""))
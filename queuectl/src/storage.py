@@ -1,24 +1,150 @@
 import sqlite3
 from pathlib import Path
 import threading
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+import functools
 import json
+import os
+import time
+
+from . import metrics
 
 DB_PATH = Path.cwd() / 'queue.db'
-_SCHEMA_SQL = Path(__file__).parent.joinpath('..', 'db_schema.sql').resolve()
+_SCHEMA_SQL = Path(__file__).with_name('db_schema.sql')
 
 _lock = threading.Lock()
 
-def get_conn():
-    # sqlite3 is not fully threadsafe by default; use check_same_thread=False for multi-threaded processes
-    conn = sqlite3.connect(str(DB_PATH), timeout=30, isolation_level=None)
+# Applied once per connection when it is opened. WAL lets readers (dashboard, status)
+# run alongside the single writer, and synchronous=NORMAL is durable enough under WAL
+# while skipping the fsync on every commit. auto_vacuum must come first: it only takes
+# effect on a brand-new file (or at the next VACUUM, see `gc --vacuum`) and lets retention
+# hand freed pages back to the OS a few at a time.
+_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    # INSERT OR REPLACE deletes the old row; the queue_stats triggers must see that delete
+    "PRAGMA recursive_triggers=ON",
+)
+
+# Per-thread pool of open connections keyed by database path. The pid is remembered so
+# a forked worker never reuses a connection inherited from its parent.
+_local = threading.local()
+# Connections inherited across fork are parked here instead of being closed by the child.
+_inherited = []
+
+def _open_conn(path):
+    # cached_statements keeps compiled statements around for the life of the pooled connection
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None,
+                           check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _thread_conns():
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _inherited.extend(getattr(_local, 'conns', {}).values())
+        _local.conns = {}
+        _local.pid = pid
+    return _local.conns
+
+def set_thread_db(path):
+    """Make `path` the calling thread's database instead of DB_PATH (None: back to DB_PATH). See shards.using."""
+    _local.db = path
+
+def get_conn(path=None):
+    """
+    Return the pooled connection for this process/thread, opening it on first use.
+    Callers must not close it; use close_pool() to drop the thread's connections.
+    """
+    path = str(path or getattr(_local, 'db', None) or DB_PATH)
+    conns = _thread_conns()
+    conn = conns.get(path)
+    if conn is None:
+        conn = _open_conn(path)
+        conns[path] = conn
     return conn
 
+# Idle connections shared by short-lived threads (the dashboard's thread-per-request
+# server), as (pid, path, conn). See lend_conn().
+_idle = []
+_idle_lock = threading.Lock()
+
+@contextmanager
+def lend_conn():
+    """
+    Bind a process-wide pooled connection to the calling thread for the duration of the
+    block, so threads that live for one request don't each open (and set up) their own.
+    Every storage call made by the thread inside the block uses the lent connection.
+    """
+    path, pid = str(DB_PATH), os.getpid()
+    conn = None
+    with _idle_lock:
+        for i, (c_pid, c_path, c) in enumerate(_idle):
+            if c_pid == pid and c_path == path:
+                conn = _idle.pop(i)[2]
+                break
+    if conn is None:
+        conn = _open_conn(path)
+    conns = _thread_conns()
+    previous = conns.get(path)
+    conns[path] = conn
+    try:
+        yield conn
+    finally:
+        if previous is None:
+            conns.pop(path, None)
+        else:
+            conns[path] = previous
+        if conn.in_transaction:
+            conn.rollback()
+        with _idle_lock:
+            _idle.append((pid, path, conn))
+
+def close_pool():
+    """Close every pooled connection owned by the calling thread."""
+    if getattr(_local, 'pid', None) != os.getpid():
+        return
+    for conn in _local.conns.values():
+        conn.close()
+    _local.conns = {}
+
+@contextmanager
+def transaction(mode='IMMEDIATE'):
+    """
+    Run the enclosed statements in a single transaction on the pooled connection.
+    Nested use joins the outer transaction.
+    """
+    conn = get_conn()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
 def init_db():
+    """
+    Create or upgrade the schema. A database that is already current is recognised from
+    PRAGMA user_version (kept equal to SCHEMA_VERSION by _migrate), a read of the file
+    header, so the common case runs no script and takes no write lock.
+    """
     with _lock:
         DB_PATH.parent.mkdir(parents=True, exist_ok=True)
         conn = get_conn()
+        if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            return
         cur = conn.cursor()
         # read schema file if exists in repository; fallback to embedded
         try:
@@ -41,71 +167,648 @@ def init_db():
         cur.execute("INSERT OR IGNORE INTO meta(key,value) VALUES('backoff_base','2')")
         cur.execute("INSERT OR IGNORE INTO meta(key,value) VALUES('max_retries','3')")
         cur.execute("INSERT OR IGNORE INTO meta(key,value) VALUES('job_timeout','60')")
-        conn.commit()
-        conn.close()
+        _migrate(conn)
+
+# ---------- Schema migrations ----------
+# db_schema.sql holds the original tables; every later change is a numbered migration
+# so existing queue.db files are upgraded in place. meta.schema_version records the
+# last one applied, and PRAGMA user_version mirrors it for init_db's fast path. Migrations must be idempotent.
+SCHEMA_VERSION = 17
+
+# jobs retention moves out of `jobs`; the same text as idx_jobs_finished's WHERE, so queries can use it
+FINISHED = "state IN ('completed','cancelled')"
+
+def _add_column(conn, table, column, decl):
+    cols = {r['name'] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migration_1(conn):
+    _add_column(conn, 'jobs', 'claimed_by', 'TEXT')
+
+def _migration_2(conn):
+    # claim path: partial covering index walked oldest-first over pending rows only, so the
+    # next_attempt check never touches the table and LIMIT stops the walk early.
+    # (state is listed so older SQLite versions also treat the index as covering)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(created_at, next_attempt, state) WHERE state='pending'")
+    # status / list / dashboard
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state_updated ON jobs(state, updated_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs(state, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dlq_failed ON dlq(failed_at)")
+
+def _migration_3(conn):
+    # earliest next_attempt among pending jobs, for idle workers deciding how long to sleep
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(next_attempt, state) WHERE state='pending'")
+
+def _migration_4(conn):
+    # set when a claimed job actually starts running; NULL while it sits in a prefetch buffer
+    _add_column(conn, 'jobs', 'started_at', 'INTEGER')
+    # jobs held by a given worker, for recovering them when it dies
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(claimed_by) WHERE state='processing'")
+
+def _migration_5(conn):
+    # lease on a claimed job: the owner (claimed_by) must renew it before it expires or the
+    # reaper hands the job to someone else
+    _add_column(conn, 'jobs', 'lease_expires', 'INTEGER')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(lease_expires) WHERE state='processing'")
+
+def _migration_6(conn):
+    # priorities and named queues. Higher priority is claimed first, then oldest first.
+    _add_column(conn, 'jobs', 'priority', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'jobs', 'queue', "TEXT NOT NULL DEFAULT 'default'")
+    # the claim indexes take priority into account: one across all queues, one per queue
+    conn.execute("DROP INDEX IF EXISTS idx_jobs_claim")
+    conn.execute("CREATE INDEX idx_jobs_claim ON jobs(priority DESC, created_at, next_attempt, state) WHERE state='pending'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue_claim "
+                 "ON jobs(queue, priority DESC, created_at, next_attempt, state) WHERE state='pending'")
+
+def _migration_7(conn):
+    # when a job completed (epoch seconds), for retention; updated_at mixes ISO and epoch text
+    _add_column(conn, 'jobs', 'finished_at', 'INTEGER')
+    conn.execute("UPDATE jobs SET finished_at = CASE WHEN updated_at NOT GLOB '*[^0-9]*' THEN CAST(updated_at AS INTEGER) "
+                 "ELSE COALESCE(CAST(strftime('%s', updated_at) AS INTEGER), 0) END "
+                 "WHERE state='completed' AND finished_at IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at) WHERE state='completed'")
+
+# queue_stats holds the number of jobs in each state, plus the DLQ size under 'dlq'. These
+# triggers keep it current in the same transaction as every write, whatever code path
+# makes it, so status reads a handful of rows instead of counting the tables.
+_STATS_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS trg_stats_jobs_insert AFTER INSERT ON jobs BEGIN "
+    "INSERT INTO queue_stats(state,count) VALUES(NEW.state,1) ON CONFLICT(state) DO UPDATE SET count=count+1; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_stats_jobs_delete AFTER DELETE ON jobs BEGIN "
+    "UPDATE queue_stats SET count=count-1 WHERE state=OLD.state; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_stats_jobs_state AFTER UPDATE OF state ON jobs WHEN OLD.state IS NOT NEW.state BEGIN "
+    "UPDATE queue_stats SET count=count-1 WHERE state=OLD.state; "
+    "INSERT INTO queue_stats(state,count) VALUES(NEW.state,1) ON CONFLICT(state) DO UPDATE SET count=count+1; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_stats_dlq_insert AFTER INSERT ON dlq BEGIN "
+    "INSERT INTO queue_stats(state,count) VALUES('dlq',1) ON CONFLICT(state) DO UPDATE SET count=count+1; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_stats_dlq_delete AFTER DELETE ON dlq BEGIN "
+    "UPDATE queue_stats SET count=count-1 WHERE state='dlq'; END",
+)
+
+def _migration_8(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS queue_stats (state TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+    for sql in _STATS_TRIGGERS:
+        conn.execute(sql)
+    _recount(conn)
+
+def _migration_9(conn):
+    # keyset pagination for list / dlq list / /api/jobs: (time, id) is the cursor
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_id ON jobs(created_at, id)")
+    conn.execute("DROP INDEX IF EXISTS idx_jobs_state_created")
+    conn.execute("CREATE INDEX idx_jobs_state_created ON jobs(state, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue_created ON jobs(queue, created_at, id)")
+    conn.execute("DROP INDEX IF EXISTS idx_dlq_failed")
+    conn.execute("CREATE INDEX idx_dlq_failed ON dlq(failed_at, id)")
+
+def _migration_10(conn):
+    # the settings a DLQ entry had as a job, so `dlq retry` restores them (NULL: use the defaults)
+    _add_column(conn, 'dlq', 'max_retries', 'INTEGER')
+    _add_column(conn, 'dlq', 'timeout', 'INTEGER')
+    _add_column(conn, 'dlq', 'priority', 'INTEGER')
+    _add_column(conn, 'dlq', 'queue', 'TEXT')
+    _add_column(conn, 'dlq', 'created_at', 'TEXT')
+
+def _migration_11(conn):
+    # rate limits / concurrency caps: an optional tag groups jobs across queues ("command
+    # class"), rate_buckets holds token-bucket state shared by every worker process, and the
+    # partial indexes count a queue's or tag's running jobs without touching the backlog
+    _add_column(conn, 'jobs', 'tag', 'TEXT')
+    _add_column(conn, 'dlq', 'tag', 'TEXT')
+    conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (scope TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                 "refilled_at REAL NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_running_queue ON jobs(queue) WHERE state='processing'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_running_tag ON jobs(tag) WHERE state='processing' "
+                 "AND tag IS NOT NULL")
+
+def _migration_12(conn):
+    # delayed jobs wait as state 'scheduled' (next_attempt = run_at) outside the claim
+    # indexes, so a large future backlog costs the claim nothing; cron schedules are
+    # materialized into jobs by the master's scheduler (src/scheduler.py)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_scheduled ON jobs(next_attempt) WHERE state='scheduled'")
+    conn.execute("CREATE TABLE IF NOT EXISTS schedules (id TEXT PRIMARY KEY, cron TEXT NOT NULL, payload TEXT NOT NULL, "
+                 "next_fire INTEGER NOT NULL, rev INTEGER NOT NULL)")
+    # the scheduler picks up added/changed schedules by rev without rescanning the table
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_rev ON schedules(rev)")
+
+def _migration_13(conn):
+    # per-attempt timing. jobs.queued_at is when the claimed attempt became due (set by the
+    # claim); job_attempts keeps queued/claimed/started/finished times and the exit code
+    _add_column(conn, 'jobs', 'queued_at', 'REAL')
+    conn.execute("CREATE TABLE IF NOT EXISTS job_attempts (job_id TEXT NOT NULL, attempt INTEGER NOT NULL, "
+                 "worker TEXT, queued_at REAL, claimed_at REAL, started_at REAL, finished_at REAL, "
+                 "exit_code INTEGER, outcome TEXT, PRIMARY KEY (job_id, attempt))")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attempts_finished ON job_attempts(finished_at)")
+
+def _migration_14(conn):
+    # job dependencies: one row per edge, keyed parent-first so completing a job finds its
+    # dependents with a seek; jobs.unmet counts a job's unfinished dependencies and the job
+    # waits as state 'waiting' (outside every claim index) until it reaches 0
+    _add_column(conn, 'jobs', 'unmet', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute("CREATE TABLE IF NOT EXISTS job_deps (depends_on TEXT NOT NULL, job_id TEXT NOT NULL, "
+                 "PRIMARY KEY (depends_on, job_id)) WITHOUT ROWID")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_deps_job ON job_deps(job_id)")
+
+def _migration_15(conn):
+    # dedup_keys: a payload's dedup_key -> the job it created, collapsing duplicates until
+    # expires_at (or while that job is unfinished). result_cache: output of successful
+    # cacheable commands by command hash, evicted by expires_at and least recent use
+    _add_column(conn, 'jobs', 'cache_ttl', 'INTEGER')
+    conn.execute("CREATE TABLE IF NOT EXISTS dedup_keys (key TEXT PRIMARY KEY, job_id TEXT NOT NULL, "
+                 "expires_at INTEGER NOT NULL) WITHOUT ROWID")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dedup_expires ON dedup_keys(expires_at)")
+    conn.execute("CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, output TEXT, stored_at INTEGER NOT NULL, "
+                 "expires_at INTEGER NOT NULL, used_at INTEGER NOT NULL) WITHOUT ROWID")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_expires ON result_cache(expires_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_used ON result_cache(used_at)")
+
+def _migration_16(conn):
+    # cancelled jobs are finished too: they get a finished_at and retention moves them out
+    conn.execute("UPDATE jobs SET finished_at = CASE WHEN updated_at NOT GLOB '*[^0-9]*' THEN CAST(updated_at AS INTEGER) "
+                 "ELSE COALESCE(CAST(strftime('%s', updated_at) AS INTEGER), 0) END "
+                 "WHERE state='cancelled' AND finished_at IS NULL")
+    conn.execute("DROP INDEX IF EXISTS idx_jobs_finished")
+    conn.execute(f"CREATE INDEX idx_jobs_finished ON jobs(finished_at) WHERE {FINISHED}")
+
+def _migration_17(conn):
+    # retries backing off used to wait as 'pending' with a future next_attempt, inside the
+    # claim index; they wait as 'scheduled' now
+    conn.execute("UPDATE jobs SET state='scheduled' WHERE state='pending' AND next_attempt>CAST(strftime('%s', 'now') AS INTEGER)")
+
+_MIGRATIONS = {
+    1: _migration_1,
+    2: _migration_2,
+    3: _migration_3,
+    4: _migration_4,
+    5: _migration_5,
+    6: _migration_6,
+    7: _migration_7,
+    8: _migration_8,
+    9: _migration_9,
+    10: _migration_10,
+    11: _migration_11,
+    12: _migration_12,
+    13: _migration_13,
+    14: _migration_14,
+    15: _migration_15,
+    16: _migration_16,
+    17: _migration_17,
+}
+
+def schema_version(conn=None):
+    conn = conn or get_conn()
+    row = conn.execute("SELECT value FROM meta WHERE key='schema_version'").fetchone()
+    return int(row['value']) if row else 0
+
+def _migrate(conn):
+    with transaction() as conn:
+        current = schema_version(conn)
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            _MIGRATIONS[version](conn)
+        if current < SCHEMA_VERSION:
+            conn.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('schema_version',?)", (str(SCHEMA_VERSION),))
+        # init_db's fast path; written in the same transaction as the migrations it vouches for
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+def bump_rev(conn, key):
+    """Increment the counter meta[key] inside the caller's transaction and return the new value."""
+    return int(conn.execute("INSERT INTO meta(key,value) VALUES(?, '1') "
+                            "ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER)+1 RETURNING value",
+                            (key,)).fetchone()[0])
 
 def fetch_one(sql, params=()):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    row = cur.fetchone()
-    conn.close()
-    return row
+    return get_conn().execute(sql, params).fetchone()
 
 def fetch_all(sql, params=()):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return get_conn().execute(sql, params).fetchall()
 
 def execute(sql, params=()):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    conn.commit()
-    lastrowid = cur.lastrowid
-    conn.close()
-    return lastrowid
+    # connections run in autocommit mode, so a lone statement commits itself
+    cur = get_conn().execute(sql, params)
+    return cur.lastrowid
 
 def execute_many(sql, seq_of_params):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.executemany(sql, seq_of_params)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.executemany(sql, seq_of_params)
+
+def _timed(op):
+    """Record the wrapped storage operation's duration in metrics (queuectl_db_op_seconds)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe('queuectl_db_op_seconds', time.perf_counter() - start, op)
+        return timed
+    return wrap
+
+# Helpers to run atomic claim/update
+# Pinned to idx_jobs_claim: the planner otherwise prefers idx_jobs_state_created, which has
+# to visit the table for next_attempt. With INDEXED BY a missing index is an error rather than
+# a silent table scan.
+# queued_at: a retry (or a delayed job) became due at next_attempt, a new job when it was created
+_CLAIM_SET = ("UPDATE jobs SET state='processing', attempts=attempts+1, updated_at=?, next_attempt=0, claimed_by=?, "
+              "started_at=NULL, lease_expires=?, queued_at=CASE WHEN next_attempt>0 THEN next_attempt "
+              "ELSE (julianday(created_at) - 2440587.5) * 86400.0 END ")
+CLAIM_SQL = (_CLAIM_SET +
+             "WHERE rowid IN (SELECT rowid FROM jobs INDEXED BY idx_jobs_claim "
+             "WHERE state='pending' AND next_attempt<=? ORDER BY priority DESC, created_at LIMIT ?) "
+             "RETURNING *")
+# the same for one named queue: a seek into idx_jobs_queue_claim, whatever the other queues hold
+CLAIM_QUEUE_SQL = (_CLAIM_SET +
+                   "WHERE rowid IN (SELECT rowid FROM jobs INDEXED BY idx_jobs_queue_claim "
+                   "WHERE queue=? AND state='pending' AND next_attempt<=? ORDER BY priority DESC, created_at LIMIT ?) "
+                   "RETURNING *")
 
-# Helper to run atomic claim/update
-def atomic_claim_job():
+# seconds a claim stays valid without a heartbeat (config key lease_seconds)
+DEFAULT_LEASE_SECONDS = 30
+
+def _claim_order(row):
+    return -row['priority'], row['created_at']
+
+@_timed('claim')
+def atomic_claim_jobs(worker_id, limit=1, start=None, lease_seconds=DEFAULT_LEASE_SECONDS, queues=None):
+    """
+    Atomically claim up to `limit` pending jobs whose next_attempt <= now for `worker_id`:
+    mark them processing and increment attempts in a single UPDATE ... RETURNING.
+    Jobs are taken highest priority first, then oldest first. With `queues`, only those
+    queues are considered, in the given order: later ones fill what earlier ones can't.
+    The first `start` of them (all by default) are also marked started; the rest are
+    prefetched and get marked by mark_started/apply_outcomes when they run.
+    Each claim carries a lease of `lease_seconds` that the worker renews with renew_leases.
+    Returns the claimed rows in claim order (possibly empty).
+    """
+    global _throttled_until
+    now = time.time()
+    now_ts = int(now)
+    lease = now_ts + lease_seconds
+    with transaction() as conn:
+        _promote_scheduled(conn, now_ts)
+        limits = _load_limits(conn)
+        if limits:
+            rows, _throttled_until = _claim_limited(conn, limits, now, worker_id, lease, limit, queues)
+        elif queues is None:
+            # RETURNING does not preserve the subquery order
+            rows = sorted(conn.execute(CLAIM_SQL, (now_ts, worker_id, lease, now_ts, limit)), key=_claim_order)
+        else:
+            rows = []
+            for queue in queues:
+                if len(rows) >= limit:
+                    break
+                claimed = conn.execute(CLAIM_QUEUE_SQL, (now_ts, worker_id, lease, queue, now_ts, limit - len(rows)))
+                rows.extend(sorted(claimed, key=_claim_order))
+        if not limits:
+            _throttled_until = None
+        started = [r['id'] for r in rows[:start]]
+        if started:
+            _mark_started(conn, worker_id, started, now_ts)
+    return rows
+
+# delayed jobs made claimable per claim transaction; the rest follow on the next claims
+PROMOTE_BATCH = 1000
+
+def _promote_scheduled(conn, now_ts):
+    # a seek into idx_jobs_scheduled: nothing to read when no delayed job is due
+    conn.execute("UPDATE jobs SET state='pending' WHERE rowid IN (SELECT rowid FROM jobs INDEXED BY idx_jobs_scheduled "
+                 "WHERE state='scheduled' AND next_attempt<=? LIMIT ?)", (now_ts, PROMOTE_BATCH))
+
+# ---------- rate limits and concurrency caps ----------
+# meta rows `limit:queue:<name>` / `limit:tag:<name>` hold JSON {"rate", "burst", "max_inflight"}
+# (see src/limits.py). They are read and enforced inside the claim transaction, which holds
+# the database write lock, so the limits hold across every worker process: a throttled job
+# is never claimed in the first place.
+LIMIT_PREFIX = 'limit:'
+# how soon a worker held back only by max_inflight looks again (a completion frees a slot)
+INFLIGHT_RECHECK = 0.5
+
+# when this process's last claim was held back by a limit, the time one may next succeed
+_throttled_until = None
+
+def throttled_until():
+    """Epoch seconds before which the jobs a limit held back in the last claim stay blocked, or None."""
+    return _throttled_until
+
+def _load_limits(conn):
+    return {tuple(r['key'][len(LIMIT_PREFIX):].split(':', 1)): json.loads(r['value'])
+            for r in conn.execute("SELECT key, value FROM meta WHERE key GLOB 'limit:*'")}
+
+def _scope_key(scope):
+    return ':'.join(scope)
+
+def _budgets(conn, limits, now):
+    """
+    Claims each limited scope allows right now: the free max_inflight slots and the whole
+    tokens in its bucket (refilled for the time since it was last used), whichever is lower.
+    Returns (budgets, tokens) with tokens only for rate-limited scopes.
+    """
+    budgets, tokens = {}, {}
+    for scope, lim in limits.items():
+        allowed = float('inf')
+        if lim.get('max_inflight') is not None:
+            col = 'queue' if scope[0] == 'queue' else 'tag'
+            running = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {col}=? AND state='processing'",
+                                   (scope[1],)).fetchone()[0]
+            allowed = max(lim['max_inflight'] - running, 0)
+        if lim.get('rate'):
+            row = conn.execute("SELECT tokens, refilled_at FROM rate_buckets WHERE scope=?",
+                               (_scope_key(scope),)).fetchone()
+            have = lim['burst'] if row is None else row['tokens'] + max(now - row['refilled_at'], 0) * lim['rate']
+            tokens[scope] = min(have, lim['burst'])
+            allowed = min(allowed, int(tokens[scope]))
+        budgets[scope] = allowed
+    return budgets, tokens
+
+def _row_scopes(row, budgets):
+    return [s for s in (('queue', row['queue']), ('tag', row['tag'])) if s in budgets]
+
+def _claim_limited(conn, limits, now, worker_id, lease, limit, queues):
+    """
+    atomic_claim_jobs with limits configured: walk candidates in claim order, skipping
+    queues and tags whose budget is spent, and charge each claim to its buckets.
+    Returns (rows, throttled_until).
+    """
+    now_ts = int(now)
+    budgets, tokens = _budgets(conn, limits, now)
+    rows = []
+    for queue in (queues or [None]):
+        while len(rows) < limit:
+            if budgets.get(('queue', queue), 1) <= 0:
+                break
+            spent = [s for s, b in budgets.items() if b <= 0]
+            where, params = ["state='pending'", "next_attempt<=?"], [now_ts]
+            if queue is not None:
+                where.insert(0, "queue=?")
+                params.insert(0, queue)
+            spent_queues = [name for kind, name in spent if kind == 'queue']
+            spent_tags = [name for kind, name in spent if kind == 'tag']
+            if spent_queues:
+                where.append(f"queue NOT IN ({','.join('?' * len(spent_queues))})")
+                params += spent_queues
+            if spent_tags:
+                where.append(f"(tag IS NULL OR tag NOT IN ({','.join('?' * len(spent_tags))}))")
+                params += spent_tags
+            index = 'idx_jobs_claim' if queue is None else 'idx_jobs_queue_claim'
+            candidates = conn.execute(f"SELECT rowid, queue, tag FROM jobs INDEXED BY {index} "
+                                      f"WHERE {' AND '.join(where)} ORDER BY priority DESC, created_at LIMIT ?",
+                                      (*params, limit - len(rows))).fetchall()
+            take = []
+            for c in candidates:
+                scopes = _row_scopes(c, budgets)
+                take.append(c['rowid'])
+                for s in scopes:
+                    budgets[s] -= 1
+                if any(budgets[s] <= 0 for s in scopes):
+                    # that scope is now spent: look again without it
+                    break
+            if not take:
+                break
+            marks = ','.join('?' * len(take))
+            claimed = conn.execute(_CLAIM_SET + f"WHERE rowid IN ({marks}) RETURNING *",
+                                   (now_ts, worker_id, lease, *take))
+            rows.extend(sorted(claimed, key=_claim_order))
+    used = {}
+    for r in rows:
+        for s in _row_scopes(r, tokens):
+            used[s] = used.get(s, 0) + 1
+    if tokens:
+        conn.executemany("INSERT OR REPLACE INTO rate_buckets(scope, tokens, refilled_at) VALUES(?,?,?)",
+                         [(_scope_key(s), t - used.get(s, 0), now) for s, t in tokens.items()])
+    throttled = _throttle_hint(limits, budgets, tokens, used, now) if len(rows) < limit else None
+    return rows, throttled
+
+def _throttle_hint(limits, budgets, tokens, used, now):
+    # when a spent scope may allow a claim again: its next token, or a recheck for max_inflight
+    waits = []
+    for scope, budget in budgets.items():
+        if budget > 0:
+            continue
+        if scope in tokens and tokens[scope] - used.get(scope, 0) < 1:
+            waits.append((1 - (tokens[scope] - used.get(scope, 0))) / limits[scope]['rate'])
+        else:
+            waits.append(INFLIGHT_RECHECK)
+    return now + min(waits) if waits else None
+
+def _mark_started(conn, worker_id, job_ids, now_ts):
+    conn.executemany("UPDATE jobs SET started_at=? WHERE id=? AND claimed_by=?",
+                     [(now_ts, job_id, worker_id) for job_id in job_ids])
+
+@_timed('mark_started')
+def mark_started(worker_id, job_ids):
+    """Record that prefetched jobs are now running (so a crash counts their attempt)."""
+    with transaction() as conn:
+        _mark_started(conn, worker_id, job_ids, int(time.time()))
+
+def atomic_claim_job(worker_id=None):
     """
     Atomically find a pending job whose next_attempt <= now and mark it processing and increment attempts.
     Returns the job row or None.
     """
-    import time
-    conn = get_conn()
-    cur = conn.cursor()
+    rows = atomic_claim_jobs(worker_id, 1)
+    return rows[0] if rows else None
+
+# job settings carried into the DLQ so a retry restores them
+_DLQ_KEPT = "max_retries, timeout, priority, queue, created_at, tag"
+_DLQ_COLUMNS = "id, command, failed_at, attempts, last_error, " + _DLQ_KEPT
+
+@_timed('apply_outcomes')
+def apply_outcomes(outcomes, worker_id=None, start_ids=()):
+    """
+    Apply finished attempts (models.Outcome) in one transaction: completions, retries
+    scheduled for next_attempt_ts, and DLQ moves (insert + delete together). Completions
+    release their dependents; DLQ moves cancel theirs.
+    With `worker_id`, results only apply to jobs that worker still holds, so a worker whose
+    lease was reaped can't overwrite the job's new claim.
+    `start_ids` are prefetched jobs of `worker_id` marked started in the same transaction.
+    """
     now_ts = int(time.time())
-    try:
-        cur.execute("BEGIN IMMEDIATE")
-        cur.execute("SELECT id FROM jobs WHERE state='pending' AND next_attempt<=? ORDER BY created_at LIMIT 1", (now_ts,))
-        row = cur.fetchone()
-        if not row:
-            conn.commit()
-            return None
-        job_id = row['id']
-        cur.execute("UPDATE jobs SET state='processing', attempts=attempts+1, updated_at=?, next_attempt=0 WHERE id=? AND state='pending'",
-                    (now_ts, job_id))
-        # ensure we succeeded to claim
-        if cur.rowcount == 0:
-            conn.commit()
-            return None
-        cur.execute("SELECT * FROM jobs WHERE id=?", (job_id,))
-        job = cur.fetchone()
-        conn.commit()
-        return job
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
\ No newline at end of file
+    fence = " AND state='processing' AND claimed_by=?" if worker_id is not None else ""
+    owner = (worker_id,) if worker_id is not None else ()
+    completed = [(o.finished_at, o.finished_at, o.job_id, *owner) for o in outcomes if o.action == 'completed']
+    # a retry backing off waits as 'scheduled' (idx_jobs_scheduled), not in the claim index,
+    # where every claim would have to step over it
+    retries = [('scheduled' if o.next_attempt_ts > now_ts else 'pending', o.next_attempt_ts, o.finished_at, o.job_id,
+                *owner) for o in outcomes if o.action == 'retry']
+    dead = [o for o in outcomes if o.action == 'dlq']
+    timed = [(o.claimed_at, o.started_at, o.ended_at, o.exit_code, o.action, o.job_id, *owner)
+             for o in outcomes if o.started_at is not None]
+    with transaction() as conn:
+        if timed:
+            # before the job rows change: attempt, worker and queued_at come from them
+            conn.executemany(f"INSERT OR REPLACE INTO job_attempts(job_id,attempt,worker,queued_at,claimed_at,started_at,"
+                             f"finished_at,exit_code,outcome) "
+                             f"SELECT id, attempts, claimed_by, queued_at, ?, ?, ?, ?, ? FROM jobs WHERE id=?{fence}",
+                             timed)
+        if completed:
+            conn.executemany(f"UPDATE jobs SET state='completed', updated_at=?, finished_at=?, lease_expires=NULL "
+                             f"WHERE id=?{fence}", completed)
+            _release_dependents(conn, [o.job_id for o in outcomes if o.action == 'completed'], now_ts)
+        if retries:
+            conn.executemany(f"UPDATE jobs SET state=?, next_attempt=?, updated_at=?, claimed_by=NULL, "
+                             f"lease_expires=NULL WHERE id=?{fence}", retries)
+        if dead:
+            conn.executemany(f"INSERT OR REPLACE INTO dlq({_DLQ_COLUMNS}) "
+                             f"SELECT id, ?, ?, ?, ?, {_DLQ_KEPT} FROM jobs WHERE id=?{fence}",
+                             [(o.command, o.finished_at, o.attempts, o.last_error, o.job_id, *owner) for o in dead])
+            gone = [o.job_id for o in dead
+                    if conn.execute(f"DELETE FROM jobs WHERE id=?{fence}", (o.job_id, *owner)).rowcount]
+            cancel_dependents(conn, gone, now_ts)
+        cacheable = [o for o in outcomes if o.action == 'completed' and o.cache_ttl]
+        if cacheable:
+            _store_results(conn, cacheable)
+        if start_ids:
+            _mark_started(conn, worker_id, start_ids, now_ts)
+
+# ---------- result cache ----------
+# Successful output of jobs enqueued with cache_ttl, keyed by a hash of the command. A
+# worker that claims a cacheable job whose command has a live entry completes it with the
+# stored output instead of running it. Only successes are kept: replaying a failure would
+# just burn the job's retries.
+RESULT_CACHE_MAX = 10000
+
+def result_key(command):
+    import hashlib     # imported on first use, like the other enqueue/worker-only modules
+    return hashlib.sha256(command.encode()).hexdigest()
+
+def cached_results(commands):
+    """{command: stored output} for those of `commands` with an unexpired cache entry."""
+    now_ts = int(time.time())
+    keys = {result_key(c): c for c in commands}
+    rows = get_conn().execute(f"SELECT key, output FROM result_cache WHERE key IN ({','.join('?' * len(keys))}) "
+                              f"AND expires_at>?", (*keys, now_ts))
+    return {keys[r['key']]: r['output'] for r in rows}
+
+def _store_results(conn, outcomes):
+    """Store fresh results (Outcome.output) and mark entries that served a hit as used."""
+    conn.executemany("UPDATE result_cache SET used_at=? WHERE key=?",
+                     [(o.finished_at, result_key(o.command)) for o in outcomes if o.cache_hit])
+    fresh = [(result_key(o.command), o.output, o.finished_at, o.finished_at + o.cache_ttl, o.finished_at)
+             for o in outcomes if not o.cache_hit]
+    if fresh:
+        conn.executemany("INSERT OR REPLACE INTO result_cache(key,output,stored_at,expires_at,used_at) "
+                         "VALUES(?,?,?,?,?)", fresh)
+        row = conn.execute("SELECT value FROM meta WHERE key='cache_max_entries'").fetchone()
+        # least recently used beyond the cap; walks the used_at index, newest first
+        conn.execute("DELETE FROM result_cache WHERE key IN (SELECT key FROM result_cache "
+                     "INDEXED BY idx_result_cache_used ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                     (int(row['value']) if row else RESULT_CACHE_MAX,))
+
+# ---------- job dependencies ----------
+# Completing a job decrements `unmet` on its direct dependents (a seek on job_deps' primary
+# key) and drops its edges; a dependent reaching 0 becomes pending, or scheduled if its
+# run_at is still ahead. Nothing else in the graph is read. The completion must have taken
+# effect (EXISTS ... 'completed'): a fenced-out result releases nothing, and a completed
+# job has no edges left, so a dependent is never released twice. `+state` keeps the planner
+# on the edge seek instead of walking every waiting job through the state index.
+_RELEASE_SQL = ("UPDATE jobs SET unmet=unmet-1, updated_at=?, "
+                "state=CASE WHEN unmet>1 THEN state WHEN next_attempt>? THEN 'scheduled' ELSE 'pending' END "
+                "WHERE id IN (SELECT job_id FROM job_deps WHERE depends_on=?) AND +state='waiting' "
+                "AND EXISTS (SELECT 1 FROM jobs WHERE id=? AND state='completed')")
+_UNLINK_SQL = ("DELETE FROM job_deps WHERE depends_on=? "
+               "AND EXISTS (SELECT 1 FROM jobs WHERE id=? AND state='completed')")
+
+def _release_dependents(conn, job_ids, now_ts):
+    conn.executemany(_RELEASE_SQL, [(now_ts, now_ts, job_id, job_id) for job_id in job_ids])
+    conn.executemany(_UNLINK_SQL, [(job_id, job_id) for job_id in job_ids])
+
+# every job reachable from the roots over job_deps; UNION (not UNION ALL) visits a shared
+# descendant of a fan-in once
+_DESCENDANTS_CTE = ("WITH RECURSIVE down(id) AS (SELECT job_id FROM job_deps WHERE depends_on IN ({marks}) "
+                    "UNION SELECT d.job_id FROM job_deps d JOIN down ON d.depends_on=down.id) ")
+
+def cancel_dependents(conn, job_ids, now_ts, chunk=500):
+    """
+    Cancel everything that (transitively) depends on `job_ids`, which failed or were
+    cancelled, and drop the cancelled jobs' edges. Returns the number cancelled.
+    """
+    cancelled = []
+    for i in range(0, len(job_ids), chunk):
+        roots = job_ids[i:i + chunk]
+        marks = ','.join('?' * len(roots))
+        cancelled += [r['id'] for r in conn.execute(
+            _DESCENDANTS_CTE.format(marks=marks) +
+            "UPDATE jobs SET state='cancelled', unmet=0, updated_at=?, finished_at=? WHERE id IN (SELECT id FROM down) "
+            "AND +state='waiting' RETURNING id", (*roots, now_ts, now_ts))]
+    conn.executemany("DELETE FROM job_deps WHERE depends_on=?", [(job_id,) for job_id in job_ids])
+    conn.executemany("DELETE FROM job_deps WHERE job_id=?", [(job_id,) for job_id in cancelled])
+    return len(cancelled)
+
+def _recover_jobs(conn, where, params, reason):
+    """
+    Put 'processing' jobs matching `where` back to pending. Jobs that never started (still
+    in a prefetch buffer) get their claimed attempt back, as in release_jobs. Jobs that were
+    running keep the attempt, and those that used their last one go to the DLQ so a job that
+    keeps killing workers can't loop forever. Returns (requeued, dead) counts.
+    """
+    now_ts = int(time.time())
+    match = f"state='processing' AND started_at IS NOT NULL AND attempts>=max_retries AND ({where})"
+    conn.execute(f"INSERT OR REPLACE INTO dlq({_DLQ_COLUMNS}) "
+                 f"SELECT id, command, ?, attempts, ?, {_DLQ_KEPT} FROM jobs WHERE {match}", (now_ts, reason, *params))
+    dead = [r['id'] for r in conn.execute(f"DELETE FROM jobs WHERE {match} RETURNING id", params)]
+    cancel_dependents(conn, dead, now_ts)
+    # next_attempt=now: the requeued attempt's queue wait starts here
+    requeued = conn.execute(f"UPDATE jobs SET state='pending', next_attempt=?, updated_at=?, claimed_by=NULL, lease_expires=NULL, "
+                            f"attempts=attempts - (started_at IS NULL), started_at=NULL "
+                            f"WHERE state='processing' AND ({where})", (now_ts, now_ts, *params)).rowcount
+    return requeued, len(dead)
+
+@_timed('requeue_owner_jobs')
+def requeue_owner_jobs(owner):
+    """Recover every job still held by a worker that is known to be gone."""
+    with transaction() as conn:
+        return _recover_jobs(conn, "claimed_by=?", (owner,), f"worker {owner} exited while running the job")
+
+@_timed('renew_leases')
+def renew_leases(worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Heartbeat: extend the lease on every job `worker_id` holds. Returns how many it still holds."""
+    return get_conn().execute("UPDATE jobs SET lease_expires=? WHERE claimed_by=? AND state='processing'",
+                              (int(time.time()) + lease_seconds, worker_id)).rowcount
+
+@_timed('reap_expired_leases')
+def reap_expired_leases():
+    """Recover, in bulk, every claimed job whose lease ran out (its worker stopped heartbeating)."""
+    with transaction() as conn:
+        return _recover_jobs(conn, "lease_expires<?", (int(time.time()),), "lease expired while the job was running")
+
+def _recount(conn):
+    conn.execute("DELETE FROM queue_stats")
+    conn.execute("INSERT INTO queue_stats(state,count) SELECT state, COUNT(*) FROM jobs GROUP BY state")
+    conn.execute("INSERT INTO queue_stats(state,count) SELECT 'dlq', COUNT(*) FROM dlq")
+
+def recount_stats():
+    """Rebuild queue_stats from full counts, e.g. after the tables were edited without the triggers."""
+    with transaction() as conn:
+        _recount(conn)
+
+def state_counts():
+    """{state: jobs in that state} for states that have any, plus 'dlq'; read from queue_stats."""
+    rows = fetch_all("SELECT state, count FROM queue_stats WHERE count>0 OR state='dlq' ORDER BY state")
+    counts = {r['state']: r['count'] for r in rows}
+    counts.setdefault('dlq', 0)
+    return counts
+
+def next_due_ts():
+    """
+    Epoch seconds at which the earliest pending or scheduled job becomes claimable, or None
+    if there are none. Two index seeks (idx_jobs_due, idx_jobs_scheduled).
+    """
+    row = fetch_one("SELECT MIN(due) AS due FROM ("
+                    "SELECT MIN(next_attempt) AS due FROM jobs INDEXED BY idx_jobs_due WHERE state='pending' UNION ALL "
+                    "SELECT MIN(next_attempt) FROM jobs INDEXED BY idx_jobs_scheduled WHERE state='scheduled')")
+    return row['due']
+
+@_timed('release_jobs')
+def release_jobs(worker_id, job_ids):
+    """
+    Hand claimed-but-unstarted jobs back to the queue, undoing the attempt the claim counted.
+    """
+    if not job_ids:
+        return
+    marks = ','.join('?' * len(job_ids))
+    execute(f"UPDATE jobs SET state='pending', attempts=attempts-1, updated_at=?, claimed_by=NULL, started_at=NULL, "
+            f"lease_expires=NULL "
+            f"WHERE claimed_by=? AND state='processing' AND id IN ({marks})",
+            (int(time.time()), worker_id, *job_ids))
@@ -1,98 +1,672 @@
 import os
 import signal
 import time
-import sys
 from multiprocessing import Process, Event
-from . import storage, queue_manager, config
+from multiprocessing import connection as mp_connection
+from . import storage, queue_manager, config, notify, joblogs, retention, scheduler, metrics, client, shards
+from .models import Outcome
 import subprocess
 import threading
 from pathlib import Path
-import json
+from collections import deque
 
 PID_FILE = Path.cwd() / 'queuectl_master.pid'
 
-def _run_command(command, timeout):
+# Idle wait bounds (seconds). With a wakeup channel workers sleep up to _IDLE_MAX and rely on
+# pokes; without one they poll, backing off from _IDLE_MIN to _IDLE_MAX.
+_IDLE_MIN = 0.05
+_IDLE_MAX = 5.0
+
+def _pump(stream, log):
+    for chunk in iter(lambda: stream.read1(joblogs.CHUNK_SIZE), b''):
+        log.write(chunk)
+    stream.close()
+
+def _run_command(command, timeout, log):
+    """
+    Run `command`, streaming its combined stdout/stderr into `log` (a joblogs.LogWriter)
+    instead of collecting it in memory. Returns (returncode, tail of the output).
+    """
+    try:
+        p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        msg = f"could not run command: {e!r}"
+        log.note(msg)
+        return 1, msg
+    pump = threading.Thread(target=_pump, args=(p.stdout, log), daemon=True)
+    pump.start()
+    try:
+        rc = p.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        p.wait()
+        pump.join()
+        msg = f"timeout: command timed out after {timeout} seconds"
+        log.note(msg)
+        return 124, f"{log.tail()}\n{msg}".lstrip()
+    pump.join()
+    return rc, log.tail()
+
+def _run_job(job, timeout, log_opts):
+    """Run a claimed job with its output appended to the job's log. Returns (returncode, output tail)."""
+    log = joblogs.LogWriter(job['id'], *log_opts)
     try:
-        p = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
-        out = p.stdout.decode('utf-8', errors='ignore')
-        err = p.stderr.decode('utf-8', errors='ignore')
-        return p.returncode, out, err
-    except subprocess.TimeoutExpired as e:
-        return 124, '', f"timeout: {e}"
+        log.note(f"attempt {job['attempts']}/{job['max_retries']}: {job['command']}")
+        if 'cached' in job:
+            return 0, _replay(job, log)
+        return _run_command(job['command'], timeout, log)
+    finally:
+        log.close()
+
+def _replay(job, log):
+    """Complete a job from the result cache: its stored output goes to the log, nothing runs."""
+    log.note("result cache hit: output of an earlier run of this command, not run again")
+    log.write(job['cached'].encode())
+    return log.tail()
+
+def _owner_id(worker_id, pid=None):
+    # what storage records in jobs.claimed_by for a worker process (this one by default)
+    return f"w{worker_id}-{pid or os.getpid()}"
+
+def _backend():
+    """Where this thread's claims and acks go: a running `queuectl serve`, else queue.db itself."""
+    return client.remote() or storage
+
+def _idle_timeout(wakeup, idle):
+    """
+    How long an idle worker may sleep: until the earliest pending job comes due, capped at
+    _IDLE_MAX with a wakeup channel or at the idle backoff without one.
+    """
+    timeout = _IDLE_MAX if wakeup else idle
+    due = min([d for d in [storage.next_due_ts() for _ in shards.each()] if d is not None], default=None)
+    throttled = _backend().throttled_until()
+    if throttled is not None:
+        # due jobs are being held back by a rate limit or concurrency cap until then
+        due = max(due or 0, throttled)
+    if due is not None:
+        timeout = min(timeout, max(due - time.time(), _IDLE_MIN))
+    return timeout
+
+def _sleep_until_work(wakeup, timeout):
+    if wakeup:
+        wakeup.wait(timeout)
+    else:
+        time.sleep(timeout)
+
+def _wait_for_work(wakeup, idle):
+    """
+    Sleep until poked, until the earliest pending job comes due, or for the idle backoff
+    when there is no wakeup channel, whichever is first.
+    """
+    _sleep_until_work(wakeup, _idle_timeout(wakeup, idle))
+
+def _outcome(job, rc, out, backoff_base):
+    """Decide what a finished attempt does to its job: complete, retry with backoff, or DLQ."""
+    now_ts = int(time.time())
+    if rc == 0:
+        outcome = Outcome(job['id'], 'completed', now_ts)
+        if job.get('cache_ttl'):
+            outcome.command, outcome.cache_ttl = job['command'], job['cache_ttl']
+            outcome.cache_hit = 'cached' in job
+            outcome.output = None if outcome.cache_hit else out
+        return outcome
+    attempts = job['attempts']
+    if attempts >= job['max_retries']:
+        return Outcome(job['id'], 'dlq', now_ts, command=job['command'], attempts=attempts,
+                       last_error=out[-joblogs.TAIL_CHARS:])
+    # compute exponential backoff: delay = base ** attempts
+    delay = int(backoff_base ** attempts)
+    return Outcome(job['id'], 'retry', now_ts, attempts=attempts, next_attempt_ts=now_ts + delay)
+
+def _claim(owner, limit, start, lease, queues, home=0):
+    """
+    atomic_claim_jobs, timed; each claimed job (as a dict) remembers when it was claimed
+    and its shard. With several shards, the `home` shard is tried first and the others in
+    turn after it, stopping at the first that has work (stealing from the rest).
+    Cacheable jobs whose command has a stored result get it as job['cached'].
+    """
+    began = time.time()
+    for shard in shards.order(home):
+        with shards.using(shard):
+            rows = _backend().atomic_claim_jobs(owner, limit, start, lease, queues)
+            if rows:
+                break
+    claimed_at = time.time()
+    metrics.observe('queuectl_claim_seconds', claimed_at - began)
+    jobs = [dict(r, claimed_at=claimed_at, shard=shard) for r in rows]
+    cacheable = [job for job in jobs if job.get('cache_ttl')]
+    if cacheable:
+        with shards.using(shard):
+            hits = storage.cached_results([job['command'] for job in cacheable])
+        for job in cacheable:
+            if job['command'] in hits:
+                job['cached'] = hits[job['command']]
+    return jobs
+
+def _home_shard(worker_id):
+    return worker_id % shards.count()
+
+def _by_shard(jobs):
+    """{shard: [job, ...]} for claimed job dicts (shard 0 when unsharded)."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.get('shard', 0), []).append(job)
+    return groups
+
+def _renew(owner, lease):
+    """Heartbeat: renew `owner`'s leases on every shard."""
+    for _ in shards.each():
+        _backend().renew_leases(owner, lease)
+
+def _release(owner, jobs):
+    """Give claimed-but-unstarted jobs back, each on its shard."""
+    for shard, group in _by_shard(jobs).items():
+        with shards.using(shard):
+            _backend().release_jobs(owner, [j['id'] for j in group])
+
+def _on_every_shard(recover, *args):
+    """Run a recovery (requeue_owner_jobs, reap_expired_leases) on each shard; sums the (requeued, dead) counts."""
+    requeued = dead = 0
+    for _ in shards.each():
+        r, d = recover(*args)
+        requeued, dead = requeued + r, dead + d
+    return requeued, dead
 
-def worker_loop(worker_id, event:Event):
+def _record_attempt(outcome, job, rc, started_at):
+    """Attach the attempt's timing to its outcome (for job_attempts) and add it to the metrics."""
+    outcome.exit_code = rc
+    outcome.claimed_at = job.get('claimed_at')
+    outcome.started_at = started_at
+    outcome.ended_at = time.time()
+    if outcome.claimed_at is not None and job.get('queued_at') is not None:
+        metrics.observe('queuectl_job_queue_wait_seconds', max(outcome.claimed_at - job['queued_at'], 0))
+    metrics.observe('queuectl_job_run_seconds', outcome.ended_at - started_at)
+    metrics.inc('queuectl_job_attempts_total', outcome.action)
+    return outcome
+
+def _report(worker_id, job, outcome, rc, out):
+    job_id = outcome.job_id
+    if outcome.action == 'completed':
+        print(f"[worker {worker_id}] job {job_id} completed. out={out.strip()}")
+    elif outcome.action == 'dlq':
+        print(f"[worker {worker_id}] job {job_id} moved to DLQ after {outcome.attempts} attempts")
+    else:
+        # idle workers recompute how long to sleep
+        notify.send_wakeup()
+        delay = outcome.next_attempt_ts - outcome.finished_at
+        print(f"[worker {worker_id}] job {job_id} failed rc={rc}; will retry after {delay}s (attempt {outcome.attempts}/{job['max_retries']})")
+
+# write-behind defaults: results are written once this many are waiting or the oldest has
+# waited this long (config ack_batch / ack_interval_ms)
+ACK_BATCH = 64
+ACK_INTERVAL = 0.2
+
+class AckBuffer:
+    """
+    Write-behind acknowledgements for one worker. Finished attempts (and start marks for
+    prefetched jobs) are held here and written with one apply_outcomes transaction once
+    `size` are waiting or the oldest has waited `interval` seconds.
+
+    Until then the jobs stay 'processing' under the worker's lease, which the heartbeat
+    keeps renewing. If the worker dies first they are reaped and run again, exactly as if
+    it had died while running them; the write is fenced by owner, so results for jobs the
+    reaper already took back are dropped. `entries` are (job, rc, out, outcome) tuples.
+    The one exception is a job's last allowed attempt: recovery moves a job that used its
+    last attempt to the DLQ, so if a success were still buffered when the worker died, the
+    job would be dead-lettered even though it ran. Such a result makes the buffer due at
+    once. The window then shrinks to the write itself, as it was without write-behind.
+    With several shards, a flush writes one transaction per shard involved; rewriting a
+    shard after a later one failed is a no-op, thanks to the same fencing.
+    """
+    def __init__(self, owner, size=ACK_BATCH, interval=ACK_INTERVAL):
+        self.owner = owner
+        self.size = max(1, size)
+        self.interval = interval
+        self.entries = []
+        self.started = []
+        self._since = None
+        self._final = False
+        self._lock = threading.Lock()
+
+    def add(self, job, rc, out, outcome):
+        with self._lock:
+            self._since = self._since or time.monotonic()
+            self.entries.append((job, rc, out, outcome))
+            self._final = self._final or job['attempts'] >= job['max_retries']
+
+    def start(self, job):
+        """Mark a prefetched job started with the next write."""
+        with self._lock:
+            self._since = self._since or time.monotonic()
+            self.started.append(job)
+
+    def due(self):
+        return self._since is not None and (self._final or len(self.entries) >= self.size or
+                                            time.monotonic() - self._since >= self.interval)
+
+    def flush(self):
+        """Write everything waiting in one transaction; returns the entries written (kept on error)."""
+        with self._lock:
+            if self._since is None:
+                return []
+            outcomes = {shard: [] for shard in _by_shard(self.started)}
+            for job, _, _, outcome in self.entries:
+                outcomes.setdefault(job.get('shard', 0), []).append(outcome)
+            started = _by_shard(self.started)
+            for shard, batch in outcomes.items():
+                with shards.using(shard):
+                    _backend().apply_outcomes(batch, self.owner, [j['id'] for j in started.get(shard, ())])
+            written, self.entries, self.started, self._since, self._final = self.entries, [], [], None, False
+            return written
+
+def _ack_buffer(owner):
+    size = int(config.get_config('ack_batch') or ACK_BATCH)
+    interval = float(config.get_config('ack_interval_ms') or ACK_INTERVAL * 1000) / 1000
+    return AckBuffer(owner, size, interval)
+
+def _report_all(worker_id, written):
+    for job, rc, out, outcome in written:
+        _report(worker_id, job, outcome, rc, out)
+
+class _Heartbeat(threading.Thread):
+    """
+    Renews the lease on every job a worker holds every `lease_seconds / 3` so that a worker
+    which is alive but stuck in a long command keeps its jobs, while one that died (or hung
+    hard enough to stop this thread) loses them to the reaper.
+    With `acks`, it also writes results that have waited `acks.interval` while the worker
+    is busy with a long job.
+    """
+    def __init__(self, owner, lease_seconds, acks=None, worker_id=None):
+        super().__init__(name='lease-heartbeat', daemon=True)
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.acks = acks
+        self.worker_id = worker_id
+        self._done = threading.Event()
+
+    def run(self):
+        every = self.lease_seconds / 3
+        tick = min(every, self.acks.interval) if self.acks else every
+        renew_at = time.monotonic() + every
+        try:
+            while not self._done.wait(tick):
+                try:
+                    if self.acks and self.acks.due():
+                        _report_all(self.worker_id, self.acks.flush())
+                    if time.monotonic() >= renew_at:
+                        renew_at += every
+                        _renew(self.owner, self.lease_seconds)
+                except Exception as e:
+                    # a busy database or a stopped daemon must not kill the heartbeat; the next beat retries
+                    client.disconnect()
+                    print(f"[{self.owner}] heartbeat write failed: {e}")
+        finally:
+            client.disconnect()
+            storage.close_pool()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+def _lease_seconds():
+    return max(1, int(config.get_config('lease_seconds') or storage.DEFAULT_LEASE_SECONDS))
+
+def worker_loop(worker_id, event:Event, wakeup=None, selector=None):
     """
     Keep claiming jobs and processing them until event.is_set() is True.
+    With `claim_batch` > 1, jobs are claimed that many at a time into a local prefetch
+    buffer so short jobs don't pay one write-lock handoff each. It defaults to 1 because a
+    buffer holds jobs back from idle workers: only raise it for queues of short jobs.
+    Results go through an AckBuffer, written `ack_batch` at a time or after
+    `ack_interval_ms`, and always before the worker goes idle or stops.
+    When idle, block on `wakeup` (a notify.Wakeup) rather than polling the database.
+    Claimed jobs carry a `lease_seconds` lease that a heartbeat thread keeps renewing.
+    `selector` (a queues.QueueSelector) picks which named queues each claim draws from.
     """
     backoff_base = float(config.get_config('backoff_base') or 2.0)
+    claim_batch = max(1, int(config.get_config('claim_batch') or 1))
+    lease = _lease_seconds()
+    log_opts = joblogs.log_options()
+    owner = _owner_id(worker_id)
+    acks = _ack_buffer(owner)
+    heartbeat = _Heartbeat(owner, lease, acks, worker_id)
+    heartbeat.start()
+    try:
+        _process_jobs(worker_id, event, wakeup, owner, claim_batch, lease, backoff_base, log_opts, selector, acks)
+    finally:
+        heartbeat.stop()
+        # normally empty already; after an error, whatever can't be written is reaped and rerun
+        try:
+            _report_all(worker_id, acks.flush())
+        except Exception as e:
+            print(f"[{owner}] could not write {len(acks.entries)} result(s): {e}")
+
+def _process_jobs(worker_id, event, wakeup, owner, claim_batch, lease, backoff_base, log_opts, selector, acks):
+    buffered = deque()
+    idle = _IDLE_MIN
     while not event.is_set():
-        job_row = storage.atomic_claim_job()
-        if not job_row:
-            time.sleep(0.5)
+        if not buffered:
+            queues = selector.order() if selector else None
+            buffered.extend(_claim(owner, claim_batch, 1, lease, queues, _home_shard(worker_id)))
+        if not buffered:
+            # nothing waits on the batch filling up while idle
+            _report_all(worker_id, acks.flush())
+            _wait_for_work(wakeup, idle)
+            idle = min(idle * 2, _IDLE_MAX)
             continue
-        job = dict(job_row)
+        idle = _IDLE_MIN
+        job = buffered.popleft()
         job_id = job['id']
         attempts = job['attempts']
         max_retries = job['max_retries']
         timeout = job.get('timeout') or int(config.get_config('job_timeout') or 60)
         print(f"[worker {worker_id}] picked job={job_id} attempts={attempts}/{max_retries} cmd={job['command']}")
-        rc, out, err = _run_command(job['command'], timeout=timeout)
-        now_ts = int(time.time())
-        if rc == 0:
-            storage.execute("UPDATE jobs SET state=?, updated_at=? WHERE id=?", ('completed', now_ts, job_id))
-            print(f"[worker {worker_id}] job {job_id} completed. out={out.strip()}")
-        else:
-            # failure
-            if attempts >= max_retries:
-                # move to dlq
-                storage.execute("INSERT OR REPLACE INTO dlq(id,command,failed_at,attempts,last_error) VALUES(?,?,?,?,?)",
-                                (job_id, job['command'], now_ts, attempts, (err or out)[:2000]))
-                storage.execute("DELETE FROM jobs WHERE id=?", (job_id,))
-                print(f"[worker {worker_id}] job {job_id} moved to DLQ after {attempts} attempts")
+        started_at = time.time()
+        rc, out = _run_job(job, timeout, log_opts)
+        acks.add(job, rc, out, _record_attempt(_outcome(job, rc, out, backoff_base), job, rc, started_at))
+        # the next prefetched job is marked started with the next write
+        if buffered and not event.is_set():
+            acks.start(buffered[0])
+        if acks.due():
+            _report_all(worker_id, acks.flush())
+    # stopping: write what is buffered, then give prefetched jobs we never started back to other workers
+    _report_all(worker_id, acks.flush())
+    _release(owner, buffered)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Supervisor:
+    """
+    Master process: keeps `worker_count` worker processes alive and restarts the ones
+    that die, recovering the jobs they held.
+
+    Signals: SIGTERM / Ctrl+C start a graceful drain (workers finish their current job,
+    then exit) bounded by the `drain_timeout` config value; a second one stops at once.
+    SIGHUP re-reads `worker_count` from config and resizes the pool without a restart.
+    """
+    # a worker that dies sooner than this after starting counts as a crash loop
+    _MIN_HEALTHY_SECONDS = 10
+    _MAX_RESTART_DELAY = 30
+    DEFAULT_DRAIN_TIMEOUT = 30.0
+
+    def __init__(self, count, concurrency=1, selector=None, metrics_port=None):
+        self.desired = count
+        self.concurrency = concurrency
+        self.selector = selector
+        self.hub = notify.WakeupHub()
+        self.workers = {}       # slot -> dict(process, stop, started)
+        self.crashes = {}       # slot -> consecutive quick crashes
+        self.restart_at = {}    # slot -> monotonic time before which it isn't restarted
+        self.draining = False
+        self.deadline = None
+        self.drain_timeout = self.DEFAULT_DRAIN_TIMEOUT
+        self.lease_seconds = _lease_seconds()
+        self.lease_check_at = time.monotonic()
+        self.retention_at = time.monotonic()
+        self.scheduler = scheduler.Scheduler()
+        # shared-memory metric blocks: the master's own and one per worker slot (kept across restarts)
+        self.metrics_port = metrics_port
+        self.metric_blocks = {0: metrics.new_block()}
+        metrics.attach(self.metric_blocks[0])
+        self._retention_thread = None
+        self._signals = []
+        self._sig_r, self._sig_w = os.pipe()
+        os.set_blocking(self._sig_r, False)
+        os.set_blocking(self._sig_w, False)
+
+    # ---------- signals ----------
+    def _on_signal(self, signum, frame):
+        # only record it; the main loop acts on it
+        self._signals.append(signum)
+
+    def _install_signals(self):
+        signal.set_wakeup_fd(self._sig_w)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._on_signal)
+
+    @staticmethod
+    def _config_number(key, cast, current):
+        """Read a numeric config value; keep `current` if it is unset or not a valid non-negative number."""
+        raw = config.get_config(key)
+        if raw is None:
+            return current
+        try:
+            value = cast(raw)
+        except ValueError:
+            value = -1
+        if value < 0:
+            print(f"Master: ignoring invalid {key}={raw!r}, keeping {current}")
+            return current
+        return value
+
+    def _handle_signals(self):
+        try:
+            os.read(self._sig_r, 512)
+        except BlockingIOError:
+            pass
+        while self._signals:
+            signum = self._signals.pop(0)
+            if signum == signal.SIGHUP:
+                self.desired = self._config_number('worker_count', int, self.desired)
+                print(f"Master: resizing pool to {self.desired} worker(s)")
+            elif self.draining:
+                print("Master: second stop signal, stopping workers now")
+                self.deadline = time.monotonic()
             else:
-                # compute exponential backoff: delay = base ** attempts
-                delay = int(backoff_base ** attempts)
-                next_ts = int(time.time()) + delay
-                storage.execute("UPDATE jobs SET state=?, next_attempt=?, updated_at=? WHERE id=?",
-                                ('pending', next_ts, now_ts, job_id))
-                print(f"[worker {worker_id}] job {job_id} failed rc={rc}; will retry after {delay}s (attempt {attempts}/{max_retries})")
+                self.drain_timeout = self._config_number('drain_timeout', float, self.drain_timeout)
+                print(f"Master: draining workers (up to {self.drain_timeout:.0f}s)...")
+                self.draining = True
+                self.deadline = time.monotonic() + self.drain_timeout
+                for slot in list(self.workers):
+                    self._stop(slot)
+
+    # ---------- workers ----------
+    def _spawn(self, slot):
+        stop = Event()
+        block = self.metric_blocks.setdefault(slot, metrics.new_block())
+        p = Process(target=_worker_process_entry, args=(slot, self.hub.channel(slot), self.concurrency, stop,
+                                                         self.selector, block))
+        p.start()
+        self.workers[slot] = {'process': p, 'stop': stop, 'started': time.monotonic()}
+        print(f"Started worker {slot} pid={p.pid}")
+
+    def _stop(self, slot):
+        self.workers[slot]['stop'].set()
+        self.hub.notify()
+
+    def _reap(self):
+        """Collect exited workers; restart the ones that weren't asked to stop."""
+        for slot, w in list(self.workers.items()):
+            p = w['process']
+            if p.is_alive():
+                continue
+            p.join()
+            del self.workers[slot]
+            self.hub.drop(slot)
+            requeued, dead = _on_every_shard(storage.requeue_owner_jobs, _owner_id(slot, p.pid))
+            if requeued or dead:
+                print(f"Master: worker {slot} left {requeued} job(s) requeued, {dead} moved to DLQ")
+            if w['stop'].is_set():
+                continue
+            print(f"Master: worker {slot} pid={p.pid} died (exitcode={p.exitcode})")
+            if time.monotonic() - w['started'] < self._MIN_HEALTHY_SECONDS:
+                self.crashes[slot] = self.crashes.get(slot, 0) + 1
+            else:
+                self.crashes[slot] = 0
+            # restart right away the first time, then back off if it keeps crashing
+            delay = min(2 ** (self.crashes[slot] - 1), self._MAX_RESTART_DELAY) if self.crashes[slot] else 0
+            self.restart_at[slot] = time.monotonic() + delay
+
+    def _reap_leases(self):
+        """Every half lease, take back jobs whose worker stopped heartbeating (hung, or not one of ours)."""
+        if time.monotonic() < self.lease_check_at:
+            return
+        self.lease_check_at = time.monotonic() + self.lease_seconds / 2
+        try:
+            requeued, dead = _on_every_shard(storage.reap_expired_leases)
+        except Exception as e:
+            print(f"Master: lease reaper failed: {e}")
+            return
+        if requeued or dead:
+            print(f"Master: {requeued} job(s) with expired leases requeued, {dead} moved to DLQ")
+
+    def _retention_pass(self):
+        try:
+            moved = sum(retention.run_once() for _ in shards.each())
+            if moved:
+                print(f"Master: retention moved {moved} finished job(s) out of the jobs table")
+        except Exception as e:
+            print(f"Master: retention pass failed: {e}")
+        finally:
+            storage.close_pool()
+
+    def _run_retention(self):
+        """Every `retention_interval` seconds, trim finished jobs in a background thread."""
+        if time.monotonic() < self.retention_at:
+            return
+        interval = self._config_number('retention_interval', float, retention.DEFAULT_INTERVAL)
+        self.retention_at = time.monotonic() + max(interval, 1.0)
+        if self._retention_thread is not None and self._retention_thread.is_alive():
+            return
+        self._retention_thread = threading.Thread(target=self._retention_pass, name='retention', daemon=True)
+        self._retention_thread.start()
+
+    def _run_scheduler(self):
+        """Create the jobs of due cron schedules and wake the workers for them."""
+        try:
+            self.scheduler.sync()
+            if self.scheduler.fire_due():
+                self.hub.notify()
+        except Exception as e:
+            print(f"Master: scheduler failed: {e}")
+
+    def _scale(self):
+        for slot in range(1, self.desired + 1):
+            if slot not in self.workers and time.monotonic() >= self.restart_at.get(slot, 0):
+                self.restart_at.pop(slot, None)
+                self._spawn(slot)
+        for slot, w in self.workers.items():
+            if slot > self.desired and not w['stop'].is_set():
+                self._stop(slot)
+
+    def _kill_stragglers(self):
+        for slot, w in self.workers.items():
+            if not w['process'].is_alive():
+                continue
+            print(f"Master: worker {slot} still busy at drain deadline, killing it")
+            # workers lead their own process group, so this takes the running job with it
+            try:
+                os.killpg(w['process'].pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for w in self.workers.values():
+            w['process'].join(timeout=5)
+        self._reap()
 
-def start_master(count:int=1):
+    def _next_wakeup(self):
+        timeout = 1.0
+        if self.restart_at:
+            timeout = min(timeout, max(min(self.restart_at.values()) - time.monotonic(), 0))
+        if self.deadline is not None:
+            timeout = min(timeout, max(self.deadline - time.monotonic(), 0))
+        fire = self.scheduler.next_fire()
+        if fire is not None and not self.draining:
+            timeout = min(timeout, max(fire - time.time(), 0))
+        return min(timeout, max(self.lease_check_at - time.monotonic(), 0))
+
+    def _collect_metrics(self):
+        # memory only: the workers' blocks plus what the master already knows
+        gauges = [('queuectl_workers', 'Worker processes the master is running.', len(self.workers)),
+                  ('queuectl_workers_desired', 'Worker processes the master keeps alive.', self.desired)]
+        return metrics.render(list(self.metric_blocks.values()), gauges)
+
+    def _abort(self):
+        """Stop every worker after an unexpected master error so none outlives the master."""
+        for w in self.workers.values():
+            w['stop'].set()
+        self.hub.notify()
+        deadline = time.monotonic() + self.drain_timeout
+        for w in self.workers.values():
+            w['process'].join(timeout=max(deadline - time.monotonic(), 0))
+        try:
+            self._kill_stragglers()
+        except Exception as e:
+            print(f"Master: could not recover jobs of stopped workers: {e}")
+
+    def run(self):
+        self._install_signals()
+        self.hub.listen()
+        listener = None
+        if self.metrics_port:
+            listener = metrics.serve(self.metrics_port, self._collect_metrics)
+            if listener:
+                print(f"Master: metrics at http://127.0.0.1:{self.metrics_port}/metrics")
+        try:
+            while True:
+                self._handle_signals()
+                self._reap()
+                self._reap_leases()
+                if self.draining:
+                    if not self.workers:
+                        break
+                    if time.monotonic() >= self.deadline:
+                        self._kill_stragglers()
+                        break
+                else:
+                    self._scale()
+                    self._run_retention()
+                    self._run_scheduler()
+                sentinels = [w['process'].sentinel for w in self.workers.values()]
+                mp_connection.wait(sentinels + [self._sig_r], timeout=self._next_wakeup())
+        except BaseException:
+            self._abort()
+            raise
+        finally:
+            signal.set_wakeup_fd(-1)
+            self.hub.close()
+            if listener:
+                listener.shutdown()
+        print("Master: all workers stopped")
+
+def start_master(count:int=1, concurrency:int=1, selector=None, metrics_port=None):
     """
-    Spawn a master process that starts `count` worker processes and waits.
-    We run master in foreground so user sees output. Master writes PID file.
-    Press Ctrl+C to stop (graceful shutdown).
+    Run the supervising master in the foreground with `count` worker processes.
+    With concurrency > 1 each worker process runs that many jobs at once (async_worker).
+    `selector` (a queues.QueueSelector) limits workers to some named queues; default all.
+    Master writes PID file. Ctrl+C or `worker stop` drains gracefully; `worker scale N`
+    resizes the pool. With `metrics_port` (or the metrics_port config value) the master
+    serves Prometheus metrics on 127.0.0.1:<port>/metrics.
     """
     if PID_FILE.exists():
-        print("Master appears to be running (pidfile exists). Stop it first or delete pidfile.")
-        return
+        try:
+            pid = int(PID_FILE.read_text().strip())
+        except ValueError:
+            pid = None
+        if pid and _pid_alive(pid):
+            print("Master appears to be running (pidfile exists). Stop it first or delete pidfile.")
+            return
+        print(f"Removing stale pidfile (pid {pid} is not running)")
 
     config.ensure_db()
+    # `worker scale` and SIGHUP work from this value
+    storage.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('worker_count',?)", (str(count),))
 
-    stop_event = Event()
-    processes = []
     try:
         # write pidfile for master
         PID_FILE.write_text(str(os.getpid()))
         print(f"Master PID {os.getpid()} (pidfile={PID_FILE})")
-        for i in range(count):
-            e = Event()
-            p = Process(target=_worker_process_entry, args=(i+1,))
-            p.start()
-            processes.append(p)
-            print(f"Started worker pid={p.pid}")
-        # wait for children
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("Master received KeyboardInterrupt, terminating workers...")
-        for p in processes:
-            try:
-                p.terminate()
-            except Exception:
-                pass
-        for p in processes:
-            p.join(timeout=5)
+        if selector:
+            print(f"Serving queues {', '.join(selector.queues)} ({selector.strategy})")
+        if metrics_port is None:
+            metrics_port = int(config.get_config('metrics_port') or 0)
+        Supervisor(count, concurrency, selector, metrics_port).run()
     finally:
         if PID_FILE.exists():
             try:
@@ -100,41 +674,84 @@ def start_master(count:int=1):
             except Exception:
                 pass
 
-def _worker_process_entry(worker_id):
+def _worker_process_entry(worker_id, wakeup=None, concurrency=1, event=None, selector=None, metrics_block=None):
     """
-    Entrypoint for each separate process; runs worker_loop until SIGTERM.
+    Entrypoint for each separate process; runs worker_loop until `event` is set by the
+    master or SIGTERM arrives.
     """
-    event = Event()
+    event = event or Event()
+    if metrics_block is not None:
+        metrics.attach(metrics_block)
 
     def _sigterm(signum, frame):
         print(f"[worker {worker_id}] received signal {signum}, stopping after current job")
         event.set()
+        if wakeup:
+            wakeup.poke()
 
+    # Own process group: the terminal's Ctrl+C only reaches the master, which turns it
+    # into a graceful drain. Job commands keep default signal dispositions.
+    os.setpgrp()
+    # drop handlers inherited from the master
+    signal.set_wakeup_fd(-1)
     signal.signal(signal.SIGTERM, _sigterm)
-    # inside a child process, ensure DB available
-    storage.init_db = storage.init_db  # noop
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
     print(f"[worker child {worker_id}] started, pid={os.getpid()}")
     try:
-        worker_loop(worker_id, event)
+        if concurrency > 1:
+            from . import async_worker
+            async_worker.async_worker_loop(worker_id, event, wakeup, concurrency, selector)
+        else:
+            worker_loop(worker_id, event, wakeup, selector)
     except KeyboardInterrupt:
         print(f"[worker child {worker_id}] interrupted")
     print(f"[worker child {worker_id}] exiting")
 
-def stop_master():
+def running_master():
+    """PID of the live master serving this directory, or None (quietly, unlike _master_pid)."""
+    try:
+        pid = int(PID_FILE.read_text().strip())
+    except (OSError, ValueError):
+        return None
+    return pid if _pid_alive(pid) else None
+
+def _master_pid():
     if not PID_FILE.exists():
         print("No master pidfile found.")
-        return
+        return None
+    pid = int(PID_FILE.read_text().strip())
+    if not _pid_alive(pid):
+        print(f"Master pid {pid} is not running; removing stale pidfile.")
+        PID_FILE.unlink()
+        return None
+    return pid
+
+def stop_master():
+    """Ask the master to drain; it removes its pidfile once the workers have exited."""
     try:
-        pid = int(PID_FILE.read_text().strip())
-        os.kill(pid, signal.SIGTERM)
-        print(f"Sent SIGTERM to master pid {pid}")
+        pid = _master_pid()
+        if pid:
+            os.kill(pid, signal.SIGTERM)
+            print(f"Sent SIGTERM to master pid {pid}")
     except Exception as e:
         print("Error stopping master:", e)
-    finally:
-        try:
-            PID_FILE.unlink()
-        except Exception:
-            pass
+
+def scale_workers(count:int):
+    """Persist the desired pool size and tell a running master to apply it."""
+    config.set_config('worker_count', count)
+    try:
+        pid = _master_pid()
+        if pid:
+            os.kill(pid, signal.SIGHUP)
+            print(f"Sent SIGHUP to master pid {pid}")
+    except Exception as e:
+        print("Error signalling master:", e)
+
+def reap_expired():
+    """Requeue jobs whose lease ran out now, without waiting for a master's periodic reaper."""
+    requeued, dead = _on_every_shard(storage.reap_expired_leases)
+    print(f"Requeued {requeued} job(s) with expired leases, moved {dead} to DLQ")
 
 def worker_status():
     from . import queue_manager
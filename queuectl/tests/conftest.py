@@ -0,0 +1,14 @@
+import pytest
+
+from src import storage, joblogs, client
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """An initialized queue.db (and job log directory) in tmp_path; yields the storage module."""
+    monkeypatch.setattr(storage, 'DB_PATH', tmp_path / 'queue.db')
+    monkeypatch.setattr(joblogs, 'LOG_DIR', tmp_path / 'job_logs')
+    # never talk to a daemon serving the working directory's queue.db
+    monkeypatch.setattr(client, 'SERVE_SOCK', tmp_path / 'queuectl.sock')
+    storage.init_db()
+    yield storage
+    storage.close_pool()
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from src import dashboard, storage
+
+@pytest.fixture
+def feed(db, monkeypatch):
+    """A fresh live-state feed, stopped at teardown so its poller can't outlive the test's queue.db."""
+    feed = dashboard._Feed()
+    monkeypatch.setattr(dashboard, '_feed', feed)
+    yield feed
+    feed.stop()
+
+def test_requests_share_lent_connections(db):
+    client = dashboard.app.test_client()
+    assert client.get('/').status_code == 200
+    assert client.post('/api/enqueue', json={'id': 'd1', 'command': 'true'}).status_code == 200
+    assert client.get('/api/dlq/list').get_json() == {'jobs': [], 'next_cursor': None}
+    # one connection served all three requests and went back to the idle list
+    assert len([c for pid, path, c in storage._idle if path == str(storage.DB_PATH)]) == 1
+    assert storage.fetch_one("SELECT state FROM jobs WHERE id='d1'")['state'] == 'pending'
+
+def test_job_log_supports_range_and_tail(db):
+    from src import joblogs
+
+    log = joblogs.LogWriter('j1', 1024, 4)
+    log.write(b''.join(b'row %03d\n' % i for i in range(300)))
+    log.close()
+    client = dashboard.app.test_client()
+
+    r = client.get('/api/jobs/j1/log', headers={'Range': 'bytes=8-15'})
+    assert r.status_code == 206
+    assert r.data == b'row 001\n'
+    assert r.headers['Content-Range'] == f"bytes 8-15/{joblogs.log_size('j1')}"
+    assert client.get('/api/jobs/j1/log?tail=1').data == b'row 299\n'
+    assert client.get('/api/jobs/nope/log').status_code == 404
+
+def _next_event(it):
+    chunk = next(it)
+    chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+    fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines())
+    return fields['event'], fields['id'], json.loads(fields['data'])
+
+def test_stream_clients_share_one_poller(feed, monkeypatch):
+    monkeypatch.setattr(dashboard, 'FEED_TICK', 0.05)
+    client = dashboard.app.test_client()
+
+    streams = [client.get('/api/stream', buffered=False) for _ in range(2)]
+    events = [iter(r.response) for r in streams]
+    first = [_next_event(it) for it in events]
+    assert [e[0] for e in first] == ['snapshot', 'snapshot']
+    assert first[0][2]['counts'] == {'dlq': 0}
+
+    client.post('/api/enqueue', json={'id': 'live', 'command': 'true'})
+    deltas = [_next_event(it) for it in events]
+    # both clients got the same change from the one shared read
+    assert deltas[0] == deltas[1]
+    name, _, delta = deltas[0]
+    assert name == 'delta'
+    assert delta['counts']['pending'] == 1 and delta['order'] == ['live']
+    for r in streams:
+        r.close()
+
+def test_json_endpoints_answer_conditional_gets(feed):
+    client = dashboard.app.test_client()
+    for url in ('/api/stats', '/api/dlq/list'):
+        first = client.get(url)
+        assert first.status_code == 200 and first.headers['ETag']
+        again = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304
+
+def test_api_jobs_paginates_with_cursors(db):
+    client = dashboard.app.test_client()
+    for i in range(5):
+        client.post('/api/enqueue', json={'id': f'p{i}', 'command': 'true'})
+    page = client.get('/api/jobs?limit=3').get_json()
+    assert [j['id'] for j in page['jobs']] == ['p0', 'p1', 'p2']
+    page = client.get(f"/api/jobs?limit=3&cursor={page['next_cursor']}").get_json()
+    assert [j['id'] for j in page['jobs']] == ['p3', 'p4'] and page['next_cursor'] is None
+    lines = client.get('/api/jobs?format=jsonl&state=pending').data.decode().splitlines()
+    assert [json.loads(l)['id'] for l in lines] == [f'p{i}' for i in range(5)]
+    assert client.get('/api/jobs?cursor=bogus').status_code == 400
+
+def test_retry_finds_jobs_on_any_shard(db, monkeypatch):
+    from src import shards
+
+    monkeypatch.setattr(dashboard.subprocess, 'Popen', lambda *a, **k: None)
+    shards.configure(2, by='id')
+    client = dashboard.app.test_client()
+    for i in range(6):
+        client.post('/api/enqueue', json={'id': f'r{i}', 'command': 'true'})
+    where = shards.locate([f'r{i}' for i in range(6)])
+    job_id = next(i for i, shard in where.items() if shard == 1)
+    with shards.using(1):
+        storage.execute("UPDATE jobs SET state='completed', attempts=1 WHERE id=?", (job_id,))
+    assert client.post(f'/api/retry/{job_id}').status_code == 200
+    with shards.using(1):
+        assert tuple(storage.fetch_one("SELECT state, attempts FROM jobs WHERE id=?", (job_id,))) == ('pending', 0)
+    assert client.post('/api/retry/nope').status_code == 404
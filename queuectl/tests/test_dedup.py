@@ -0,0 +1,87 @@
+import json
+import time
+
+from src import queue_manager, retention
+from src.models import Outcome
+
+def _enqueue(**payload):
+    queue_manager.enqueue_from_input(json.dumps({'command': 'true', **payload}))
+
+def _finish(db, job_id):
+    assert [r['id'] for r in db.atomic_claim_jobs('w', 1)] == [job_id]
+    db.apply_outcomes([Outcome(job_id, 'completed', int(time.time()))], 'w')
+
+def test_reenqueuing_an_id_only_replaces_finished_jobs(db, capsys):
+    _enqueue(id='a', priority=1)
+    db.atomic_claim_jobs('w', 1)
+    _enqueue(id='a', command='echo replaced')
+    assert 'not enqueued: duplicate of job a (processing)' in capsys.readouterr().out
+    row = db.fetch_one("SELECT state, command, claimed_by FROM jobs WHERE id='a'")
+    assert tuple(row) == ('processing', 'true', 'w')
+
+    db.apply_outcomes([Outcome('a', 'completed', int(time.time()))], 'w')
+    _enqueue(id='a', command='echo again')
+    row = db.fetch_one("SELECT state, command, attempts, claimed_by FROM jobs WHERE id='a'")
+    assert tuple(row) == ('pending', 'echo again', 0, None)
+    assert db.state_counts() == {'pending': 1, 'dlq': 0}
+
+def test_dedup_keys_collapse_within_their_window(db, tmp_path, capsys):
+    _enqueue(id='a', dedup_key='report:42')
+    _enqueue(id='b', dedup_key='report:42')
+    assert 'Job b not enqueued: duplicate of job a (pending)' in capsys.readouterr().out
+    _finish(db, 'a')
+    # still inside the window after completing
+    _enqueue(id='c', dedup_key='report:42')
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM jobs")['n'] == 1
+
+    _enqueue(id='d', dedup_key='short', dedup_window=1)
+    _finish(db, 'd')
+    db.execute("UPDATE dedup_keys SET expires_at=0 WHERE key='short'")
+    src = tmp_path / 'jobs.jsonl'
+    src.write_text('\n'.join(json.dumps({'id': f'e{i}', 'command': 'true', 'dedup_key': 'short'}) for i in range(3)))
+    assert queue_manager.enqueue_batch(str(src)) == 1
+    assert '2 duplicate(s) skipped' in capsys.readouterr().out
+    assert db.fetch_one("SELECT job_id FROM dedup_keys WHERE key='short'")['job_id'] == 'e0'
+
+    retention.run_once(now=int(time.time()) + 7200)
+    # report:42's window is over and its job finished; e0 is still pending
+    assert [r['key'] for r in db.fetch_all("SELECT key FROM dedup_keys")] == ['short']
+
+def test_cacheable_jobs_reuse_a_stored_result(db, monkeypatch):
+    from multiprocessing import Event
+    from src import worker, joblogs
+
+    _enqueue(id='a', command='echo computed', cache_ttl=60)
+    _enqueue(id='b', command='echo computed', cache_ttl=60)
+    _enqueue(id='c', command='echo computed')
+    event = Event()
+    runs = []
+    real_run = worker._run_command
+
+    def run(command, timeout, log):
+        runs.append(command)
+        return real_run(command, timeout, log)
+    monkeypatch.setattr(worker, '_run_command', run)
+    real_apply = db.apply_outcomes
+
+    def apply(outcomes, owner=None, start_ids=()):
+        real_apply(outcomes, owner, start_ids)
+        if db.fetch_one("SELECT COUNT(*) AS n FROM jobs WHERE state='pending'")['n'] == 0:
+            event.set()
+    monkeypatch.setattr(db, 'apply_outcomes', apply)
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('ack_batch','1')")
+
+    worker.worker_loop(1, event)
+    # b came from the cache; c isn't cacheable and ran
+    assert runs == ['echo computed', 'echo computed']
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM jobs WHERE state='completed'")['n'] == 3
+    assert b'cache hit' in joblogs.tail_lines('b', 5)
+    entry = db.fetch_one("SELECT output, expires_at - stored_at AS ttl FROM result_cache")
+    assert (entry['output'], entry['ttl']) == ('computed\n', 60)
+
+    # least recently used entries go beyond cache_max_entries
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('cache_max_entries','2')")
+    now = int(time.time())
+    db.apply_outcomes([Outcome(f'x{i}', 'completed', now + i, command=f'echo {i}', cache_ttl=60, output=str(i))
+                       for i in range(3)])
+    assert db.cached_results(['echo computed', 'echo 0', 'echo 1', 'echo 2']) == {'echo 1': '1', 'echo 2': '2'}
@@ -0,0 +1,84 @@
+import json
+import time
+
+import pytest
+
+from src import queue_manager
+from src.models import Outcome
+
+def _enqueue(job_id, *deps, **fields):
+    queue_manager.enqueue_from_input(json.dumps({'id': job_id, 'command': 'true', 'depends_on': list(deps), **fields}))
+
+def _states(db):
+    return {r['id']: (r['state'], r['unmet']) for r in db.fetch_all("SELECT id, state, unmet FROM jobs")}
+
+def _finish(db, job_id, action='completed'):
+    assert [r['id'] for r in db.atomic_claim_jobs('w', 1)] == [job_id]
+    db.apply_outcomes([Outcome(job_id, action, int(time.time()), command='true', attempts=1)], 'w')
+
+def test_completions_release_dependents_once_all_are_met(db):
+    # a -> (b, c) -> d, and e waits for d and for the already completed x
+    _enqueue('x')
+    _finish(db, 'x')
+    _enqueue('a')
+    _enqueue('b', 'a')
+    _enqueue('c', 'a')
+    _enqueue('d', 'b', 'c')
+    _enqueue('e', 'd', 'x', run_at=int(time.time()) + 3600)
+    assert _states(db) == {'x': ('completed', 0), 'a': ('pending', 0), 'b': ('waiting', 1), 'c': ('waiting', 1),
+                           'd': ('waiting', 2), 'e': ('waiting', 1)}
+
+    _finish(db, 'a')
+    assert _states(db)['b'] == _states(db)['c'] == ('pending', 0)
+    _finish(db, 'b')
+    assert _states(db)['d'] == ('waiting', 1)
+    # a result for a job the worker no longer holds releases nothing
+    db.apply_outcomes([Outcome('b', 'completed', int(time.time()))], 'w')
+    assert _states(db)['d'] == ('waiting', 1)
+    _finish(db, 'c')
+    _finish(db, 'd')
+    # its run_at is still ahead
+    assert _states(db)['e'] == ('scheduled', 0)
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM job_deps")['n'] == 0
+
+def test_failure_and_cancel_propagate_to_descendants(db, capsys):
+    _enqueue('a')
+    _enqueue('b', 'a')
+    _enqueue('c', 'b')
+    _enqueue('other')
+    _enqueue('d', 'c', 'other')
+    _finish(db, 'a', 'dlq')
+    states = _states(db)
+    assert [states[j][0] for j in 'bcd'] == ['cancelled'] * 3
+    assert states['other'] == ('pending', 0)
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM job_deps")['n'] == 0
+    with pytest.raises(ValueError, match='failed'):
+        _enqueue('late', 'a')
+
+    _enqueue('p')
+    _enqueue('q', 'p')
+    queue_manager.cancel_job('p')
+    assert 'and 1 job(s) depending on it' in capsys.readouterr().out
+    assert _states(db)['q'] == ('cancelled', 0)
+    with pytest.raises(ValueError, match="can't be cancelled"):
+        queue_manager.cancel_job('q')
+
+def test_dependencies_must_come_first_and_live_jobs_are_not_replaced(db, tmp_path):
+    with pytest.raises(ValueError, match='enqueued first'):
+        _enqueue('a', 'missing')
+    src = tmp_path / 'dag.jsonl'
+    src.write_text('\n'.join(json.dumps({'id': f'n{i}', 'command': 'true', 'depends_on': [f'n{i - 1}'] if i else []})
+                             for i in range(50)))
+    assert queue_manager.enqueue_batch(str(src), chunk_size=7) == 50
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM jobs WHERE state='waiting'")['n'] == 49
+
+    # n0 is still pending, so re-enqueuing it (which would close a cycle) is a duplicate
+    _enqueue('n0', 'n30')
+    assert _states(db)['n0'] == ('pending', 0)
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM job_deps")['n'] == 49
+    # forward references within one input are rejected too
+    fwd = tmp_path / 'fwd.jsonl'
+    fwd.write_text(json.dumps({'id': 'y', 'command': 'true', 'depends_on': ['z']}) + '\n' +
+                   json.dumps({'id': 'z', 'command': 'true'}))
+    with pytest.raises(ValueError, match='enqueued first'):
+        queue_manager.enqueue_batch(str(fwd))
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from src import joblogs, worker
+
+def _write_log(job_id, data, segment_bytes=1024, segments=3):
+    log = joblogs.LogWriter(job_id, segment_bytes, segments)
+    log.write(data)
+    log.close()
+
+def test_log_rotation_caps_size_and_reads_span_segments(db):
+    data = bytes(range(256)) * 20      # 5120 bytes: five 1 KiB segments, three kept
+    _write_log('a/b', data)
+    assert [p.name for p in joblogs.segments('a/b')] == ['a%2Fb.log.2', 'a%2Fb.log.1', 'a%2Fb.log']
+    assert joblogs.log_size('a/b') == 3072
+    kept = data[-3072:]
+    assert joblogs.read_range('a/b', 1000, 1100) == kept[1000:1100]
+
+def test_tail_lines_reads_only_the_end(db):
+    _write_log('t', b''.join(b'line %d\n' % i for i in range(500)), segment_bytes=1 << 20)
+    assert joblogs.tail_lines('t', 2) == b'line 498\nline 499\n'
+
+def test_run_command_streams_output_to_the_log(db):
+    log = joblogs.LogWriter('big', 64 * 1024, 2)
+    # ~1 MiB of output; only the last two 64 KiB segments and a short tail are kept
+    rc, tail = worker._run_command("yes queuectl | head -c 1048576; echo done >&2", 10, log)
+    log.close()
+    assert rc == 0
+    assert tail.endswith('done\n') and len(tail) <= joblogs.TAIL_CHARS
+    assert joblogs.log_size('big') == 64 * 1024 + 5
+
+def test_follow_continues_across_rotation(db):
+    log = joblogs.LogWriter('f', 1024, 2)
+    finished = threading.Event()
+    got = []
+    reader = threading.Thread(target=lambda: got.extend(joblogs.follow('f', finished.is_set, offset=0, poll=0.01)))
+    reader.start()
+    for i in range(10):
+        log.write(b'%d' % i * 300)
+        # a follower that keeps up loses nothing, even though only two segments are kept
+        deadline = time.monotonic() + 5
+        while sum(map(len, got)) < (i + 1) * 300 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    log.close()
+    finished.set()
+    reader.join(timeout=10)
+    assert b''.join(got) == b''.join(b'%d' % i * 300 for i in range(10))
@@ -0,0 +1,57 @@
+import urllib.request
+
+from src import metrics
+
+def test_render_sums_blocks_into_cumulative_histograms():
+    a, b = metrics.new_block(), metrics.new_block()
+    metrics.attach(a)
+    metrics.observe('queuectl_job_run_seconds', 0.0002)
+    metrics.observe('queuectl_db_op_seconds', 0.02, 'claim')
+    metrics.attach(b)
+    metrics.observe('queuectl_job_run_seconds', 7200)
+    metrics.inc('queuectl_job_attempts_total', 'dlq')
+
+    text = metrics.render([a, b], [('queuectl_workers', 'Workers.', 2)])
+    assert 'queuectl_job_run_seconds_bucket{le="0.0005"} 1' in text
+    assert 'queuectl_job_run_seconds_bucket{le="3600"} 1' in text
+    assert 'queuectl_job_run_seconds_bucket{le="+Inf"} 2' in text
+    assert 'queuectl_job_run_seconds_sum 7200.0002' in text
+    assert 'queuectl_db_op_seconds_bucket{op="claim",le="0.025"} 1' in text
+    assert 'queuectl_db_op_seconds_count{op="apply_outcomes"} 0' in text
+    assert 'queuectl_job_attempts_total{outcome="dlq"} 1' in text
+    assert '# TYPE queuectl_workers gauge\nqueuectl_workers 2' in text
+
+def test_serve_answers_scrapes_from_memory():
+    server = metrics.serve(0, lambda: 'queuectl_up 1\n')
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as resp:
+            assert resp.read() == b'queuectl_up 1\n'
+    finally:
+        server.shutdown()
+
+def test_worker_records_each_attempt(db, monkeypatch):
+    from multiprocessing import Event
+    from src import worker
+
+    block = metrics.new_block()
+    monkeypatch.setattr(metrics, '_block', block)
+    db.execute("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+               "VALUES('a','exit 2','pending',0,3,'2024-01-01','x',0,60)")
+    event = Event()
+    real_claim = db.atomic_claim_jobs
+
+    def claim(*args):
+        event.set()
+        return real_claim(*args)
+    monkeypatch.setattr(db, 'atomic_claim_jobs', claim)
+
+    worker.worker_loop(1, event)
+    row = db.fetch_one("SELECT * FROM job_attempts WHERE job_id='a'")
+    assert (row['attempt'], row['exit_code'], row['outcome']) == (1, 2, 'retry')
+    assert row['queued_at'] <= row['claimed_at'] <= row['started_at'] <= row['finished_at']
+    text = metrics.render([block])
+    assert 'queuectl_job_attempts_total{outcome="retry"} 1' in text
+    assert 'queuectl_job_queue_wait_seconds_count 1' in text
+    assert 'queuectl_claim_seconds_count 1' in text
+    assert 'queuectl_db_op_seconds_count{op="apply_outcomes"} 1' in text
@@ -0,0 +1,127 @@
+import io
+import json
+import pytest
+
+from src import queue_manager
+
+def test_iter_payloads_reads_json_lines_and_arrays():
+    lines = io.StringIO('{"command":"a"}\n\n{"command":"b"}\n')
+    assert [p['command'] for p in queue_manager.iter_payloads(lines)] == ['a', 'b']
+
+    array = json.dumps([{"command": f"c{i}", "pad": "x" * 100} for i in range(50)], indent=1)
+    got = list(queue_manager._iter_json_array(io.StringIO(array[1:]), '', chunk_size=7))
+    assert [p['command'] for p in got] == [f"c{i}" for i in range(50)]
+
+def test_enqueue_batch_inserts_in_chunks(db, tmp_path, capsys):
+    src = tmp_path / 'jobs.jsonl'
+    src.write_text(''.join(json.dumps({"id": f"j{i}", "command": "true"}) + '\n' for i in range(25)))
+    db.execute("UPDATE meta SET value='7' WHERE key='max_retries'")
+
+    assert queue_manager.enqueue_batch(str(src), chunk_size=10) == 25
+    assert db.fetch_one("SELECT COUNT(*) AS c FROM jobs WHERE state='pending' AND max_retries=7")['c'] == 25
+    assert "Enqueued 25 jobs" in capsys.readouterr().out
+
+def test_enqueue_batch_reports_bad_record(db, tmp_path):
+    src = tmp_path / 'jobs.jsonl'
+    src.write_text('{"command":"true"}\n{"id":"no-command"}\n')
+    with pytest.raises(ValueError, match="record 2"):
+        queue_manager.enqueue_batch(str(src))
+
+class _CountingStream(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.chars_read = 0
+
+    def read(self, n=-1):
+        data = super().read(n)
+        self.chars_read += len(data)
+        return data
+
+def test_json_array_errors_are_reported_without_reading_the_rest():
+    body = '{"command":"a"} {"command":"b"},' + ', '.join('{"command":"x"}' for _ in range(100000)) + ']'
+    stream = _CountingStream(body)
+    it = queue_manager._iter_json_array(stream, '', chunk_size=64)
+    assert next(it)['command'] == 'a'
+    with pytest.raises(ValueError, match="expected ',' or ']' after element 1"):
+        next(it)
+    assert stream.chars_read < 1000
+
+    stream = _CountingStream('{"command": nope}, ' + 'x' * (queue_manager.MAX_RECORD_CHARS * 3) + ']')
+    with pytest.raises(ValueError, match="element 1 is malformed"):
+        list(queue_manager._iter_json_array(stream, '', chunk_size=65536))
+    assert stream.chars_read < queue_manager.MAX_RECORD_CHARS + 2 * 65536
+
+    assert list(queue_manager._iter_json_array(io.StringIO(' ]'), '')) == []
+
+def test_payload_priority_and_queue_are_validated():
+    from src.queue_manager import _job_from_payload
+
+    job = _job_from_payload({'command': 'true', 'priority': '7', 'queue': 'web'}, {'max_retries': 3, 'timeout': 60})
+    assert (job.priority, job.queue) == (7, 'web')
+    assert _job_from_payload({'command': 'true'}, {'max_retries': 3, 'timeout': 60}).queue == 'default'
+    for bad in ({'priority': 'high'}, {'queue': ''}, {'queue': 3}):
+        with pytest.raises(ValueError):
+            _job_from_payload({'command': 'true', **bad}, {'max_retries': 3, 'timeout': 60})
+
+def test_iter_rows_pages_by_keyset_with_filters(db):
+    db.execute_many("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout,queue) "
+                    "VALUES(?,?,?,?,?,?,?,?,?,?)",
+                    [(f'j{i}', f'echo {i}' if i % 2 else f'sleep {i}', 'pending', 0, 3, f'2024-01-0{i // 3 + 1}', 'x', 0, 60,
+                      'web' if i < 6 else 'bulk') for i in range(9)])
+    ids = lambda rows: [r['id'] for r in rows]
+
+    # small pages, same created_at across rows: (created_at, id) keeps the order total
+    assert ids(queue_manager.iter_rows('jobs', page_size=2)) == [f'j{i}' for i in range(9)]
+    first = list(queue_manager.iter_rows('jobs', limit=4))
+    rest = queue_manager.iter_rows('jobs', after=queue_manager.encode_cursor('jobs', first[-1]))
+    assert ids(first) + ids(rest) == [f'j{i}' for i in range(9)]
+    assert ids(queue_manager.iter_rows('jobs', queue='web', prefix='echo')) == ['j1', 'j3', 'j5']
+    assert ids(queue_manager.iter_rows('jobs', since='2024-01-02', until='2024-01-03')) == ['j3', 'j4', 'j5']
+    with pytest.raises(ValueError):
+        list(queue_manager.iter_rows('jobs', after='not-a-cursor'))
+
+def test_list_pages_use_an_index(db):
+    for table, key, where in (('jobs', 'created_at', ''), ('jobs', 'created_at', 'state=? AND '), ('dlq', 'failed_at', '')):
+        params = ('pending',) if where else ()
+        plan = [r['detail'] for r in db.fetch_all(
+            f"EXPLAIN QUERY PLAN SELECT * FROM {table} WHERE {where}({key}, id) > (?, ?) ORDER BY {key}, id LIMIT 10",
+            (*params, 'x', 'y'))]
+        assert any('USING INDEX' in d for d in plan) and not any('TEMP B-TREE' in d for d in plan), plan
+
+def _fail_into_dlq(job_id, command, error, **fields):
+    from src import storage
+    from src.models import Outcome
+    queue_manager.enqueue_from_input(json.dumps({'id': job_id, 'command': command, **fields}))
+    storage.atomic_claim_jobs('w', queues=[fields.get('queue', 'default')])
+    storage.apply_outcomes([Outcome(job_id, 'dlq', command=command, finished_at=1, attempts=1, last_error=error)], 'w')
+
+def test_bulk_dlq_retry_restores_settings_and_skips_live_ids(db):
+    from src import storage
+    _fail_into_dlq('a', 'curl x', 'connection timeout', max_retries=7, timeout=5, priority=3, queue='net')
+    _fail_into_dlq('b', 'ls', 'exit 2')
+    _fail_into_dlq('c', 'curl y', 'timeout')
+    queue_manager.enqueue_from_input(json.dumps({'id': 'c', 'command': 'again'}))
+
+    assert queue_manager.retry_dlq(match='*timeout*', chunk_size=1) == (1, 1)
+    row = storage.fetch_one("SELECT * FROM jobs WHERE id='a'")
+    assert (row['state'], row['attempts'], row['max_retries'], row['timeout'], row['priority'], row['queue']) == \
+        ('pending', 0, 7, 5, 3, 'net')
+    assert sorted(r['id'] for r in storage.fetch_all("SELECT id FROM dlq")) == ['b', 'c']
+
+    assert queue_manager.purge_dlq(job_id='b') == 1
+    assert [r['id'] for r in storage.fetch_all("SELECT id FROM dlq")] == ['c']
+
+def test_bulk_dlq_retry_staggers_release(db):
+    from src import storage
+    for i in range(4):
+        _fail_into_dlq(f'j{i}', 'false', 'boom')
+    before = int(__import__('time').time())
+    assert queue_manager.retry_dlq(rate=2, chunk_size=3) == (4, 0)
+    due = [r['next_attempt'] - before for r in storage.fetch_all("SELECT next_attempt FROM jobs ORDER BY id")]
+    assert due[0] in (0, 1) and due[3] - due[0] == 1 and due == sorted(due)
+
+def test_dlq_command_requires_a_selection(db):
+    with pytest.raises(ValueError):
+        queue_manager.retry_dlq_job()
+    with pytest.raises(ValueError):
+        queue_manager.purge_dlq_jobs('a', select_all=True)
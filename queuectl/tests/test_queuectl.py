@@ -41,3 +41,11 @@ def test_enqueue_and_worker_completion(tmp_path):
     # kill worker
     p.terminate()
     p.wait(timeout=5)
+
+def test_user_errors_exit_2_without_a_traceback(tmp_path):
+    import sys
+    for args in (['cancel', 'no-such-job'], ['shards', '0'], ['dlq', 'retry']):
+        p = subprocess.run([sys.executable, str(ROOT / 'queuectl.py'), *args], cwd=tmp_path,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        assert p.returncode == 2
+        assert p.stderr.startswith('Error: ') and 'Traceback' not in p.stderr
@@ -0,0 +1,23 @@
+import pytest
+
+from src.queues import QueueSelector, parse_selector
+
+def test_weighted_selector_interleaves_by_weight():
+    sel = QueueSelector(['a', 'b'], [3, 1])
+    firsts = [sel.order()[0] for _ in range(8)]
+    assert firsts == ['a', 'a', 'b', 'a'] * 2
+    # whatever leads, the other queues remain as fallbacks
+    assert sorted(sel.order()) == ['a', 'b']
+
+def test_strict_selector_keeps_listed_order():
+    sel = parse_selector('hi, lo', strategy='strict')
+    assert [sel.order() for _ in range(2)] == [['hi', 'lo']] * 2
+
+def test_selector_rejects_bad_specs():
+    assert parse_selector(None) is None
+    with pytest.raises(ValueError):
+        parse_selector('a,b', '3')
+    with pytest.raises(ValueError):
+        parse_selector('a', 'x')
+    with pytest.raises(ValueError):
+        parse_selector(None, '1')
@@ -0,0 +1,86 @@
+import sqlite3
+
+from src import joblogs, retention
+
+DAY = 86400
+NOW = 1_700_000_000     # 2023-11-14
+
+def _completed(db, job_id, finished_at):
+    db.execute("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout,finished_at) "
+               "VALUES(?,?,?,?,?,?,?,?,?,?)", (job_id, 'true', 'completed', 1, 3, 'x', str(finished_at), 0, 60, finished_at))
+
+def test_old_completed_jobs_move_to_monthly_archives(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, 'ARCHIVE_DIR', tmp_path / 'archive')
+    monkeypatch.setattr(retention, 'RETENTION_BATCH', 2)
+    _completed(db, 'oct', NOW - 30 * DAY)
+    _completed(db, 'nov1', NOW - 8 * DAY)
+    _completed(db, 'nov2', NOW - 8 * DAY + 1)
+    _completed(db, 'recent', NOW - DAY)
+    db.execute("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+               "VALUES('todo','true','pending',0,3,'x','x',0,60)")
+    log = joblogs.LogWriter('oct')
+    log.write(b'done\n')
+    log.close()
+
+    assert retention.run_once(NOW) == 3
+    assert sorted(r['id'] for r in db.fetch_all("SELECT id FROM jobs")) == ['recent', 'todo']
+    assert joblogs.segments('oct') == []
+    oct_ids = sqlite3.connect(retention.archive_path('2023-10')).execute("SELECT id FROM jobs").fetchall()
+    nov_ids = sqlite3.connect(retention.archive_path('2023-11')).execute("SELECT id FROM jobs ORDER BY id").fetchall()
+    assert (oct_ids, nov_ids) == ([('oct',)], [('nov1',), ('nov2',)])
+    # nothing left to do, and the archives are detached again
+    assert retention.run_once(NOW) == 0
+    assert [r['name'] for r in db.fetch_all("PRAGMA database_list")] == ['main']
+
+def test_count_limit_in_delete_mode(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, 'ARCHIVE_DIR', tmp_path / 'archive')
+    for key, value in (('retention_seconds', '0'), ('retention_keep', '2'), ('retention_mode', 'delete')):
+        db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES(?,?)", (key, value))
+    for i in range(5):
+        _completed(db, f'j{i}', NOW - 10 * DAY + i)
+
+    assert retention.run_once(NOW) == 3
+    assert [r['id'] for r in db.fetch_all("SELECT id FROM jobs ORDER BY id")] == ['j3', 'j4']
+    assert not (tmp_path / 'archive').exists()
+
+def test_new_databases_use_incremental_auto_vacuum(db):
+    assert db.fetch_one("PRAGMA auto_vacuum")[0] == 2
+
+def test_cancelled_jobs_age_out_with_their_dependents(db, tmp_path, monkeypatch):
+    import json
+    from src import queue_manager
+
+    monkeypatch.setattr(retention, 'ARCHIVE_DIR', tmp_path / 'archive')
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('retention_mode','delete')")
+    for payload in ({'id': 'root', 'command': 'true', 'run_at': '2099-01-01T00:00:00Z'},
+                    {'id': 'leaf', 'command': 'true', 'depends_on': ['root']}):
+        queue_manager.enqueue_from_input(json.dumps(payload))
+    queue_manager.cancel_job('root')
+    log = joblogs.LogWriter('leaf')
+    log.write(b'never ran\n')
+    log.close()
+    rows = db.fetch_all("SELECT state, finished_at FROM jobs")
+    assert {r['state'] for r in rows} == {'cancelled'} and all(r['finished_at'] for r in rows)
+
+    assert retention.run_once(rows[0]['finished_at'] + 1) == 0
+    assert retention.run_once(rows[0]['finished_at'] + 8 * DAY) == 2
+    assert db.fetch_all("SELECT id FROM jobs") == [] and joblogs.segments('leaf') == []
+
+def test_dlq_is_kept_unless_it_has_a_retention_window(db):
+    from src import queue_manager
+
+    for job_id, failed_at in (('old', NOW - 10 * DAY), ('new', NOW - DAY), ('purged', NOW)):
+        db.execute("INSERT INTO dlq(id,command,failed_at,attempts,last_error) VALUES(?,?,?,?,?)",
+                   (job_id, 'false', failed_at, 3, 'boom'))
+        log = joblogs.LogWriter(job_id)
+        log.write(b'boom\n')
+        log.close()
+    retention.run_once(NOW)
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM dlq")['n'] == 3
+
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('dlq_retention_seconds',?)", (str(7 * DAY),))
+    retention.run_once(NOW)
+    assert [r['id'] for r in db.fetch_all("SELECT id FROM dlq ORDER BY id")] == ['new', 'purged']
+    assert joblogs.segments('old') == []
+    assert queue_manager.purge_dlq('purged') == 1
+    assert joblogs.segments('purged') == [] and joblogs.segments('new')
@@ -0,0 +1,67 @@
+import json
+import time
+
+import pytest
+
+from src import queue_manager, scheduler
+from src.cron import Cron
+
+NOW = 1_700_000_000     # 2023-11-14T22:13:20Z
+
+def test_cron_next_after():
+    assert Cron('*/15 * * * *').next_after(NOW) == NOW - 20 + 60 * 2
+    # Friday 22:13 -> Monday 09:00
+    assert Cron('0 9 * * mon-fri').next_after(NOW + 3 * 86400) == 1_700_470_800
+    # both day fields restricted: either matches (the 1st of the month or any Sunday)
+    assert Cron('0 0 1 * 0').next_after(NOW) == 1_700_352_000
+    assert Cron('@daily').next_after(NOW) == 1_700_006_400
+    for bad in ('* * *', '60 * * * *', '*/0 * * * *', '5-1 * * * *'):
+        with pytest.raises(ValueError):
+            Cron(bad)
+    with pytest.raises(ValueError):
+        Cron('0 0 30 2 *').next_after(NOW)
+
+def test_run_at_jobs_wait_outside_the_claim_index(db):
+    later = int(time.time()) + 3600
+    queue_manager.enqueue_from_input(json.dumps({'id': 'later', 'command': 'true', 'run_at': later}))
+    queue_manager.enqueue_from_input(json.dumps({'id': 'soon', 'command': 'true',
+                                                 'run_at': '2000-01-01T00:00:00Z'}))
+    assert db.fetch_one("SELECT state FROM jobs WHERE id='later'")['state'] == 'scheduled'
+    assert db.next_due_ts() == 946684800
+    assert [r['id'] for r in db.atomic_claim_jobs('w', 10)] == ['soon']
+    assert db.next_due_ts() == later
+
+    db.execute("UPDATE jobs SET next_attempt=? WHERE id='later'", (int(time.time()) - 1,))
+    assert [r['id'] for r in db.atomic_claim_jobs('w', 10)] == ['later']
+
+def test_logs_follow_waits_for_a_scheduled_job(db):
+    later = int(time.time()) + 3600
+    queue_manager.enqueue_from_input(json.dumps({'id': 'later', 'command': 'true', 'run_at': later}))
+    assert not queue_manager._job_finished('later')
+    queue_manager.cancel_job('later')
+    assert queue_manager._job_finished('later') and queue_manager._job_finished('gone')
+
+def test_scheduler_fires_from_its_heap_and_picks_up_changes(db, monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: NOW)
+    queue_manager.enqueue_from_input(json.dumps({'id': 'tick', 'command': 'echo hi', 'cron': '*/5 * * * *',
+                                                 'queue': 'cron'}))
+    sched = scheduler.Scheduler()
+    sched.sync()
+    first = NOW - 200 + 300         # 22:15
+    assert sched.next_fire() == first
+    assert sched.fire_due(first - 1) == 0
+
+    # the master was down for an hour: one catch-up run, then on from now
+    assert sched.fire_due(first + 3600) == 1
+    job = db.fetch_one("SELECT * FROM jobs WHERE id=?", (f'tick@{first}',))
+    assert (job['command'], job['queue'], job['state']) == ('echo hi', 'cron', 'pending')
+    assert sched.next_fire() == first + 3600 + 300
+
+    # replacing the schedule supersedes its heap entry; removing it stops it
+    queue_manager.enqueue_from_input(json.dumps({'id': 'tick', 'command': 'echo hi', 'cron': '@hourly'}))
+    sched.sync()
+    assert sched.next_fire() == NOW - 800 + 3600      # 23:00
+    queue_manager.remove_schedule('tick')
+    assert sched.fire_due(NOW + 86400) == 0
+    assert sched.next_fire() is None
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM jobs")['n'] == 1
@@ -0,0 +1,67 @@
+import json
+import time
+
+import pytest
+
+from src import client, queue_manager, server
+from src.models import Outcome
+
+@pytest.fixture
+def daemon(db):
+    srv = server.QueueServer()
+    srv.start()
+    yield srv
+    client.disconnect()
+    srv.stop()
+
+def test_cli_and_worker_calls_go_through_the_daemon(daemon, db, capsys):
+    queue_manager.enqueue_from_input(json.dumps({'id': 'a', 'command': 'true'}))
+    queue_manager.enqueue_from_input(json.dumps({'id': 'b', 'command': 'true', 'depends_on': ['a']}))
+    assert 'Enqueued job b, waiting on 1 job(s)' in capsys.readouterr().out
+    remote = client.remote()
+    assert remote is not None
+
+    rows = remote.atomic_claim_jobs('w1', 5)
+    assert [r['id'] for r in rows] == ['a']
+    remote.apply_outcomes([Outcome('a', 'completed', int(time.time()))], 'w1')
+    assert remote.call('status') == {'completed': 1, 'pending': 1, 'dlq': 0}
+    assert db.fetch_one("SELECT state FROM jobs WHERE id='b'")['state'] == 'pending'
+
+    with pytest.raises(ValueError, match="must contain 'command'"):
+        remote.call('enqueue', payloads=[{'id': 'x'}])
+    assert daemon.applied == daemon.commits == 6
+
+def test_pipelined_requests_share_commits_and_fail_alone(daemon, db):
+    remote = client.remote()
+    for i in range(300):
+        payload = {'id': f'j{i}', 'command': 'true'} if i != 150 else {'id': 'bad'}
+        remote.send('enqueue', payloads=[payload])
+    replies = []
+    for i in range(300):
+        try:
+            replies.append(remote.receive())
+        except ValueError:
+            replies.append(None)
+    assert [i for i, r in enumerate(replies) if r is None] == [150]
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM jobs")['n'] == 299
+    # the writer took whatever had queued up during each commit
+    assert daemon.commits < 300
+
+def test_worker_uses_the_daemon(daemon, db):
+    from multiprocessing import Event
+    from src import worker
+
+    queue_manager.enqueue_from_input(json.dumps({'id': 'a', 'command': 'true'}))
+    event = Event()
+    real = client.Client.apply_outcomes
+
+    def ack_then_stop(self, *args):
+        event.set()
+        return real(self, *args)
+    client.Client.apply_outcomes = ack_then_stop
+    try:
+        worker.worker_loop(1, event)
+    finally:
+        client.Client.apply_outcomes = real
+    assert db.fetch_one("SELECT state FROM jobs WHERE id='a'")['state'] == 'completed'
+    assert daemon.applied >= 3      # enqueue, claim, ack
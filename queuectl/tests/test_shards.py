@@ -0,0 +1,106 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src import queue_manager, shards, limits, config, storage
+from src.models import Outcome
+
+def _enqueue(**payload):
+    queue_manager.enqueue_from_input(json.dumps({'command': 'true', **payload}))
+
+def _ids_on(shard, table='jobs'):
+    with shards.using(shard):
+        return sorted(r['id'] for r in storage.fetch_all(f"SELECT id FROM {table}"))
+
+def test_jobs_are_routed_and_read_back_across_shards(db, tmp_path, capsys):
+    shards.configure(3, by='id')
+    assert (tmp_path / 'queue-2.db').exists()
+    ids = [f'j{i:02}' for i in range(30)]
+    src = tmp_path / 'jobs.jsonl'
+    src.write_text('\n'.join(json.dumps({'id': i, 'command': 'true', 'created_at': f'2024-01-01T00:00:{i[1:]}Z'})
+                             for i in ids))
+    assert queue_manager.enqueue_batch(str(src)) == 30
+    placed = [_ids_on(shard) for shard in range(3)]
+    assert sorted(sum(placed, [])) == ids and all(placed)
+    # a dependent follows its dependency; a known id stays where it is
+    _enqueue(id='child', depends_on=['j07'])
+    assert 'child' in _ids_on(shards.locate(['j07'])['j07'])
+    _enqueue(id='j07')
+    assert 'not enqueued: duplicate of job j07 (pending)' in capsys.readouterr().out
+
+    assert shards.state_counts() == {'dlq': 0, 'pending': 30, 'waiting': 1}
+    # the merged listing keeps one order, and its cursors resume it
+    first = list(queue_manager.iter_rows('jobs', limit=12))
+    cursor = queue_manager.encode_cursor('jobs', first[-1])
+    rest = list(queue_manager.iter_rows('jobs', after=cursor))
+    assert [r['id'] for r in first + rest] == ids + ['child']
+
+    with pytest.raises(ValueError, match='holds 31 job'):
+        shards.configure(1)
+
+def test_workers_claim_from_home_then_steal_and_ack_to_the_jobs_shard(db):
+    from src import worker
+
+    shards.configure(2, by='queue')
+    queues = {shards.route(SimpleNamespace(queue=q)): q for q in ('q0', 'q1', 'q2', 'q3', 'q4', 'q5')}
+    for shard in (0, 1):
+        _enqueue(id=f'on{shard}', queue=queues[shard])
+    jobs = worker._claim('w1', 1, 1, 60, None, home=1)
+    assert [(j['id'], j['shard']) for j in jobs] == [('on1', 1)]
+    # home is empty now: the next claim steals from shard 0
+    jobs += worker._claim('w1', 1, 1, 60, None, home=1)
+    assert [(j['id'], j['shard']) for j in jobs] == [('on1', 1), ('on0', 0)]
+    assert worker._claim('w1', 1, 1, 60, None, home=1) == []
+
+    acks = worker.AckBuffer('w1', size=10, interval=60)
+    now = int(time.time())
+    for job in jobs:
+        acks.add(job, 0, '', Outcome(job['id'], 'completed', now))
+    assert len(acks.flush()) == 2
+    for shard in (0, 1):
+        with shards.using(shard):
+            assert storage.fetch_one("SELECT state FROM jobs")['state'] == 'completed'
+
+def test_settings_and_job_commands_reach_every_shard(db, capsys):
+    shards.configure(2, by='id')
+    config.set_config('backoff_base', '3')
+    limits.set_limit('tag:gpu', max_inflight=1)
+    for _ in shards.each():
+        assert config.get_config('backoff_base') == '3'
+        assert json.loads(config.get_config(storage.LIMIT_PREFIX + 'tag:gpu')) == {'max_inflight': 1}
+
+    for i in range(6):
+        _enqueue(id=f'j{i}', max_retries=0)
+    where = shards.locate([f'j{i}' for i in range(6)])
+    assert set(where.values()) == {0, 1}
+    queue_manager.cancel_job('j5')
+    with shards.using(where['j5']):
+        assert storage.fetch_one("SELECT state FROM jobs WHERE id='j5'")['state'] == 'cancelled'
+
+    # fail one job on each shard into its DLQ, then retry both by id
+    failed = [next(i for i, s in where.items() if s == shard and i != 'j5') for shard in (0, 1)]
+    for job_id in failed:
+        with shards.using(where[job_id]):
+            storage.atomic_claim_jobs('w', 10)
+            storage.apply_outcomes([Outcome(job_id, 'dlq', int(time.time()), command='true', attempts=1, last_error='boom')], 'w')
+    assert shards.state_counts()['dlq'] == 2
+    for job_id in failed:
+        queue_manager.retry_dlq_job(job_id)
+    assert shards.state_counts()['dlq'] == 0
+    assert {r['id'] for r in queue_manager.iter_rows('jobs', state='pending')} >= set(failed)
+
+def test_layout_cant_change_under_running_workers(db, tmp_path, monkeypatch):
+    import os
+    from src import worker
+
+    pidfile = tmp_path / 'queuectl_master.pid'
+    monkeypatch.setattr(worker, 'PID_FILE', pidfile)
+    pidfile.write_text(str(os.getpid()))
+    with pytest.raises(ValueError, match='workers are running'):
+        shards.configure(2)
+    assert shards.count() == 1
+    pidfile.unlink()
+    shards.configure(2)
+    assert shards.count() == 2
@@ -0,0 +1,244 @@
+import threading
+
+import pytest
+
+from src import storage
+
+def test_connections_are_pooled_per_thread(db):
+    conn = db.get_conn()
+    assert db.get_conn() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(db.get_conn()))
+    t.start()
+    t.join()
+    assert other[0] is not conn
+
+def test_transaction_rolls_back_on_error(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO meta(key,value) VALUES('k','v')")
+            raise RuntimeError("boom")
+    assert db.fetch_one("SELECT value FROM meta WHERE key='k'") is None
+
+def _enqueue(db, job_id, created_at, next_attempt=0):
+    db.execute("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+               "VALUES(?,?,?,?,?,?,?,?,?)", (job_id, 'true', 'pending', 0, 3, created_at, created_at, next_attempt, 60))
+
+def test_atomic_claim_jobs_claims_due_jobs_in_order(db):
+    _enqueue(db, 'b', '2024-01-02')
+    _enqueue(db, 'a', '2024-01-01')
+    _enqueue(db, 'later', '2024-01-00', next_attempt=2**40)
+    _enqueue(db, 'c', '2024-01-03')
+
+    rows = db.atomic_claim_jobs('w1', 2)
+    assert [r['id'] for r in rows] == ['a', 'b']
+    assert all(r['state'] == 'processing' and r['attempts'] == 1 and r['claimed_by'] == 'w1' for r in rows)
+    assert [r['id'] for r in db.atomic_claim_jobs('w2', 5)] == ['c']
+    assert db.atomic_claim_job('w3') is None
+
+def test_release_jobs_returns_unstarted_claims(db):
+    _enqueue(db, 'a', '2024-01-01')
+    db.atomic_claim_jobs('w1', 1)
+    db.release_jobs('other', ['a'])
+    assert db.fetch_one("SELECT state FROM jobs WHERE id='a'")['state'] == 'processing'
+    db.release_jobs('w1', ['a'])
+    row = db.fetch_one("SELECT * FROM jobs WHERE id='a'")
+    assert (row['state'], row['attempts'], row['claimed_by']) == ('pending', 0, None)
+
+def test_schema_migrations_upgrade_existing_db(tmp_path, monkeypatch):
+    import sqlite3
+    path = tmp_path / 'old.db'
+    conn = sqlite3.connect(str(path))
+    conn.executescript(storage._SCHEMA_SQL.read_text())
+    conn.close()
+
+    monkeypatch.setattr(storage, 'DB_PATH', path)
+    storage.init_db()
+    try:
+        assert storage.schema_version() == storage.SCHEMA_VERSION
+        cols = {r['name'] for r in storage.fetch_all("PRAGMA table_info(jobs)")}
+        assert 'claimed_by' in cols
+        indexes = {r['name'] for r in storage.fetch_all("PRAGMA index_list(jobs)")}
+        assert 'idx_jobs_claim' in indexes
+    finally:
+        storage.close_pool()
+
+def test_claim_path_never_scans_the_table(db):
+    # a populated table with a completed backlog, analyzed so the planner uses real statistics
+    db.execute_many("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+                    "VALUES(?,?,?,?,?,?,?,?,?)",
+                    [(f'j{i}', 'true', 'pending' if i % 4 == 0 else 'completed', 0, 3, str(i), str(i), i % 3, 60)
+                     for i in range(2000)])
+    db.execute("ANALYZE")
+    plan = [r['detail'] for r in db.fetch_all("EXPLAIN QUERY PLAN " + db.CLAIM_SQL, (0, 'w', 0, 0, 1))]
+    assert any('idx_jobs_claim' in d for d in plan)
+    # "SCAN jobs" alone is a full table scan; scanning a (partial, covering) index is fine
+    assert not any(d.startswith('SCAN') and 'INDEX' not in d for d in plan), plan
+    # priority order comes from the index, not a sort
+    assert not any('TEMP B-TREE' in d for d in plan), plan
+
+def test_next_due_ts_tracks_earliest_pending_job(db):
+    assert db.next_due_ts() is None
+    _enqueue(db, 'a', '2024-01-01', next_attempt=500)
+    _enqueue(db, 'b', '2024-01-02', next_attempt=200)
+    assert db.next_due_ts() == 200
+
+def test_requeue_owner_jobs_spares_prefetched_claims(db):
+    for i in range(4):
+        db.execute("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+                   "VALUES(?,?,?,?,?,?,?,?,?)", (f'j{i}', 'true', 'pending', 0, 1, f'2024-01-0{i}', 'x', 0, 60))
+    rows = db.atomic_claim_jobs('w1', 4, start=1)
+    assert [r['id'] for r in rows] == ['j0', 'j1', 'j2', 'j3']
+
+    # only j0 was running: it used its last attempt; the prefetched ones get theirs back
+    assert db.requeue_owner_jobs('w1') == (3, 1)
+    assert db.fetch_one("SELECT id FROM dlq")['id'] == 'j0'
+    left = db.fetch_all("SELECT state, attempts, started_at FROM jobs")
+    assert [tuple(r) for r in left] == [('pending', 0, None)] * 3
+
+def test_lent_connections_are_reused_across_threads(db):
+    seen = []
+
+    def request():
+        with db.lend_conn() as conn:
+            assert db.get_conn() is conn
+            seen.append(conn)
+
+    for _ in range(3):
+        t = threading.Thread(target=request)
+        t.start()
+        t.join()
+    assert seen[0] is seen[1] is seen[2]
+    assert seen[0] is not db.get_conn()
+
+def test_expired_leases_are_reaped_and_live_ones_renewed(db):
+    for i in range(3):
+        _enqueue(db, f'j{i}', f'2024-01-0{i}')
+    db.atomic_claim_jobs('dead', 2, start=1, lease_seconds=30)
+    db.atomic_claim_jobs('alive', 1, lease_seconds=30)
+    db.execute("UPDATE jobs SET lease_expires=1")
+
+    # the live worker's heartbeat gets in first; the dead one's leases stay expired
+    assert db.renew_leases('alive', 30) == 1
+    assert db.reap_expired_leases() == (2, 0)
+    rows = {r['id']: tuple(r) for r in db.fetch_all("SELECT id, state, attempts, claimed_by, lease_expires FROM jobs")}
+    # j0 was running and keeps its attempt; j1 was only prefetched and gets it back
+    assert rows['j0'] == ('j0', 'pending', 1, None, None)
+    assert rows['j1'] == ('j1', 'pending', 0, None, None)
+    assert rows['j2'][1:4] == ('processing', 1, 'alive')
+
+def test_apply_outcomes_ignores_results_for_reaped_jobs(db):
+    import time
+    from src.models import Outcome
+
+    _enqueue(db, 'a', '2024-01-01')
+    db.atomic_claim_jobs('w1', 1)
+    db.execute("UPDATE jobs SET lease_expires=1")
+    db.reap_expired_leases()
+    db.atomic_claim_jobs('w2', 1)
+
+    # the first worker finishes late: its result must not complete w2's claim
+    db.apply_outcomes([Outcome('a', 'completed', int(time.time()))], 'w1')
+    assert tuple(db.fetch_one("SELECT state, claimed_by FROM jobs")) == ('processing', 'w2')
+
+def test_retries_back_off_outside_the_claim_index(db):
+    import time
+    from src.models import Outcome
+
+    _enqueue(db, 'a', '2024-01-01')
+    db.atomic_claim_jobs('w1', 1)
+    now = int(time.time())
+    db.apply_outcomes([Outcome('a', 'retry', now, attempts=1, next_attempt_ts=now + 60)], 'w1')
+    assert db.fetch_one("SELECT state FROM jobs WHERE id='a'")['state'] == 'scheduled'
+    assert db.atomic_claim_jobs('w1', 1) == [] and db.next_due_ts() == now + 60
+    db.execute("UPDATE jobs SET next_attempt=? WHERE id='a'", (now - 1,))
+    assert [r['id'] for r in db.atomic_claim_jobs('w1', 1)] == ['a']
+
+def _enqueue_in(db, job_id, queue, priority, created_at):
+    db.execute("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout,"
+               "priority,queue) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+               (job_id, 'true', 'pending', 0, 3, created_at, created_at, 0, 60, priority, queue))
+
+def test_claims_take_priority_then_age_and_respect_queue_order(db):
+    _enqueue_in(db, 'old', 'bulk', 0, '2024-01-01')
+    _enqueue_in(db, 'urgent', 'bulk', 5, '2024-01-03')
+    _enqueue_in(db, 'web1', 'web', 0, '2024-01-02')
+    _enqueue_in(db, 'web2', 'web', 0, '2024-01-04')
+
+    assert [r['id'] for r in db.atomic_claim_jobs('w1', 2)] == ['urgent', 'old']
+    db.execute("UPDATE jobs SET state='pending' WHERE id IN ('urgent','old')")
+    # queues are tried in order; the second fills what the first can't
+    assert [r['id'] for r in db.atomic_claim_jobs('w1', 3, queues=['web', 'bulk'])] == ['web1', 'web2', 'urgent']
+
+def test_queue_claim_seeks_its_index(db):
+    db.execute_many("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout,"
+                    "priority,queue) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+                    [(f'j{i}', 'true', 'pending', 0, 3, str(i), str(i), 0, 60, i % 3, f'q{i % 5}') for i in range(2000)])
+    db.execute("ANALYZE")
+    plan = [r['detail'] for r in db.fetch_all("EXPLAIN QUERY PLAN " + db.CLAIM_QUEUE_SQL, (0, 'w', 0, 'q1', 0, 1))]
+    assert any('idx_jobs_queue_claim (queue=?)' in d for d in plan), plan
+    assert not any('TEMP B-TREE' in d for d in plan), plan
+
+def _true_counts(db):
+    counts = {r['state']: r['c'] for r in db.fetch_all("SELECT state, COUNT(*) AS c FROM jobs GROUP BY state")}
+    counts['dlq'] = db.fetch_one("SELECT COUNT(*) AS c FROM dlq")['c']
+    return counts
+
+def test_state_counters_follow_every_transition(db):
+    import time
+    from src.models import Outcome
+
+    for i in range(4):
+        _enqueue(db, f'j{i}', f'2024-01-0{i}')
+    db.atomic_claim_jobs('w1', 3)
+    now = int(time.time())
+    db.apply_outcomes([Outcome('j0', 'completed', now), Outcome('j1', 'retry', now, attempts=1, next_attempt_ts=now),
+                       Outcome('j2', 'dlq', now, command='true', attempts=1, last_error='x')], 'w1')
+    # INSERT OR REPLACE over an existing job counts as a delete plus an insert
+    db.execute("INSERT OR REPLACE INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+               "VALUES('j0','true','pending',0,3,'x','x',0,60)")
+    db.execute("DELETE FROM dlq")
+    assert db.state_counts() == _true_counts(db) == {'pending': 3, 'dlq': 0}
+
+def test_recount_repairs_drifted_counters(db):
+    _enqueue(db, 'a', '2024-01-01')
+    db.execute("UPDATE queue_stats SET count=99 WHERE state='pending'")
+    db.recount_stats()
+    assert db.state_counts() == {'pending': 1, 'dlq': 0}
+
+def test_limits_cap_claims_across_workers(db):
+    from src import limits
+    from src.models import Outcome
+    for i in range(6):
+        _enqueue_in(db, f'q{i}', 'slow', 0, f'2024-01-01T00:00:0{i}')
+    _enqueue_in(db, 'other', 'default', 0, '2024-01-01T00:00:09')
+    limits.set_limit('queue:slow', max_inflight=2)
+
+    assert [r['id'] for r in db.atomic_claim_jobs('w1', 10)] == ['q0', 'q1', 'other']
+    # the cap counts every worker's running jobs, and held-back jobs are never claimed
+    assert db.atomic_claim_jobs('w2', 10) == []
+    assert db.throttled_until() is not None
+    assert db.fetch_one("SELECT COUNT(*) AS n FROM jobs WHERE state='pending'")['n'] == 4
+
+    db.apply_outcomes([Outcome('q0', 'completed', 1)], 'w1')
+    assert [r['id'] for r in db.atomic_claim_jobs('w2', 10)] == ['q2']
+
+def test_tag_rate_limit_uses_a_shared_token_bucket(db, monkeypatch):
+    import time
+    from src import limits
+    for i in range(5):
+        _enqueue_in(db, f't{i}', 'a' if i % 2 else 'b', 0, f'2024-01-01T00:00:0{i}')
+    db.execute("UPDATE jobs SET tag='api'")
+    limits.set_limit('tag:api', rate=2, burst=2)
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    assert len(db.atomic_claim_jobs('w1', 10)) == 2
+    assert db.atomic_claim_jobs('w2', 10, queues=['a', 'b']) == []
+    assert db.throttled_until() == 1000.5
+    now[0] += 0.5
+    assert len(db.atomic_claim_jobs('w2', 10)) == 1
+    now[0] += 10
+    # refill stops at the burst
+    assert len(db.atomic_claim_jobs('w1', 10)) == 2
@@ -0,0 +1,98 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from src import config, worker
+
+QUEUECTL = Path(__file__).resolve().parent.parent / 'queuectl.py'
+
+def _cli(cwd, *args):
+    return subprocess.run([sys.executable, str(QUEUECTL), *args], cwd=cwd, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def _start_master(cwd, count):
+    log = open(cwd / 'master.log', 'w')
+    return subprocess.Popen([sys.executable, '-u', str(QUEUECTL), 'worker', 'start', '--count', str(count)],
+                            cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+
+def _job(cwd, job_id):
+    conn = sqlite3.connect(str(cwd / 'queue.db'))
+    conn.row_factory = sqlite3.Row
+    try:
+        return conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+def _wait_until(predicate, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.1)
+    return False
+
+def _stop(master):
+    if master.poll() is None:
+        master.send_signal(signal.SIGINT)
+        master.send_signal(signal.SIGINT)
+        master.wait(timeout=15)
+
+def test_dead_worker_is_restarted_and_drain_honours_deadline(tmp_path):
+    _cli(tmp_path, 'enqueue', '{"id":"long","command":"sleep 30","max_retries":3}')
+    _cli(tmp_path, 'config', 'set', 'drain_timeout', '1')
+    master = _start_master(tmp_path, 1)
+    try:
+        assert _wait_until(lambda: (_job(tmp_path, 'long') or {'started_at': None})['started_at'])
+        first_owner = _job(tmp_path, 'long')['claimed_by']
+        # kill the worker and the job it runs (workers lead their own process group)
+        os.killpg(int(first_owner.rsplit('-', 1)[1]), signal.SIGKILL)
+
+        # the master requeues the running job and a fresh worker picks it up again
+        def reclaimed():
+            job = _job(tmp_path, 'long')
+            return job['state'] == 'processing' and job['claimed_by'] not in (None, first_owner)
+        assert _wait_until(reclaimed)
+        assert _job(tmp_path, 'long')['attempts'] == 2
+
+        # graceful stop: the job runs well past drain_timeout, so the master kills it and requeues
+        start = time.monotonic()
+        master.send_signal(signal.SIGTERM)
+        assert master.wait(timeout=15) == 0
+        assert time.monotonic() - start < 10
+    finally:
+        _stop(master)
+    job = _job(tmp_path, 'long')
+    assert (job['state'], job['claimed_by']) == ('pending', None)
+    assert not (tmp_path / 'queuectl_master.pid').exists()
+
+def test_worker_scale_resizes_running_pool(tmp_path):
+    master = _start_master(tmp_path, 1)
+    log = tmp_path / 'master.log'
+    try:
+        assert _wait_until(lambda: 'Started worker 1' in log.read_text())
+        _cli(tmp_path, 'worker', 'scale', '--count', '3')
+        assert _wait_until(lambda: 'Started worker 3' in log.read_text())
+        _cli(tmp_path, 'worker', 'scale', '--count', '1')
+        assert _wait_until(lambda: '[worker child 3] exiting' in log.read_text()
+                           and '[worker child 2] exiting' in log.read_text())
+        assert '[worker child 1] exiting' not in log.read_text()
+        _cli(tmp_path, 'worker', 'stop')
+        assert master.wait(timeout=15) == 0
+    finally:
+        _stop(master)
+
+def test_invalid_pool_settings_keep_current_values(db, capsys):
+    config.set_config('worker_count', 'lots')
+    config.set_config('drain_timeout', '-5')
+    sup = worker.Supervisor(2)
+    sup._signals.append(signal.SIGHUP)
+    sup._handle_signals()
+    assert sup.desired == 2
+    assert sup._config_number('drain_timeout', float, 30.0) == 30.0
+    assert "ignoring invalid worker_count='lots'" in capsys.readouterr().out
@@ -0,0 +1,214 @@
+import time
+
+from src import notify
+
+def test_wakeup_pokes_are_coalesced_and_not_lost():
+    ch = notify.Wakeup()
+    start = time.monotonic()
+    assert ch.wait(0.05) is False
+    assert time.monotonic() - start >= 0.04
+
+    # pokes that land before the wait are kept, and several count as one
+    ch.poke()
+    ch.poke()
+    assert ch.wait(5) is True
+    assert ch.wait(0) is False
+
+def test_hub_pokes_every_worker_channel():
+    hub = notify.WakeupHub()
+    channels = [hub.channel(i) for i in range(3)]
+    hub.drop(2)
+    hub.notify()
+    assert [ch.wait(0) for ch in channels] == [True, True, False]
+
+def _wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_async_worker_runs_jobs_concurrently(db):
+    import threading
+    from multiprocessing import Event
+    from src import async_worker
+
+    rows = [(f'j{i}', 'sleep 0.3', 'pending', 0, 1, f'2024-01-{i:02d}', 'x', 0, 60) for i in range(8)]
+    rows.append(('bad', 'exit 3', 'pending', 0, 1, '2024-02-01', 'x', 0, 60))
+    db.execute_many("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+                    "VALUES(?,?,?,?,?,?,?,?,?)", rows)
+    event, wakeup = Event(), notify.Wakeup()
+    t = threading.Thread(target=async_worker.async_worker_loop, args=(1, event, wakeup, 16))
+    start = time.monotonic()
+    t.start()
+    try:
+        assert _wait_until(lambda: db.fetch_one("SELECT COUNT(*) AS c FROM dlq")['c'] == 1
+                           and db.fetch_one("SELECT COUNT(*) AS c FROM jobs WHERE state='completed'")['c'] == 8)
+        # eight 0.3s jobs in one process, run side by side
+        assert time.monotonic() - start < 2
+    finally:
+        event.set()
+        wakeup.poke()
+        t.join(timeout=10)
+    assert not t.is_alive()
+
+def _insert(db, rows):
+    db.execute_many("INSERT INTO jobs(id,command,state,attempts,max_retries,created_at,updated_at,next_attempt,timeout) "
+                    "VALUES(?,?,?,?,?,?,?,?,?)", rows)
+
+def test_worker_loop_claims_one_job_by_default(db, monkeypatch):
+    from multiprocessing import Event
+    from src import worker
+
+    _insert(db, [(f'j{i}', 'true', 'pending', 0, 3, f'2024-01-0{i}', 'x', 0, 60) for i in range(3)])
+    event = Event()
+    claims = []
+    real_claim = db.atomic_claim_jobs
+
+    def claim(owner, limit, start=None, lease_seconds=30, queues=None):
+        claims.append(limit)
+        event.set()
+        return real_claim(owner, limit, start, lease_seconds, queues)
+    monkeypatch.setattr(db, 'atomic_claim_jobs', claim)
+
+    worker.worker_loop(1, event)
+    assert claims == [1]
+    assert db.fetch_one("SELECT COUNT(*) AS c FROM jobs WHERE state='pending'")['c'] == 2
+
+def test_worker_loop_releases_prefetched_jobs_on_stop(db, monkeypatch):
+    from multiprocessing import Event
+    from src import worker
+
+    _insert(db, [(f'j{i}', 'true', 'pending', 0, 3, f'2024-01-0{i}', 'x', 0, 60) for i in range(3)])
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('claim_batch','3')")
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('ack_batch','1')")
+    event = Event()
+    real_apply = db.apply_outcomes
+
+    def apply_then_stop(outcomes, owner=None, start_ids=()):
+        # the next prefetched job is marked started together with the first result
+        assert start_ids == ['j1']
+        real_apply(outcomes, owner, start_ids)
+        event.set()
+    monkeypatch.setattr(db, 'apply_outcomes', apply_then_stop)
+
+    worker.worker_loop(1, event)
+    rows = {r['id']: tuple(r) for r in db.fetch_all("SELECT id, state, attempts, claimed_by, started_at FROM jobs")}
+    assert rows['j0'][1] == 'completed'
+    assert rows['j1'][1:] == ('pending', 0, None, None)
+    assert rows['j2'][1:] == ('pending', 0, None, None)
+
+def test_worker_loop_writes_results_behind_in_batches(db, monkeypatch):
+    from multiprocessing import Event
+    from src import worker
+
+    # only j3 is on its last attempt (that result is written at once, see AckBuffer); it is second in its pair
+    _insert(db, [(f'j{i}', 'true' if i != 3 else 'exit 1', 'pending', 0, 3 if i != 3 else 1, f'2024-01-0{i}', 'x', 0, 60)
+                 for i in range(5)])
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('ack_batch','2')")
+    db.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('ack_interval_ms','60000')")
+    event = Event()
+    writes = []
+    real_apply = db.apply_outcomes
+
+    def apply(outcomes, owner=None, start_ids=()):
+        writes.append([o.job_id for o in outcomes])
+        real_apply(outcomes, owner, start_ids)
+        if db.fetch_one("SELECT COUNT(*) AS c FROM jobs WHERE state='pending'")['c'] == 0:
+            event.set()
+    monkeypatch.setattr(db, 'apply_outcomes', apply)
+
+    worker.worker_loop(1, event)
+    # two results per transaction; the DLQ move rides in the same one as a completion
+    assert writes == [['j0', 'j1'], ['j2', 'j3'], ['j4']]
+    assert db.fetch_one("SELECT COUNT(*) AS c FROM jobs WHERE state='completed'")['c'] == 4
+    assert db.fetch_one("SELECT id FROM dlq")['id'] == 'j3'
+
+def test_unwritten_results_are_reaped_like_a_dead_worker(db):
+    from src import worker
+    from src.models import Outcome
+
+    _insert(db, [('a', 'true', 'pending', 0, 3, '2024-01-01', 'x', 0, 60)])
+    db.atomic_claim_jobs('w1', 1, lease_seconds=1)
+    acks = worker.AckBuffer('w1', size=10, interval=60)
+    acks.add({'id': 'a', 'attempts': 1, 'max_retries': 3}, 0, '', Outcome('a', 'completed', int(time.time())))
+    assert not acks.due()
+    # the worker dies here; its lease runs out and the job goes back to the queue
+    db.execute("UPDATE jobs SET lease_expires=0")
+    db.reap_expired_leases()
+    db.atomic_claim_jobs('w2', 1)
+    # a late write from the old owner is fenced out
+    assert [e[0]['id'] for e in acks.flush()] == ['a']
+    assert tuple(db.fetch_one("SELECT state, claimed_by FROM jobs")) == ('processing', 'w2')
+
+def _run_async_worker(concurrency, until, wakeup=None):
+    import threading
+    from multiprocessing import Event
+    from src import async_worker
+
+    event, wakeup = Event(), wakeup or notify.Wakeup()
+    t = threading.Thread(target=async_worker.async_worker_loop, args=(1, event, wakeup, concurrency))
+    t.start()
+    try:
+        assert _wait_until(until)
+    finally:
+        event.set()
+        wakeup.poke()
+        t.join(timeout=10)
+    assert not t.is_alive()
+
+def test_async_worker_stops_claiming_after_an_empty_claim(db, monkeypatch):
+    _insert(db, [('long', 'sleep 1', 'pending', 0, 3, '2024-01-01', 'x', 0, 60)])
+    claims = []
+    real_claim = db.atomic_claim_jobs
+    monkeypatch.setattr(db, 'atomic_claim_jobs', lambda *a: claims.append(a) or real_claim(*a))
+
+    _run_async_worker(50, lambda: db.fetch_one("SELECT state FROM jobs WHERE id='long'")['state'] == 'completed')
+    # one claim got the job, one came back empty; no polling while the job ran
+    assert len(claims) == 2
+
+def test_async_worker_turns_spawn_errors_into_failed_attempts(db, monkeypatch):
+    from src import async_worker
+
+    _insert(db, [('ok', 'true', 'pending', 0, 3, '2024-01-01', 'x', 0, 60),
+                 ('boom', 'emfile', 'pending', 0, 1, '2024-01-02', 'x', 0, 60)])
+    real_run = async_worker._run_command
+
+    async def run(command, timeout, log):
+        if command == 'emfile':
+            raise OSError(24, 'Too many open files')
+        return await real_run(command, timeout, log)
+    monkeypatch.setattr(async_worker, '_run_command', run)
+
+    _run_async_worker(4, lambda: db.fetch_one("SELECT COUNT(*) AS c FROM dlq")['c'] == 1
+                      and db.fetch_one("SELECT state FROM jobs WHERE id='ok'")['state'] == 'completed')
+    assert 'Too many open files' in db.fetch_one("SELECT last_error FROM dlq WHERE id='boom'")['last_error']
+
+def test_heartbeat_renews_leases_while_a_job_runs(db):
+    from src import worker
+
+    _insert(db, [('a', 'true', 'pending', 0, 3, '2024-01-01', 'x', 0, 60)])
+    db.atomic_claim_jobs('w1', 1, lease_seconds=1)
+    first = db.fetch_one("SELECT lease_expires FROM jobs")['lease_expires']
+    beat = worker._Heartbeat('w1', 3)
+    beat.start()
+    try:
+        assert _wait_until(lambda: db.fetch_one("SELECT lease_expires FROM jobs")['lease_expires'] > first + 1)
+    finally:
+        beat.stop()
+
+def test_a_final_attempts_result_is_written_at_once(db):
+    from src import worker
+    from src.models import Outcome
+
+    _insert(db, [('a', 'true', 'pending', 0, 1, '2024-01-01', 'x', 0, 60)])
+    job = dict(db.atomic_claim_jobs('w1', 1)[0])
+    acks = worker.AckBuffer('w1', size=10, interval=60)
+    # were this buffered and the worker died, recovery would move a job that ran fine to the DLQ
+    acks.add(job, 0, '', Outcome('a', 'completed', int(time.time())))
+    assert acks.due()
+    acks.flush()
+    assert not acks.due()
+    db.reap_expired_leases()
+    assert db.fetch_one("SELECT state FROM jobs")['state'] == 'completed'